@@ -0,0 +1,78 @@
+"""Compare two load test reports from benchmarks.load.
+
+Prints per-scenario changes in latency percentiles, throughput and
+errors as JSON, and exits with status 1 when any scenario's p95 or p99
+latency got worse by more than --threshold percent, or its throughput
+dropped by more than that.
+
+    python -m benchmarks.compare before.json after.json --threshold 10
+"""
+import argparse
+import json
+import sys
+from typing import Dict, List, Tuple
+
+
+def percent_change(before: float, after: float) -> float:
+    return round((after - before) / before * 100, 1) if before else 0.0
+
+
+def compare(before: Dict, after: Dict, threshold: float) -> Tuple[Dict, List[str]]:
+    """Per-scenario deltas and the list of regressions beyond threshold"""
+    changes, regressions = {}, []
+    for name, new in after['scenarios'].items():
+        old = before['scenarios'].get(name)
+        if old is None:
+            continue
+
+        scenario = {
+            f'{metric}_ms': {
+                'before': old['latency_ms'][metric],
+                'after': new['latency_ms'][metric],
+                'change_percent': percent_change(old['latency_ms'][metric], new['latency_ms'][metric])
+            }
+            for metric in ('p50', 'p95', 'p99')
+        }
+        scenario['throughput_rps'] = {
+            'before': old['throughput_rps'],
+            'after': new['throughput_rps'],
+            'change_percent': percent_change(old['throughput_rps'], new['throughput_rps'])
+        }
+        scenario['errors'] = {'before': old['errors'], 'after': new['errors']}
+        changes[name] = scenario
+
+        for metric in ('p95_ms', 'p99_ms'):
+            if scenario[metric]['change_percent'] > threshold:
+                regressions.append(f"{name} {metric} +{scenario[metric]['change_percent']}%")
+        if scenario['throughput_rps']['change_percent'] < -threshold:
+            regressions.append(f"{name} throughput {scenario['throughput_rps']['change_percent']}%")
+
+    return changes, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('before')
+    parser.add_argument('after')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='Allowed slowdown in percent before failing')
+    args = parser.parse_args()
+
+    with open(args.before, encoding='utf-8') as file:
+        before = json.load(file)
+    with open(args.after, encoding='utf-8') as file:
+        after = json.load(file)
+
+    changes, regressions = compare(before, after, args.threshold)
+    print(json.dumps({
+        'before': before.get('revision'),
+        'after': after.get('revision'),
+        'scenarios': changes,
+        'peak_rss_mb': {'before': before.get('peak_rss_mb'), 'after': after.get('peak_rss_mb')},
+        'regressions': regressions
+    }, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
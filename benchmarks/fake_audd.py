@@ -0,0 +1,126 @@
+"""Local stand-in for the AudD.io recognition API.
+
+Answers ``POST /recognize`` like AudD.io after a configurable delay.
+A share of requests fail with a 5xx, and of the rest a share are
+"recognized" as one of a known list of songs. Point the recognition
+service at it with ``AUDD_API_URL``.
+
+    python -m benchmarks.fake_audd --port 8900 --latency 0.2 --error-rate 0.05
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Sequence, Tuple
+
+
+class FakeAudd:
+    """Threaded HTTP server imitating AudD.io.
+
+    Args:
+        songs: (title, artist) pairs returned as recognition results
+        latency: Mean response delay in seconds
+        jitter: Delay varies uniformly by up to this many seconds either way
+        error_rate: Share of requests answered with HTTP 503
+        hit_rate: Share of successful requests that return a song
+        host: Interface to listen on
+        port: Port to listen on (0 picks a free one)
+    """
+
+    def __init__(self, songs: Sequence[Tuple[str, str]] = (), latency: float = 0.1,
+                 jitter: float = 0.0, error_rate: float = 0.0, hit_rate: float = 1.0,
+                 host: str = '127.0.0.1', port: int = 0):
+        self.songs: List[Tuple[str, str]] = list(songs)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hit_rate = hit_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> 'FakeAudd':
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def respond(self) -> Tuple[int, dict]:
+        """Status and body for one request, after the simulated delay"""
+        with self._lock:
+            self.requests += 1
+        time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+        if random.random() < self.error_rate:
+            return 503, {'status': 'error', 'error': {'error_message': 'Simulated failure'}}
+        if not self.songs or random.random() >= self.hit_rate:
+            return 200, {'status': 'success', 'result': None}
+
+        title, artist = random.choice(self.songs)
+        return 200, {'status': 'success', 'result': {
+            'title': title,
+            'artist': artist,
+            'album': 'Synthetic'
+        }}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+            def do_POST(self):
+                # Drain the upload so the client is not cut off mid-send
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.split('?', 1)[0].rstrip('/') != '/recognize':
+                    status, body = 404, {'status': 'error'}
+                else:
+                    status, body = fake.respond()
+
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.1)
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--hit-rate', type=float, default=0.0,
+                        help='Share of requests recognized (as "Fake Title - Fake Artist")')
+    args = parser.parse_args()
+
+    fake = FakeAudd([('Fake Title', 'Fake Artist')], args.latency, args.jitter,
+                    args.error_rate, args.hit_rate, args.host, args.port)
+    print(f"Fake AudD.io listening on {fake.url}")
+    fake.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,302 @@
+"""End-to-end load test of the gateway against a synthetic catalogue.
+
+Generates a catalogue of synthetic WAV tracks, bulk imports it into a
+fresh database, starts a local AudD.io stand-in and drives the real
+``gateway.application`` (rate limiting included) from a pool of client
+threads. Prints latency percentiles, throughput and peak RSS per
+scenario as JSON, so runs on different commits can be compared with
+``python -m benchmarks.compare``.
+
+    python -m benchmarks.load --tracks 500 --concurrency 16 --requests 2000 \\
+        --audd-latency 0.2 --audd-error-rate 0.02 --output after.json
+
+Scenarios (``--scenarios``, run in this order):
+    list       GET  /catalogue/tracks/?limit=100
+    search     GET  /catalogue/tracks/search?title=...
+    recognize  POST /recognition/api/recognize with catalogue fragments,
+               plus --unknown-rate fragments that fall through to AudD.io
+    add        POST /catalogue/tracks with new tracks
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, Dict, List, NamedTuple
+
+import numpy as np
+
+from benchmarks.fake_audd import FakeAudd
+from benchmarks.synthetic import (
+    SyntheticTrack,
+    generate_catalogue,
+    render_samples,
+    to_wav,
+    track_metadata
+)
+
+SCENARIOS = ('list', 'search', 'recognize', 'add')
+UNLIMITED = '1000000000 per day'
+
+
+class Call(NamedTuple):
+    """One request to replay: method, path and werkzeug Client kwargs"""
+    method: str
+    path: str
+    build: Callable[[], Dict]
+
+
+# --------------------------
+# Environment
+# --------------------------
+
+def configure_environment(workdir: str, audd_url: str, args):
+    """Point every service at scratch storage and the fake AudD.io.
+
+    Must run before the gateway is imported, since module-level settings
+    are read from the environment at import time.
+    """
+    os.environ.update({
+        'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'catalogue.db')}",
+        'AUDIO_STORAGE_PATH': os.path.join(workdir, 'audio'),
+        'AUDD_API_URL': audd_url,
+        'AUDD_API_KEY': 'benchmark',
+        'RECOGNITION_JOB_DIR': os.path.join(workdir, 'jobs'),
+        'RECOGNITION_CACHE_SIZE': str(args.cache_size),
+        'RATELIMIT_STORAGE_URI': args.ratelimit_storage or
+            f"sqlite:///{os.path.join(workdir, 'ratelimit.db')}",
+        # Every request comes from one address; keep the limiter's cost
+        # but never its 429s
+        'RATELIMIT_DEFAULT': UNLIMITED,
+        'RATELIMIT_RECOGNIZE': UNLIMITED,
+        'RATELIMIT_POLL': UNLIMITED
+    })
+
+
+def seed_catalogue(application, catalogue: List[SyntheticTrack], workers: int) -> Dict:
+    """Bulk import the synthetic tracks through the catalogue app"""
+    from gateway import mounted_apps
+    from services.catalogue.bulk import ImportItem, import_tracks
+
+    catalogue_app = mounted_apps(application)['/catalogue']
+    items = [ImportItem(track.path, track.title, track.artist) for track in catalogue]
+    with catalogue_app.app_context():
+        report = import_tracks(items, workers=workers)
+    stats = report.to_dict()
+    stats.pop('errors')
+    return stats
+
+
+# --------------------------
+# Workloads
+# --------------------------
+
+def multipart(fields: Dict, audio: bytes, filename: str) -> Callable[[], Dict]:
+    """Client kwargs for a multipart upload with a fresh file object per call"""
+    return lambda: {'data': {**fields, 'audio_file': (BytesIO(audio), filename)}}
+
+
+def build_calls(scenario: str, count: int, catalogue: List[SyntheticTrack],
+                args, rng: random.Random) -> List[Call]:
+    """Pre-render every request of a scenario so generation is not timed"""
+    if scenario == 'list':
+        return [Call('GET', '/catalogue/tracks/?limit=100', dict)] * count
+
+    if scenario == 'search':
+        return [
+            Call('GET', '/catalogue/tracks/search', lambda title=rng.choice(catalogue).title: {
+                'query_string': {'title': title}
+            })
+            for _ in range(count)
+        ]
+
+    if scenario == 'recognize':
+        calls = []
+        rendered = {}
+        for i in range(count):
+            unknown = rng.random() < args.unknown_rate
+            # Seeds past the catalogue have no fingerprints, so AudD.io is asked
+            seed = len(catalogue) + i if unknown else rng.choice(catalogue).seed
+            if seed not in rendered:
+                rendered[seed] = render_samples(args.track_seconds, seed)
+            samples = rendered[seed]
+            length = int(args.fragment_seconds * args.rate)
+            start = rng.randrange(0, max(1, len(samples) - length))
+            # Random offsets make most fragments distinct, so the cache
+            # only helps as much as it would with real clients
+            audio = to_wav(samples[start:start + length], args.rate)
+            calls.append(Call('POST', '/recognition/api/recognize', multipart({}, audio, 'fragment.wav')))
+        return calls
+
+    if scenario == 'add':
+        calls = []
+        for i in range(count):
+            seed = 10 ** 6 + i
+            title, artist = track_metadata(seed)
+            audio = to_wav(render_samples(args.track_seconds, seed), args.rate)
+            calls.append(Call('POST', '/catalogue/tracks', multipart(
+                {'title': title, 'artist': artist}, audio, f"{seed}.wav"
+            )))
+        return calls
+
+    raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def run_scenario(application, calls: List[Call], concurrency: int, warmup: int,
+                 accept_encoding: str = '') -> Dict:
+    """Replay calls from concurrency threads, each with its own client"""
+    from werkzeug.test import Client
+
+    local = threading.local()
+    # The test client sets no REMOTE_ADDR, which would leave the limiter
+    # without a key and skip it
+    environ = {'REMOTE_ADDR': '127.0.0.1', 'HTTP_ACCEPT_ENCODING': accept_encoding}
+
+    def send(call: Call):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = Client(application)
+        start = time.perf_counter()
+        response = client.open(call.path, method=call.method, environ_base=environ, **call.build())
+        response.close()
+        return time.perf_counter() - start, response.status_code
+
+    for call in calls[:warmup]:
+        send(call)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, calls[warmup:]))
+    elapsed = time.perf_counter() - started
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    statuses = Counter(status for _, status in results)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'requests': len(results),
+        'errors': sum(count for status, count in statuses.items() if status >= 500),
+        'status_counts': {str(status): count for status, count in sorted(statuses.items())},
+        'elapsed_seconds': round(elapsed, 3),
+        'throughput_rps': round(len(results) / elapsed, 1),
+        'latency_ms': {
+            'p50': round(p50, 2),
+            'p95': round(p95, 2),
+            'p99': round(p99, 2),
+            'mean': round(latencies.mean(), 2),
+            'max': round(latencies.max(), 2)
+        },
+        'peak_rss_mb': peak_rss_mb()
+    }
+
+
+# --------------------------
+# Report
+# --------------------------
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (2 ** 20 if sys.platform == 'darwin' else 2 ** 10), 1)
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='\n'.join(__doc__.splitlines()[1:])
+    )
+    parser.add_argument('--tracks', type=int, default=200, help='Catalogue size')
+    parser.add_argument('--track-seconds', type=float, default=30.0)
+    parser.add_argument('--fragment-seconds', type=float, default=5.0)
+    parser.add_argument('--rate', type=int, default=22050, help='Sample rate of generated audio')
+    parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+    parser.add_argument('--requests', type=int, default=500, help='Requests per scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per scenario')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--unknown-rate', type=float, default=0.2,
+                        help='Share of recognition fragments not in the catalogue')
+    parser.add_argument('--audd-latency', type=float, default=0.1)
+    parser.add_argument('--audd-jitter', type=float, default=0.02)
+    parser.add_argument('--audd-error-rate', type=float, default=0.0)
+    parser.add_argument('--audd-hit-rate', type=float, default=0.5,
+                        help='Share of AudD.io answers naming a catalogue track')
+    parser.add_argument('--accept-encoding', default='',
+                        help='Accept-Encoding sent by clients, e.g. "gzip" (default: none)')
+    parser.add_argument('--cache-size', type=int, default=1024, help='RECOGNITION_CACHE_SIZE')
+    parser.add_argument('--ratelimit-storage', help='RATELIMIT_STORAGE_URI (default: scratch SQLite file)')
+    parser.add_argument('--import-workers', type=int, default=None,
+                        help='Processes used to seed the catalogue (0 runs inline)')
+    parser.add_argument('--library', help='Reuse generated WAV files from this directory')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for request mixes')
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory(prefix='shamzam-load-') as workdir:
+        library = args.library or os.path.join(workdir, 'library')
+        catalogue = generate_catalogue(library, args.tracks, args.track_seconds, args.rate)
+
+        fake_audd = FakeAudd(
+            songs=[(track.title, track.artist) for track in catalogue],
+            latency=args.audd_latency,
+            jitter=args.audd_jitter,
+            error_rate=args.audd_error_rate,
+            hit_rate=args.audd_hit_rate
+        ).start()
+        try:
+            configure_environment(workdir, fake_audd.url, args)
+            from gateway import application
+
+            report = {
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpus': os.cpu_count(),
+                'config': vars(args),
+                'seed_import': seed_catalogue(application, catalogue, args.import_workers),
+                'scenarios': {}
+            }
+            for scenario in scenarios:
+                calls = build_calls(scenario, args.requests + args.warmup, catalogue, args, rng)
+                report['scenarios'][scenario] = run_scenario(
+                    application, calls, args.concurrency, args.warmup, args.accept_encoding
+                )
+            report['audd_requests'] = fake_audd.requests
+            report['peak_rss_mb'] = peak_rss_mb()
+        finally:
+            fake_audd.stop()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
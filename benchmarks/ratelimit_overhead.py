@@ -0,0 +1,72 @@
+"""Per-request overhead of the gateway rate limiter.
+
+Times a trivial Flask route with no limiter, with in-memory storage and
+with the shared SQLite storage (batched, and syncing on every hit), and
+prints the mean cost per request in microseconds as JSON.
+
+    python -m benchmarks.ratelimit_overhead --requests 20000
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from flask import Flask
+from flask_limiter import Limiter
+
+import shared.ratelimit  # noqa: F401  (registers the sqlite:// scheme)
+
+
+def build_app(storage_uri=None, storage_options=None):
+    app = Flask(__name__)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    if storage_uri:
+        Limiter(
+            key_func=lambda: 'client',
+            default_limits=['1000000 per hour'],
+            storage_uri=storage_uri,
+            storage_options=storage_options or {}
+        ).init_app(app)
+    return app
+
+
+def time_requests(app, requests):
+    client = app.test_client()
+    for _ in range(min(requests, 100)):
+        client.get('/ping')
+    start = time.perf_counter()
+    for _ in range(requests):
+        client.get('/ping')
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=10000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        sqlite_uri = f"sqlite:///{os.path.join(workdir, 'ratelimit.db')}"
+        modes = {
+            'none': build_app(),
+            'memory': build_app('memory://'),
+            'sqlite_batched': build_app(sqlite_uri),
+            'sqlite_every_hit': build_app(sqlite_uri, {'flush_every': 1}),
+        }
+        results = {mode: time_requests(app, args.requests) for mode, app in modes.items()}
+
+    baseline = results['none']
+    print(json.dumps({
+        'requests': args.requests,
+        'us_per_request': {mode: round(us, 1) for mode, us in results.items()},
+        'overhead_us': {mode: round(us - baseline, 1) for mode, us in results.items() if mode != 'none'}
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Payload size and CPU cost of the catalogue's wire formats.
+
+Encodes representative payloads (a list page, fingerprint match
+requests and a track with inline audio) as JSON, pretty-printed JSON
+and MessagePack, each uncompressed, gzipped and zstd-compressed, and
+prints bytes plus encode/decode microseconds as JSON. MessagePack and
+zstd rows appear only when those packages are installed.
+
+    python -m benchmarks.serialization --iterations 200
+"""
+import argparse
+import base64
+import gzip
+import json
+import time
+from io import BytesIO
+from typing import Callable, Dict, Tuple
+
+from benchmarks.synthetic import render_samples, to_wav
+from shared.compression import zstandard
+from shared.fingerprint import fingerprint_audio
+from shared.serialization import msgpack_available, packb, unpackb
+
+
+def payloads() -> Dict[str, Dict]:
+    """Envelopes shaped like real catalogue traffic"""
+    tracks = [
+        {
+            'id': f"{i:064x}",
+            'title': f"Synthetic Title {i}",
+            'artist': f"Synthetic Artist {i % 97}",
+            'audio_url': f"/catalogue/tracks/{i:064x}/audio"
+        }
+        for i in range(100)
+    ]
+    fragment = BytesIO(to_wav(render_samples(5.0, seed=1)))
+    hashes = [list(pair) for pair in fingerprint_audio(fragment)]
+    audio = to_wav(render_samples(10.0, seed=2))
+    return {
+        'list_page': {'status': 200, 'message': 'Tracks retrieved', 'data': tracks},
+        'match_request': {'hashes': hashes},
+        'match_batch_request': {'fragments': [hashes] * 20},
+        'track_inline_audio': {'status': 200, 'message': 'Track details retrieved', 'data': {
+            **tracks[0], 'audio_file': base64.b64encode(audio).decode('utf-8')
+        }},
+        # What MessagePack could carry instead: the raw bytes, no base64
+        'track_raw_audio': {'status': 200, 'message': 'Track details retrieved', 'data': {
+            **tracks[0], 'audio_file': audio
+        }}
+    }
+
+
+def serializers() -> Dict[str, Tuple[Callable, Callable]]:
+    formats = {
+        'json': (lambda obj: json.dumps(obj, separators=(',', ':')).encode(), json.loads),
+        'json_pretty': (lambda obj: json.dumps(obj, indent=2).encode(), json.loads),
+    }
+    if msgpack_available():
+        formats['msgpack'] = (packb, unpackb)
+    return formats
+
+
+def compressors() -> Dict[str, Tuple[Callable, Callable]]:
+    codecs = {
+        'identity': (lambda data: data, lambda data: data),
+        'gzip': (lambda data: gzip.compress(data, compresslevel=6, mtime=0), gzip.decompress),
+    }
+    if zstandard is not None:
+        codecs['zstd'] = (
+            zstandard.ZstdCompressor(level=3).compress,
+            zstandard.ZstdDecompressor().decompress
+        )
+    return codecs
+
+
+def measure(payload, encode, decode, compress, decompress, iterations: int) -> Dict:
+    wire = compress(encode(payload))
+    start = time.perf_counter()
+    for _ in range(iterations):
+        compress(encode(payload))
+    encoded = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(decompress(wire))
+    decoded = time.perf_counter() - start
+
+    return {
+        'bytes': len(wire),
+        'encode_us': round(encoded / iterations * 1e6, 1),
+        'decode_us': round(decoded / iterations * 1e6, 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=100)
+    args = parser.parse_args()
+
+    results = {}
+    for name, payload in payloads().items():
+        results[name] = {}
+        for format_name, (encode, decode) in serializers().items():
+            if name == 'track_raw_audio' and format_name != 'msgpack':
+                continue  # JSON cannot carry raw bytes
+            for codec, (compress, decompress) in compressors().items():
+                results[name][f"{format_name}+{codec}"] = measure(
+                    payload, encode, decode, compress, decompress, args.iterations
+                )
+        if not results[name]:
+            del results[name]
+
+    print(json.dumps({
+        'iterations': args.iterations,
+        'msgpack': msgpack_available(),
+        'zstd': zstandard is not None,
+        'payloads': results
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
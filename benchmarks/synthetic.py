@@ -0,0 +1,95 @@
+"""Synthetic WAV catalogues for load tests.
+
+Each track is a reproducible random sequence of tones (seeded by its
+index), so fragments cut from it match the catalogue's fingerprints
+while fragments from unused seeds do not.
+
+    python -m benchmarks.synthetic /tmp/library --tracks 1000 --seconds 30
+"""
+import argparse
+import os
+import wave
+from io import BytesIO
+from typing import List, NamedTuple
+
+import numpy as np
+
+SAMPLE_RATE = 22050
+NOTE_SECONDS = 0.25
+
+
+class SyntheticTrack(NamedTuple):
+    """A generated catalogue entry"""
+    seed: int
+    title: str
+    artist: str
+    path: str
+
+
+def render_samples(seconds: float, seed: int, rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Random sequence of three-tone chords as 16-bit mono samples"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * NOTE_SECONDS)) / rate
+    notes = [
+        sum(np.sin(2 * np.pi * f * t) for f in rng.uniform(200, 4000, size=3))
+        for _ in range(max(1, int(seconds / NOTE_SECONDS)))
+    ]
+    return (np.concatenate(notes) / 3 * 32767).astype('<i2')
+
+
+def to_wav(samples: np.ndarray, rate: int = SAMPLE_RATE) -> bytes:
+    """Encode 16-bit mono samples as WAV bytes"""
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def render_fragment(track_seconds: float, seed: int, start: float, seconds: float,
+                    rate: int = SAMPLE_RATE) -> bytes:
+    """WAV bytes of a slice of the track generated from seed"""
+    samples = render_samples(track_seconds, seed, rate)
+    first = int(start * rate)
+    return to_wav(samples[first:first + int(seconds * rate)], rate)
+
+
+def track_metadata(seed: int):
+    """(title, artist) of the synthetic track with this seed"""
+    return f"Synthetic Title {seed}", f"Synthetic Artist {seed % 97}"
+
+
+def generate_catalogue(directory: str, tracks: int, seconds: float,
+                       rate: int = SAMPLE_RATE) -> List[SyntheticTrack]:
+    """Write tracks as "Artist - Title.wav" files, reusing existing ones.
+
+    The naming matches what the bulk importer reads from a directory.
+    """
+    os.makedirs(directory, exist_ok=True)
+    catalogue = []
+    for seed in range(tracks):
+        title, artist = track_metadata(seed)
+        path = os.path.join(directory, f"{artist} - {title}.wav")
+        if not os.path.exists(path):
+            with open(path, 'wb') as file:
+                file.write(to_wav(render_samples(seconds, seed, rate), rate))
+        catalogue.append(SyntheticTrack(seed, title, artist, path))
+    return catalogue
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--tracks', type=int, default=100)
+    parser.add_argument('--seconds', type=float, default=30.0)
+    parser.add_argument('--rate', type=int, default=SAMPLE_RATE)
+    args = parser.parse_args()
+
+    catalogue = generate_catalogue(args.directory, args.tracks, args.seconds, args.rate)
+    print(f"{len(catalogue)} tracks in {args.directory}")
+
+
+if __name__ == '__main__':
+    main()
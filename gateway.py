@@ -1,56 +1,160 @@
 import os
 from dotenv import load_dotenv
+
+# Before the services are imported: they read configuration at import
+# time, and create_application() below runs when this module is loaded
+# (including gunicorn's preload)
+load_dotenv()
+
 from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from werkzeug.serving import run_simple
 from flask import Flask, request
 from flask_limiter import Limiter
 
-from services.catalogue.app import app as catalogue_app
-from services.recognition.app import app as recognition_app
+from services.catalogue.app import create_app as create_catalogue_app
+from services.catalogue.extensions import db
+from services.recognition.app import create_app as create_recognition_app
+from services.recognition.catalogue_client import LocalCatalogueClient
+from shared.compression import CompressionMiddleware
+from shared.http import reset_clients
+from shared.logs import configure_logging, reset_after_fork as reset_logging
+from shared.metrics import init_metrics
+from shared.ratelimit import DEFAULT_FLUSH_EVERY, DEFAULT_FLUSH_INTERVAL, SQLiteStorage
+from shared.utils import has_internal_token
+
+# Limits shared by all gunicorn workers through one SQLite file unless
+# another limits storage URI (memory://, redis://...) is configured
+RATELIMIT_STORAGE_URI = os.getenv('RATELIMIT_STORAGE_URI')
+RATELIMIT_DEFAULT = os.getenv('RATELIMIT_DEFAULT', '200 per day;50 per hour')
+RATELIMIT_RECOGNIZE = os.getenv('RATELIMIT_RECOGNIZE', '10 per minute;100 per day')
+RATELIMIT_POLL = os.getenv('RATELIMIT_POLL', '60 per minute')
+
+def rate_limit_key():
+    return request.headers.get('X-Real-IP', request.remote_addr)
+
+def is_internal_request():
+    # Only calls proving INTERNAL_API_TOKEN skip the limits; the internal
+    # request header alone can be sent by anyone
+    return has_internal_token()
+
+def attach_limiter(app, storage_uri, route_limits, exempt=('health', 'metrics')):
+    """Rate limit a mounted service for external API consumers.
+
+    Every route gets RATELIMIT_DEFAULT unless route_limits (endpoint ->
+    limit string) gives it its own; exempt endpoints are never limited.
+    """
+    limiter = Limiter(
+        key_func=rate_limit_key,
+        default_limits=[RATELIMIT_DEFAULT],
+        storage_uri=storage_uri,
+        storage_options={
+            'flush_every': int(os.getenv('RATELIMIT_FLUSH_EVERY', DEFAULT_FLUSH_EVERY)),
+            'flush_interval': float(os.getenv('RATELIMIT_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL))
+        },
+        key_prefix=app.name,
+        headers_enabled=True
+    )
+    limiter.init_app(app)
+    limiter.request_filter(is_internal_request)
+    for endpoint, limit in route_limits.items():
+        app.view_functions[endpoint] = limiter.limit(limit)(app.view_functions[endpoint])
+    for endpoint in exempt:
+        limiter.exempt(app.view_functions[endpoint])
+    return limiter
+
+def create_application():
+    """Build the gateway WSGI application with both services mounted.
 
-gateway = Flask(__name__)
+    gunicorn serves the module-level `application` built from this
+    factory (see gunicorn.conf.py).
+    """
+    configure_logging()
+    gateway = Flask(__name__)
+    catalogue_app = create_catalogue_app()
+    recognition_app = create_recognition_app()
 
-# Configure path routing
-applications = {
-    '/catalogue': catalogue_app,  # Points to catalogue Flask app
-    '/recognition': recognition_app  # Points to recognition Flask app
-}
+    storage_uri = RATELIMIT_STORAGE_URI
+    if not storage_uri:
+        os.makedirs(gateway.instance_path, exist_ok=True)
+        storage_uri = f"sqlite:///{os.path.join(gateway.instance_path, 'ratelimit.db')}"
 
-limiter = Limiter(
-    app=gateway,
-    key_func=lambda: request.headers.get('X-Real-IP', request.remote_addr),
-    default_limits=["200 per day", "50 per hour"]
-)
+    # Recognition is the expensive path, so its entry points are tighter
+    attach_limiter(catalogue_app, storage_uri, {})
+    attach_limiter(recognition_app, storage_uri, {
+        'recognize': RATELIMIT_RECOGNIZE,
+        'recognize_batch': RATELIMIT_RECOGNIZE,
+        'get_job': RATELIMIT_POLL
+    })
 
-@gateway.before_request
-def validate_external_requests():
-    if request.path.startswith('/catalogue'):
-        # Allow internal service-to-service communication
-        if request.headers.get('X-Internal-Request') == 'true':
-            return
-        # Enforce rate limits for external API consumers
-        limiter.check()
+    # Both services share this process, so recognition queries the catalogue
+    # directly instead of looping back through the gateway over HTTP
+    if os.getenv('CATALOGUE_IN_PROCESS', 'true').lower() == 'true':
+        recognition_app.extensions['catalogue_client'] = LocalCatalogueClient(
+            catalogue_app,
+            url_prefix='/catalogue'
+        )
 
-# Health check endpoint
-@gateway.route('/health')
-def health():
-    return 'Gateway operational', 200
+    # Configure path routing
+    applications = {
+        '/catalogue': catalogue_app,  # Points to catalogue Flask app
+        '/recognition': recognition_app  # Points to recognition Flask app
+    }
 
-# Create middleware dispatcher
-application = DispatcherMiddleware(gateway, applications)
+    # Health check endpoint
+    @gateway.route('/health')
+    def health():
+        return 'Gateway operational', 200
+
+    # /metrics here covers every mounted service; each also serves its own
+    init_metrics(gateway, 'gateway', aggregate=True)
+
+    # Create middleware dispatcher, compressing responses for clients
+    # that accept gzip or zstd
+    dispatcher = DispatcherMiddleware(gateway, applications)
+    if os.getenv('COMPRESSION_ENABLED', 'true').lower() != 'true':
+        return dispatcher
+    return CompressionMiddleware.from_env(dispatcher)
+
+def mounted_apps(application):
+    """The services mounted in a gateway application, by path prefix"""
+    while not isinstance(application, DispatcherMiddleware):
+        application = application.app
+    return application.mounts
+
+def reinitialize_after_fork(application):
+    """Drop state a forked worker must not share with its parent.
+
+    With a preloaded application the master process has already opened
+    database connections and SQLite handles; each worker discards the
+    inherited ones (without closing them under the parent) and opens its
+    own on first use.
+    """
+    reset_logging()
+    reset_clients()
+    for app in mounted_apps(application).values():
+        if 'sqlalchemy' in app.extensions:
+            with app.app_context():
+                for engine in db.engines.values():
+                    engine.dispose(close=False)
+        for limiter in app.extensions.get('limiter', ()):
+            if isinstance(limiter.storage, SQLiteStorage):
+                limiter.storage.reset_after_fork()
+        for name in ('recognition_cache', 'recognition_jobs', 'match_index'):
+            if name in app.extensions:
+                app.extensions[name].reset_after_fork()
+
+application = create_application()
 
 if __name__ == '__main__':
-    # Production-ready server with concurrency
-    
-    load_dotenv()
+    # Development server; use gunicorn (gunicorn.conf.py) in production
     GATEWAY_HOST = os.getenv('GATEWAY_HOST')
     GATEWAY_PORT = int(os.getenv('GATEWAY_PORT'))
-    
+
     run_simple(
         hostname=GATEWAY_HOST,
         port=GATEWAY_PORT,
         application=application,
         use_debugger=False,
-        use_reloader=True,
+        use_reloader=os.getenv('GATEWAY_RELOAD', 'false').lower() == 'true',
         threaded=True,
-    )
\ No newline at end of file
+    )
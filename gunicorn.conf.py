@@ -0,0 +1,49 @@
+# Production serving for the gateway:
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# Every setting can be overridden with the GUNICORN_* variables below or on
+# the command line.
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+wsgi_app = 'gateway:application'
+bind = f"{os.getenv('GATEWAY_HOST', '0.0.0.0')}:{os.getenv('GATEWAY_PORT', '8000')}"
+
+# Processes sidestep the GIL for fingerprinting; threads overlap the I/O
+# of AudD.io and catalogue calls within each process
+workers = int(os.getenv('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+# The application sizes per-process pools (MATCH_WORKERS) from this count;
+# set GUNICORN_WORKERS rather than passing -w so the two agree
+os.environ['WEB_CONCURRENCY'] = str(workers)
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Import the application once in the master so its code and read-only
+# state are shared copy-on-write. Forked workers then drop inherited
+# connections in post_fork. With preload, HUP restarts workers but does
+# not reload code; deploy new code with USR2 (binary upgrade) instead.
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+# Development only: restart workers when source files change
+reload = os.getenv('GUNICORN_RELOAD', 'false').lower() == 'true'
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+
+# Recycle workers periodically, staggered so they do not restart together
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 1000))
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    from gateway import reinitialize_after_fork
+    reinitialize_after_fork(server.app.wsgi())
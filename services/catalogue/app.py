@@ -1,22 +1,100 @@
 import base64
+import json
 import os
-from flask import Flask, render_template, request
+import shutil
+import tempfile
+import time
+import click
+import requests
+from flask import Flask, Response, render_template, request, send_file, stream_with_context, url_for
 from flask_cors import CORS
 from werkzeug.exceptions import BadRequest
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from services.catalogue.extensions import db
+from services.catalogue.bulk import DEFAULT_BATCH_SIZE, ImportItem, import_tracks
+from services.catalogue.changes import (
+    CHANGE_ADD,
+    CHANGE_REMOVE,
+    CHANGES_POLL_INTERVAL,
+    backfill_changes,
+    changes_since,
+    format_cursor,
+    parse_cursor,
+    record_changes,
+    wait_for_changes
+)
+from services.catalogue.database import (
+    configure_database,
+    configure_engines,
+    create_tables,
+    each_shard,
+    owner_shard,
+    read_only,
+    replica_reads
+)
+from services.catalogue.duplicates import (
+    DEFAULT_MAX_DISTANCE,
+    backfill_signatures,
+    find_near_duplicates,
+    signature_columns
+)
+from services.catalogue.extensions import blob_store, db
+from services.catalogue.fingerprint import Fingerprint
+from services.catalogue.listing import iter_tracks, list_tracks_page
+from services.catalogue.matching import (
+    compact_match_index,
+    index_changes,
+    match_fragment,
+    match_fragments
+)
+from services.catalogue.migrations import migrate_audio_blobs
+from services.catalogue.search import find_tracks, rebuild_search_index, search_catalogue
 from services.catalogue.track import Track
+from shared.fingerprint import analyze_track
+from shared.http import get_client
+from shared.logs import configure_logging
+from shared.metrics import init_metrics, span
+from shared.serialization import request_payload
+from shared.signals import track_removed
 from shared.utils import (
+    MAX_UPLOAD_SIZE,
+    MULTIPART_OVERHEAD,
+    AudioProcessingError,
     format_response,
-    generate_audio_hash,
     handle_errors,
+    internal_headers,
+    internal_only,
+    logger,
+    parse_int_arg,
     validate_audio_format,
-    validate_file_upload
+    validate_file_upload,
+    validate_required_fields
 )
 
+LIST_DEFAULT_LIMIT = 100
+LIST_MAX_LIMIT = 1000
+
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# Items accepted by the batch lookup endpoints
+BATCH_MAX_ITEMS = 100
+
+# Audio is content-addressed, so cached copies never go stale
+AUDIO_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+
+CHANGES_DEFAULT_LIMIT = 100
+CHANGES_MAX_LIMIT = 1000
+# Longest ?wait= a change feed long-poll may hold a request for
+CHANGES_MAX_WAIT = 30
+# Seconds between keep-alive comments on an idle change stream
+CHANGES_HEARTBEAT = 15
+# Milliseconds an EventSource waits before reconnecting to a closed stream
+CHANGES_STREAM_RETRY = 1000
+
 def create_app():
     """Application factory function"""
+    configure_logging()
     app = Flask(__name__)
     
     CORS(app, resources={r"/tracks/*": {"origins": "*"}})
@@ -31,13 +109,63 @@ def create_app():
     # Configure application
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///database.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+    # Never pretty-print, even in debug; the gateway compresses responses
+    app.json.compact = True
+    app.config['AUDIO_STORAGE_PATH'] = os.getenv(
+        'AUDIO_STORAGE_PATH',
+        os.path.join(app.instance_path, 'audio')
+    )
+    # Bulk import over HTTP: rows per commit and hashing processes. An upload
+    # is hashed in the request thread by default; a positive value starts a
+    # process pool per request, worth it only for very large uploads (the
+    # CLI is the tool for loading a library)
+    app.config['BULK_IMPORT_BATCH_SIZE'] = int(os.getenv('BULK_IMPORT_BATCH_SIZE', DEFAULT_BATCH_SIZE))
+    app.config['BULK_IMPORT_WORKERS'] = int(os.getenv('BULK_IMPORT_WORKERS', 0))
+    # Signature bits two recordings may differ by and still be rejected
+    # as near-duplicates at ingest (negative disables the check)
+    app.config['NEAR_DUPLICATE_MAX_DISTANCE'] = int(
+        os.getenv('NEAR_DUPLICATE_MAX_DISTANCE', DEFAULT_MAX_DISTANCE)
+    )
+    # Fragment matching: "index" scores a memory-mapped copy of the hash
+    # index (files under MATCH_INDEX_PATH, shared by every worker) across
+    # MATCH_WORKERS processes (0 = in the request thread); "sql" votes over
+    # rows fetched per request
+    app.config['MATCH_ENGINE'] = os.getenv('MATCH_ENGINE', 'index').lower()
+    app.config['MATCH_INDEX_PATH'] = os.getenv(
+        'MATCH_INDEX_PATH',
+        os.path.join(app.instance_path, 'match-index')
+    )
+    # Every server process runs its own scoring pool, so by default the
+    # cores are divided between them; under gunicorn's 2 x CPUs + 1 workers
+    # that leaves none, and fragments are scored in the request thread
+    match_workers = os.getenv('MATCH_WORKERS')
+    server_workers = int(os.getenv('WEB_CONCURRENCY') or os.getenv('GUNICORN_WORKERS') or 1)
+    cores = (os.cpu_count() or 1) // max(server_workers, 1)
+    app.config['MATCH_WORKERS'] = int(match_workers) if match_workers else (cores if cores > 1 else 0)
+    # Hashes one fragment may send to be matched; a 12 second fragment
+    # (FRAGMENT_MAX_SECONDS) has a few thousand
+    app.config['MATCH_MAX_HASHES'] = int(os.getenv('MATCH_MAX_HASHES', 20000))
+    # Stop scoring a fragment once its best match is this confident (above 1 never stops early)
+    app.config['MATCH_EARLY_EXIT_CONFIDENCE'] = float(os.getenv('MATCH_EARLY_EXIT_CONFIDENCE', 0.95))
+    # Seconds a change stream holds its worker thread before the client is
+    # told to reconnect from its last event
+    app.config['CHANGE_STREAM_MAX_SECONDS'] = float(os.getenv('CHANGE_STREAM_MAX_SECONDS', 300))
+    # A recognition service deployed on its own is told about removed
+    # tracks over HTTP; mounted in the same gateway, a signal reaches it
+    app.config['RECOGNITION_BASE_URL'] = os.getenv('RECOGNITION_BASE_URL')
     
     # Initialize extensions
+    configure_database(app)
     db.init_app(app)
+    blob_store.init_app(app)
+    init_metrics(app, 'catalogue')
     
     # Create tables
     with app.app_context():
-        db.create_all()
+        configure_engines(db)
+        # Schema lives on the primary and shards; replicas follow them
+        create_tables(db)
         
     # Routes
     @app.route('/tracks/health')
@@ -49,12 +177,34 @@ def create_app():
         """Main catalogue interface"""
         return render_template('index.html')
 
+    def invalidate_recognition_cache(track_id):
+        """Drop a removed track's cached matches in a separate recognition service"""
+        base_url = app.config['RECOGNITION_BASE_URL']
+        if not base_url:
+            return
+        try:
+            response = get_client(base_url).request(
+                'DELETE', f"/api/cache/tracks/{track_id}", headers=internal_headers()
+            )
+        except requests.exceptions.RequestException as e:
+            # Entries still expire after RECOGNITION_CACHE_POSITIVE_TTL
+            logger.warning("Recognition cache not invalidated for %s: %s", track_id, e)
+            return
+        if response.status_code != 204:
+            logger.warning("Recognition cache not invalidated for %s: HTTP %s",
+                           track_id, response.status_code)
+
+    def allow_duplicate():
+        """Whether the uploader asked to keep a near-duplicate anyway"""
+        return request.form.get('allow_duplicate', '').lower() in ('1', 'true', 'yes')
+
     @app.route('/tracks', methods=['POST'])
     @handle_errors
     def add_track():
         """Handle file upload and track metadata"""
         # Validate file upload
-        audio_file = validate_file_upload('audio_file')
+        with span('upload'):
+            audio_file = validate_file_upload('audio_file')
         
         validate_audio_format(audio_file.filename)
         
@@ -66,47 +216,141 @@ def create_app():
         if not title or not artist:
             raise BadRequest("Missing title or artist in form data")
         
-        # Generate hash from audio bytes
-        audio_bytes = audio_file.read()
-        audio_hash = generate_audio_hash(audio_bytes)
+        # SHA-256 was computed while the upload was streamed
+        audio_hash = audio_file.sha256
         
-        # Check for duplicates
-        if Track.query.get(audio_hash):
+        # Check for duplicates on the shard owning the id
+        with owner_shard(audio_hash):
+            exists = Track.query.get(audio_hash) is not None
+        if exists:
             return format_response(
                 status=409,
                 message="Track already exists in catalogue"
             )
         
+        # Index spectral-peak hashes for local fragment matching, and sign
+        # the track for near-duplicate detection
+        try:
+            with span('fingerprint'):
+                hashes, signature = analyze_track(audio_file)
+        except AudioProcessingError as e:
+            logger.warning("Track %s stored without fingerprints: %s", audio_hash, e)
+            hashes, signature = [], None
+        
+        # Re-encodings of a catalogued recording hash differently but sign alike
+        max_distance = app.config['NEAR_DUPLICATE_MAX_DISTANCE']
+        if signature is not None and max_distance >= 0 and not allow_duplicate():
+            with span('near_duplicates'):
+                near = find_near_duplicates(signature, max_distance)
+            for track_id, distance in near:
+                # A candidate deleted since the lookup is skipped for the next closest
+                with owner_shard(track_id):
+                    duplicate_of = Track.query.get(track_id)
+                    duplicate_of = duplicate_of and duplicate_of.serialize()
+                if duplicate_of is None:
+                    continue
+                return format_response(
+                    data={'duplicate_of': duplicate_of, 'distance': distance},
+                    status=409,
+                    message="Near-duplicate of a track already in catalogue"
+                )
+        
         # Create and save track
         new_track = Track(
             id=audio_hash,
             title=title,
             artist=artist,
-            audio_file=audio_bytes
+            **signature_columns(signature)
         )
         db.session.add(new_track)
-        db.session.commit()
+        
+        # Content-addressed, so a blob left by a failed commit is reused
+        with span('store_audio'):
+            audio_file.seek(0)
+            blob_store.put_file(audio_hash, audio_file)
+        
+        with span('db_write'), index_changes() as changes, owner_shard(audio_hash):
+            db.session.flush()
+            db.session.bulk_insert_mappings(Fingerprint, [
+                {'hash': h, 'track_id': audio_hash, 'offset': offset}
+                for h, offset in hashes
+            ])
+            record_changes(CHANGE_ADD, [audio_hash])
+            db.session.commit()
+            changes.add(audio_hash, hashes)
+            # Committed attributes expire and reload from the owning shard
+            data = new_track.serialize()
         
         return format_response(
-            data=new_track.serialize(),
+            data=data,
             status=201,
             message="Track added successfully"
         )
 
+    @app.route('/tracks/bulk', methods=['POST'])
+    @handle_errors
+    def add_tracks():
+        """Import many tracks in one request.
+        
+        Takes repeated audio_file parts with title and artist fields in the
+        same order. Files are hashed and fingerprinted in the request
+        thread and inserted in batched transactions; per-file failures are listed
+        in the report instead of failing the request.
+        """
+        files = request.files.getlist('audio_file')
+        titles = request.form.getlist('title')
+        artists = request.form.getlist('artist')
+        if not files:
+            raise BadRequest("No audio_file uploaded")
+        if not len(files) == len(titles) == len(artists):
+            raise BadRequest("Provide one title and artist per audio_file")
+        
+        with tempfile.TemporaryDirectory(prefix='shamzam-bulk-') as workdir:
+            items, filenames = [], {}
+            for index, (file, title, artist) in enumerate(zip(files, titles, artists)):
+                path = os.path.join(workdir, f"{index}.wav")
+                with open(path, 'wb') as target:
+                    shutil.copyfileobj(file.stream, target)
+                items.append(ImportItem(path, title, artist))
+                filenames[path] = file.filename
+            
+            max_distance = app.config['NEAR_DUPLICATE_MAX_DISTANCE']
+            report = import_tracks(
+                items,
+                batch_size=app.config['BULK_IMPORT_BATCH_SIZE'],
+                workers=app.config['BULK_IMPORT_WORKERS'],
+                max_distance=None if max_distance < 0 or allow_duplicate() else max_distance
+            ).to_dict()
+        
+        for entry in report['errors'] + report['near_duplicates']:
+            entry['filename'] = filenames[entry.pop('path')]
+        
+        return format_response(
+            data=report,
+            message="Bulk import complete"
+        )
+
     @app.route('/tracks/<string:track_id>', methods=['DELETE'])
     @handle_errors
     def remove_track(track_id):
         """Endpoint for S2: Remove track from catalogue"""
-        track = Track.query.get(track_id)
-        
-        if not track:
-            return format_response(
-                status=404,
-                message="Track not found"
-            )
-        
-        db.session.delete(track)
-        db.session.commit()
+        with index_changes() as changes, owner_shard(track_id):
+            track = Track.query.get(track_id)
+            
+            if not track:
+                return format_response(
+                    status=404,
+                    message="Track not found"
+                )
+            
+            Fingerprint.query.filter_by(track_id=track_id).delete()
+            db.session.delete(track)
+            record_changes(CHANGE_REMOVE, [track_id])
+            db.session.commit()
+            changes.remove(track_id)
+        blob_store.delete(track_id)
+        track_removed.send(app, track_id=track_id)
+        invalidate_recognition_cache(track_id)
         
         return format_response(
             status=204,
@@ -115,48 +359,340 @@ def create_app():
 
     @app.route('/tracks/', methods=['GET'])
     @handle_errors
+    @read_only
     def list_tracks():
-        """Endpoint for S3: List all tracks in catalogue"""
-        tracks = Track.query.all()
-        return format_response(
-            data=[t.serialize() for t in tracks],
+        """Endpoint for S3: List all tracks in catalogue
+        
+        Keyset-paginated by id: pass the X-Next-Cursor header of one page
+        as ?cursor= to fetch the next (limit defaults to
+        LIST_DEFAULT_LIMIT). ?format=ndjson streams every track after the
+        cursor as newline-delimited JSON for full exports.
+        """
+        cursor = request.args.get('cursor') or None
+        
+        if request.args.get('format') == 'ndjson':
+            def export():
+                # Runs after the view returns, so opt into the replica here
+                with replica_reads():
+                    for track in iter_tracks(cursor):
+                        yield json.dumps(track) + '\n'
+            return Response(stream_with_context(export()), mimetype='application/x-ndjson')
+        
+        limit = parse_int_arg('limit', LIST_DEFAULT_LIMIT, minimum=1, maximum=LIST_MAX_LIMIT)
+        tracks, next_cursor = list_tracks_page(cursor, limit)
+        response, status = format_response(
+            data=tracks,
             message="Catalogue retrieved successfully"
         )
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+            response.headers['Link'] = (
+                f'<{url_for("list_tracks", cursor=next_cursor, limit=limit)}>; rel="next"'
+            )
+        return response, status
+    
+    def change_cursor(value):
+        try:
+            return parse_cursor(value)
+        except ValueError:
+            raise BadRequest("Invalid change cursor")
+    
+    @app.route('/tracks/changes', methods=['GET'])
+    @handle_errors
+    @read_only
+    def list_changes():
+        """Tracks added and removed after ?since=<cursor>, oldest first
+        
+        Pass the returned cursor as ?since= to fetch the next changes;
+        without it the feed starts from the beginning. ?wait=<seconds>
+        long-polls until a change arrives (at most CHANGES_MAX_WAIT).
+        """
+        cursor = change_cursor(request.args.get('since'))
+        limit = parse_int_arg('limit', CHANGES_DEFAULT_LIMIT, minimum=1, maximum=CHANGES_MAX_LIMIT)
+        wait = parse_int_arg('wait', 0, maximum=CHANGES_MAX_WAIT)
+        
+        with span('changes'):
+            changes, position = wait_for_changes(cursor, limit, wait)
+        return format_response(
+            data={'changes': changes, 'cursor': format_cursor(position)},
+            message="Changes retrieved"
+        )
+    
+    @app.route('/tracks/changes/stream', methods=['GET'])
+    @handle_errors
+    def stream_changes():
+        """Server-sent event stream of changes after ?since=<cursor>
+        
+        Each event's id is the cursor after it, so a reconnecting
+        EventSource resumes via Last-Event-ID. Streams end after
+        CHANGE_STREAM_MAX_SECONDS with a retry hint, so no client holds
+        a worker thread indefinitely.
+        """
+        cursor = change_cursor(request.headers.get('Last-Event-ID') or request.args.get('since'))
+        deadline = time.monotonic() + app.config['CHANGE_STREAM_MAX_SECONDS']
+        
+        def events(position):
+            idle_since = time.monotonic()
+            while True:
+                # Runs after the view returns, so opt into the replica here
+                with replica_reads():
+                    changes, position = changes_since(position, CHANGES_MAX_LIMIT)
+                db.session.rollback()
+                for change in changes:
+                    yield (
+                        f"id: {change['cursor']}\nevent: {change['op']}\n"
+                        f"data: {json.dumps(change)}\n\n"
+                    )
+                if time.monotonic() >= deadline:
+                    yield f"retry: {CHANGES_STREAM_RETRY}\n\n"
+                    return
+                if changes:
+                    idle_since = time.monotonic()
+                    continue
+                if time.monotonic() - idle_since >= CHANGES_HEARTBEAT:
+                    idle_since = time.monotonic()
+                    yield ": keep-alive\n\n"
+                time.sleep(CHANGES_POLL_INTERVAL)
+        
+        return Response(
+            stream_with_context(events(cursor)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
         
     @app.route('/tracks/<string:track_id>', methods=['GET'])
     @handle_errors
+    @read_only
     def get_track(track_id):
-        track = Track.query.get_or_404(track_id)
+        """Track metadata, with base64 audio only when ?include=audio"""
+        with span('lookup'), owner_shard(track_id):
+            track = db.session.get(Track, track_id)
         
-        # Encode audio bytes to proper base64
-        audio_base64 = base64.b64encode(track.audio_file).decode('utf-8')
+        if not track:
+            return format_response(
+                status=404,
+                message="Track not found"
+            )
+        
+        data = {
+            **track.serialize(),
+            'audio_url': url_for('get_track_audio', track_id=track.id)
+        }
+        
+        # Inline audio is opt-in; clients should stream audio_url instead
+        if 'audio' in request.args.get('include', '').split(','):
+            with span('inline_audio'):
+                data['audio_file'] = base64.b64encode(blob_store.read(track.id)).decode('utf-8')
         
         return format_response(
-            data={
-                'id': track.id,
-                'title': track.title,
-                'artist': track.artist,
-                'audio_file': audio_base64
-            },
+            data=data,
             message="Track details retrieved"
         )
 
+    @app.route('/tracks/<string:track_id>/audio', methods=['GET'])
+    @handle_errors
+    @read_only
+    def get_track_audio(track_id):
+        """Stream track audio straight from the blob store"""
+        with owner_shard(track_id):
+            track = db.session.get(Track, track_id)
+        
+        if not track:
+            return format_response(
+                status=404,
+                message="Track not found"
+            )
+        
+        # Tracks stored before migrate-audio, or whose blob was removed
+        if not blob_store.exists(track.id):
+            return format_response(
+                status=404,
+                message="Track audio not found"
+            )
+        
+        # The id is a content hash, so it doubles as a strong, immutable
+        # ETag. conditional=True answers If-None-Match with 304 and Range
+        # with 206; the body is streamed in chunks (or via sendfile when
+        # the WSGI server provides a file wrapper)
+        response = send_file(
+            blob_store.path(track.id),
+            mimetype='audio/wav',
+            download_name=f"{track.id}.wav",
+            conditional=True,
+            etag=track.id,
+            max_age=AUDIO_CACHE_MAX_AGE
+        )
+        response.cache_control.immutable = True
+        return response
+
     @app.route('/tracks/search', methods=['GET'])
     @handle_errors
+    @read_only
     def search_tracks():
-        """Search tracks by title and/or artist"""
+        """Ranked, fuzzy search by title and/or artist"""
         title = request.args.get('title')
         artist = request.args.get('artist')
+        limit = parse_int_arg('limit', SEARCH_DEFAULT_LIMIT, minimum=1, maximum=SEARCH_MAX_LIMIT)
+        offset = parse_int_arg('offset', 0)
+        fuzzy = request.args.get('fuzzy', 'true').lower() not in ('0', 'false', 'no')
         
-        query = Track.query
-        if title: query = query.filter(Track.title.ilike(f'%{title}%'))
-        if artist: query = query.filter(Track.artist.ilike(f'%{artist}%'))
-        
-        tracks = query.all()
+        with span('search'):
+            tracks = search_catalogue(title, artist, limit=limit, offset=offset, fuzzy=fuzzy)
         return format_response(
-            data=[t.serialize() for t in tracks],
+            data=tracks,
             message="Search results"
         )
+
+    @app.route('/tracks/search-and-fetch', methods=['GET'])
+    @handle_errors
+    @read_only
+    def search_and_fetch_track():
+        """Best search match with its details in a single round-trip"""
+        title = request.args.get('title')
+        artist = request.args.get('artist')
+        if not title and not artist:
+            raise BadRequest("Provide title and/or artist")
+        
+        with span('search'):
+            matches = search_catalogue(title, artist, limit=1)
+        if not matches:
+            return format_response(
+                status=404,
+                message="Track not found"
+            )
+        
+        return format_response(
+            data={
+                **matches[0],
+                'audio_url': url_for('get_track_audio', track_id=matches[0]['id'])
+            },
+            message="Track details retrieved"
+        )
+
+    def fragment_query(hashes, message):
+        """(hash, offset) pairs of one fragment, at most MATCH_MAX_HASHES"""
+        if not isinstance(hashes, list):
+            raise BadRequest(message)
+        if len(hashes) > app.config['MATCH_MAX_HASHES']:
+            raise BadRequest(f"At most {app.config['MATCH_MAX_HASHES']} hashes per fragment")
+        try:
+            return [(int(h), int(offset)) for h, offset in hashes]
+        except (TypeError, ValueError):
+            raise BadRequest(message)
+
+    @app.route('/tracks/match', methods=['POST'])
+    @internal_only
+    @handle_errors
+    def match_track():
+        """Match fragment fingerprints against the local hash index (recognition only)"""
+        payload = request_payload()
+        validate_required_fields(payload, ['hashes'])
+        query = fragment_query(payload['hashes'], "Hashes must be a list of [hash, offset] pairs")
+        
+        with span('match'):
+            match = match_fragment(query)
+        if not match:
+            return format_response(
+                status=404,
+                message="No matching track found"
+            )
+        
+        return format_response(
+            data={
+                **match,
+                'audio_url': url_for('get_track_audio', track_id=match['id'])
+            },
+            message="Match found"
+        )
+    
+    def with_audio_url(track):
+        if track is None:
+            return None
+        return {**track, 'audio_url': url_for('get_track_audio', track_id=track['id'])}
+
+    def batch_items(payload, field):
+        validate_required_fields(payload, [field])
+        items = payload[field]
+        if not isinstance(items, list):
+            raise BadRequest(f"{field} must be a list")
+        if len(items) > BATCH_MAX_ITEMS:
+            raise BadRequest(f"At most {BATCH_MAX_ITEMS} {field} per request")
+        return items
+
+    @app.route('/tracks/match/batch', methods=['POST'])
+    @internal_only
+    @handle_errors
+    def match_tracks():
+        """Match several fragments against the hash index in one pass (recognition only).
+        
+        Body: {"fragments": [[[hash, offset], ...], ...]}; data holds one
+        match or null per fragment, in order.
+        """
+        fragments = batch_items(request_payload(), 'fragments')
+        queries = [
+            fragment_query(hashes, "Each fragment must be a list of [hash, offset] pairs")
+            for hashes in fragments
+        ]
+        
+        return format_response(
+            data=[with_audio_url(match) for match in match_fragments(queries)],
+            message="Fragments matched"
+        )
+
+    @app.route('/tracks/search-and-fetch/batch', methods=['POST'])
+    @handle_errors
+    def search_and_fetch_tracks():
+        """Best match for several title/artist queries in one round-trip.
+        
+        Body: {"queries": [{"title": ..., "artist": ...}, ...]}; data holds
+        one track or null per query, in order.
+        """
+        queries = batch_items(request_payload(), 'queries')
+        if not all(isinstance(q, dict) for q in queries):
+            raise BadRequest("Each query must be an object with title and/or artist")
+        
+        return format_response(
+            data=[
+                with_audio_url(track)
+                for track in find_tracks([(q.get('title'), q.get('artist')) for q in queries])
+            ],
+            message="Tracks retrieved"
+        )
+    
+    @app.cli.command('migrate-audio')
+    @click.option('--batch-size', default=100, help='Rows loaded per query')
+    def migrate_audio(batch_size):
+        """Move legacy audio_file blobs out of the tracks table"""
+        moved = sum(each_shard(lambda: migrate_audio_blobs(batch_size)))
+        click.echo(f"Moved {moved} blobs to {blob_store.root}")
+    
+    @app.cli.command('reindex-search')
+    def reindex_search():
+        """Backfill normalized columns and rebuild the search index"""
+        each_shard(rebuild_search_index)
+        click.echo("Search index rebuilt")
+    
+    @app.cli.command('reindex-signatures')
+    @click.option('--batch-size', default=100, help='Tracks signed per commit')
+    def reindex_signatures(batch_size):
+        """Add signature columns and sign tracks stored before them"""
+        signed = sum(each_shard(lambda: backfill_signatures(batch_size)))
+        click.echo(f"Signed {signed} tracks")
+    
+    @app.cli.command('backfill-changes')
+    def backfill_change_log():
+        """Log an add for tracks stored before the change log existed"""
+        logged = sum(each_shard(backfill_changes))
+        click.echo(f"Logged {logged} tracks")
+    
+    @app.cli.command('compact-match-index')
+    def compact_matches():
+        """Rewrite the match index file and reset its append log"""
+        state = compact_match_index()
+        click.echo(
+            f"Indexed {len(state.index.ids)} tracks ({state.index.rows} hashes) "
+            f"in {app.config['MATCH_INDEX_PATH']}"
+        )
     
     return app
 
@@ -0,0 +1,360 @@
+import csv
+import hashlib
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from werkzeug.exceptions import BadRequest
+
+from services.catalogue.changes import CHANGE_ADD, record_changes
+from services.catalogue.database import on_shard, shard_for
+from services.catalogue.duplicates import SignatureIndex, find_near_duplicates, signature_columns
+from services.catalogue.extensions import blob_store, db
+from services.catalogue.fingerprint import Fingerprint
+from services.catalogue.matching import index_changes
+from services.catalogue.track import Track
+from shared.fingerprint import analyze_track
+from shared.utils import (
+    MAX_UPLOAD_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    WAV_HEADER_SIZE,
+    AudioProcessingError,
+    logger,
+    normalize_text,
+    validate_wav_content
+)
+
+DEFAULT_BATCH_SIZE = 500
+
+
+class ImportItem(NamedTuple):
+    """One file to import with its metadata"""
+    path: str
+    title: str
+    artist: str
+
+
+@dataclass
+class ImportReport:
+    """Running totals of a bulk import"""
+    total: int = 0
+    processed: int = 0
+    imported: int = 0
+    duplicates: int = 0
+    skipped: int = 0  # Completed by an earlier run, per the checkpoint
+    bytes: int = 0
+    errors: List[Dict] = field(default_factory=list)
+    near_duplicates: List[Dict] = field(default_factory=list)
+    started_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def failed(self) -> int:
+        return len(self.errors)
+
+    @property
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def to_dict(self) -> Dict:
+        elapsed = self.elapsed
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'imported': self.imported,
+            'duplicates': self.duplicates,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'errors': self.errors,
+            'near_duplicates': self.near_duplicates,
+            'elapsed_seconds': round(elapsed, 3),
+            'tracks_per_second': round(self.processed / elapsed, 1) if elapsed else 0.0,
+            'megabytes_per_second': round(self.bytes / elapsed / 2 ** 20, 2) if elapsed else 0.0
+        }
+
+    def summary(self) -> str:
+        """One-line progress report"""
+        stats = self.to_dict()
+        return (
+            f"{self.processed + self.skipped}/{self.total} tracks "
+            f"({self.imported} imported, {self.duplicates} duplicates, "
+            f"{len(self.near_duplicates)} near-duplicates, "
+            f"{self.failed} failed, {self.skipped} skipped) "
+            f"{stats['tracks_per_second']} tracks/s, {stats['megabytes_per_second']} MB/s"
+        )
+
+
+# --------------------------
+# Sources
+# --------------------------
+
+def discover_items(source: str) -> List[ImportItem]:
+    """List the files to import from a directory or manifest.
+
+    A manifest is a CSV with path, title and artist columns; relative
+    paths are resolved against the manifest's directory. In a directory
+    every .wav file is imported, with metadata taken from file names of
+    the form "Artist - Title.wav" (otherwise the parent directory is used
+    as the artist and the file name as the title).
+
+    Raises:
+        ValueError: If the manifest is missing a required column
+    """
+    if os.path.isdir(source):
+        items = []
+        for directory, _, files in os.walk(source):
+            for name in sorted(files):
+                if name.lower().endswith('.wav'):
+                    items.append(_item_from_filename(os.path.join(directory, name)))
+        return sorted(items)
+
+    base = os.path.dirname(os.path.abspath(source))
+    with open(source, newline='', encoding='utf-8') as manifest:
+        reader = csv.DictReader(manifest)
+        missing = {'path', 'title', 'artist'} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f"Manifest is missing columns: {', '.join(sorted(missing))}")
+        return [
+            ImportItem(os.path.join(base, row['path']), row['title'].strip(), row['artist'].strip())
+            for row in reader
+        ]
+
+
+def _item_from_filename(path: str) -> ImportItem:
+    stem = os.path.splitext(os.path.basename(path))[0]
+    if ' - ' in stem:
+        artist, title = stem.split(' - ', 1)
+    else:
+        artist, title = os.path.basename(os.path.dirname(path)), stem
+    return ImportItem(path, title.strip(), artist.strip())
+
+
+# --------------------------
+# Worker stage
+# --------------------------
+
+def prepare_track(item: ImportItem, max_size: int = MAX_UPLOAD_SIZE) -> Dict:
+    """Validate, hash, fingerprint and sign one file (runs in a worker process).
+
+    Returns:
+        Dict with the item fields plus id, size, hashes and signature, or
+        an error
+    """
+    result = {'path': item.path, 'title': item.title, 'artist': item.artist}
+    try:
+        if not item.title or not item.artist:
+            raise BadRequest("Missing title or artist")
+
+        digest = hashlib.sha256()
+        size = 0
+        with open(item.path, 'rb') as audio:
+            validate_wav_content(audio.read(WAV_HEADER_SIZE))
+            audio.seek(0)
+            for chunk in iter(lambda: audio.read(UPLOAD_CHUNK_SIZE), b''):
+                size += len(chunk)
+                if size > max_size:
+                    raise BadRequest(f"File exceeds {max_size} bytes limit")
+                digest.update(chunk)
+
+            try:
+                hashes, signature = analyze_track(audio)
+            except AudioProcessingError as e:
+                logger.warning("%s imported without fingerprints: %s", item.path, e)
+                hashes, signature = [], None
+    except BadRequest as e:
+        return {**result, 'error': e.description}
+    except OSError as e:
+        return {**result, 'error': str(e)}
+
+    return {
+        **result,
+        'id': digest.hexdigest(),
+        'size': size,
+        'hashes': hashes,
+        'signature': signature
+    }
+
+
+# --------------------------
+# Import
+# --------------------------
+
+def import_tracks(items: Iterable[ImportItem],
+                  batch_size: int = DEFAULT_BATCH_SIZE,
+                  workers: Optional[int] = None,
+                  checkpoint: Optional[str] = None,
+                  progress: Optional[Callable[[ImportReport], None]] = None,
+                  max_distance: Optional[int] = None) -> ImportReport:
+    """Import many tracks with parallel hashing and batched commits.
+
+    Files are validated, hashed and fingerprinted in a process pool one
+    batch ahead of the database writes. Each batch is deduplicated with a
+    single IN query, inserted with bulk_insert_mappings and committed
+    once. With a checkpoint file, paths of committed and duplicate files
+    are recorded and skipped when the import is run again. With max_distance set,
+    files whose perceptual signature is that close to a catalogued or
+    earlier imported track are reported as near-duplicates and skipped.
+
+    Args:
+        items: Files to import
+        batch_size: Tracks per transaction
+        workers: Worker processes (default: CPU count; 0 runs inline)
+        checkpoint: Optional file recording completed paths
+        progress: Called with the report after every batch
+        max_distance: Signature bits within which a file is a
+            near-duplicate (None disables the check)
+
+    Returns:
+        Final ImportReport
+    """
+    items = list(items)
+    report = ImportReport(total=len(items))
+
+    done = _read_checkpoint(checkpoint)
+    if done:
+        pending = [item for item in items if item.path not in done]
+        report.skipped = len(items) - len(pending)
+        items = pending
+
+    batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    # Signatures imported by this run, for duplicates within the import
+    imported = SignatureIndex() if max_distance is not None else None
+    write = lambda results: _write_batch(  # noqa: E731
+        results, report, checkpoint, progress, max_distance, imported
+    )
+    if workers == 0:
+        for batch in batches:
+            write([prepare_track(item) for item in batch])
+        return report
+
+    # Spawned workers share no sockets, threads or engine state with this
+    # process, so the pool is safe to start from a threaded server
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, batch_size // (4 * workers))
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        submitted = None
+        for batch in batches + [None]:
+            upcoming = pool.map(prepare_track, batch, chunksize=chunksize) if batch else None
+            if submitted is not None:
+                write(list(submitted))
+            submitted = upcoming
+    return report
+
+
+def _write_batch(results: List[Dict], report: ImportReport,
+                 checkpoint: Optional[str],
+                 progress: Optional[Callable[[ImportReport], None]],
+                 max_distance: Optional[int] = None,
+                 imported: Optional[SignatureIndex] = None):
+    """Insert one prepared batch in a single transaction"""
+    valid = []
+    for result in results:
+        if 'error' in result:
+            report.errors.append({'path': result['path'], 'error': result['error']})
+        else:
+            valid.append(result)
+
+    # One query per owning shard finds every id already in the catalogue
+    ids_by_shard = defaultdict(set)
+    for result in valid:
+        ids_by_shard[shard_for(result['id'])].add(result['id'])
+    existing: Set[str] = set()
+    for shard, ids in ids_by_shard.items():
+        with on_shard(shard):
+            existing.update(
+                track_id for (track_id,) in
+                db.session.query(Track.id).filter(Track.id.in_(ids))
+            )
+
+    tracks, fingerprints = defaultdict(list), defaultdict(list)
+    inserted, duplicates = [], []
+    for result in valid:
+        report.bytes += result['size']
+        if result['id'] in existing:
+            report.duplicates += 1
+            duplicates.append(result)
+            continue
+        existing.add(result['id'])
+
+        near = _near_duplicate(result, max_distance, imported)
+        if near:
+            report.near_duplicates.append({
+                'path': result['path'], 'duplicate_of': near[0], 'distance': near[1]
+            })
+            continue
+
+        # Content-addressed, so a blob left by a failed commit is reused
+        with open(result['path'], 'rb') as audio:
+            blob_store.put_file(result['id'], audio)
+
+        # bulk_insert_mappings skips ORM validators, so normalize here
+        shard = shard_for(result['id'])
+        tracks[shard].append({
+            'id': result['id'],
+            'title': result['title'],
+            'artist': result['artist'],
+            'title_norm': normalize_text(result['title']),
+            'artist_norm': normalize_text(result['artist']),
+            **signature_columns(result['signature'])
+        })
+        fingerprints[shard].extend(
+            {'hash': h, 'track_id': result['id'], 'offset': offset}
+            for h, offset in result['hashes']
+        )
+        inserted.append(result)
+
+    # Rows go to their own shard; the commit covers every shard touched
+    try:
+        with index_changes() as changes:
+            for shard, shard_tracks in tracks.items():
+                with on_shard(shard):
+                    db.session.bulk_insert_mappings(Track, shard_tracks)
+                    db.session.bulk_insert_mappings(Fingerprint, fingerprints[shard])
+                    record_changes(CHANGE_ADD, [track['id'] for track in shard_tracks])
+            db.session.commit()
+            for result in inserted:
+                changes.add(result['id'], result['hashes'])
+    except Exception:
+        db.session.rollback()
+        raise
+
+    report.imported += len(inserted)
+    report.processed += len(results)
+    # Failed and near-duplicate files are retried when the import is re-run
+    _append_checkpoint(checkpoint, [result['path'] for result in inserted + duplicates])
+    if progress:
+        progress(report)
+
+
+def _near_duplicate(result: Dict, max_distance: Optional[int],
+                    imported: Optional[SignatureIndex]) -> Optional[Tuple[str, int]]:
+    """Closest catalogued or already imported near-duplicate of a prepared file"""
+    signature = result['signature']
+    if max_distance is None or signature is None:
+        return None
+    near = find_near_duplicates(signature, max_distance) + imported.search(signature, max_distance)
+    if not near:
+        imported.add(result['id'], signature)
+        return None
+    return min(near, key=lambda match: match[1])
+
+
+def _read_checkpoint(checkpoint: Optional[str]) -> Set[str]:
+    if not checkpoint or not os.path.exists(checkpoint):
+        return set()
+    with open(checkpoint, encoding='utf-8') as file:
+        return {line.rstrip('\n') for line in file if line.strip()}
+
+
+def _append_checkpoint(checkpoint: Optional[str], paths: List[str]):
+    if not checkpoint:
+        return
+    with open(checkpoint, 'a', encoding='utf-8') as file:
+        file.writelines(f"{path}\n" for path in paths)
+        file.flush()
+        os.fsync(file.fileno())
+
@@ -0,0 +1,139 @@
+import heapq
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import select, text
+
+from services.catalogue.database import current_shard, scatter, shard_count, shard_engine
+from services.catalogue.extensions import db
+from services.catalogue.track import Track
+from services.catalogue.track_change import TrackChange
+
+CHANGE_ADD = 'add'
+CHANGE_REMOVE = 'remove'
+
+# Seconds between polls of the log while a long-poll or stream waits
+CHANGES_POLL_INTERVAL = 0.5
+
+Cursor = List[int]  # Last seq seen on each shard
+
+
+def record_changes(op: str, track_ids: List[str]):
+    """Log tracks added or removed in the session's open transaction.
+
+    Call on the shard the tracks live on, before the commit that writes
+    them. On PostgreSQL the log is locked against other writers until
+    that commit, so seqs become visible in order and a reader can never
+    move its cursor past a seq that is still uncommitted; SQLite already
+    serializes writers.
+    """
+    if not track_ids:
+        return
+    if shard_engine().dialect.name == 'postgresql':
+        db.session.execute(text('LOCK TABLE track_changes IN SHARE ROW EXCLUSIVE MODE'))
+    now = time.time()
+    db.session.bulk_insert_mappings(TrackChange, [
+        {'track_id': track_id, 'op': op, 'created_at': now}
+        for track_id in track_ids
+    ])
+
+
+def parse_cursor(cursor: Optional[str]) -> Cursor:
+    """Per-shard seqs from a feed cursor ("" or None starts from the beginning).
+
+    Cursors are the seqs joined with dots, one per shard; shards added
+    since the cursor was issued start from their beginning.
+
+    Raises:
+        ValueError: If the cursor is malformed or names too many shards
+    """
+    seqs = [int(part) for part in cursor.split('.')] if cursor else []
+    if len(seqs) > shard_count() or any(seq < 0 for seq in seqs):
+        raise ValueError(f"Invalid change cursor {cursor!r}")
+    return seqs + [0] * (shard_count() - len(seqs))
+
+
+def format_cursor(cursor: Cursor) -> str:
+    return '.'.join(str(seq) for seq in cursor)
+
+
+def _shard_changes(cursor: Cursor, limit: int) -> List[Tuple]:
+    shard = current_shard() or 0
+    rows = db.session.execute(
+        select(TrackChange.created_at, TrackChange.seq, TrackChange.op, TrackChange.track_id)
+        .where(TrackChange.seq > cursor[shard])
+        .order_by(TrackChange.seq)
+        .limit(limit)
+    )
+    return [(created_at, shard, seq, op, track_id) for created_at, seq, op, track_id in rows]
+
+
+def changes_since(cursor: Cursor, limit: int) -> Tuple[List[Dict], Cursor]:
+    """Catalogue changes after a cursor, oldest first.
+
+    Each shard's log is read in seq order and the logs are interleaved
+    by time. Every change carries the cursor just after it, so a
+    consumer can resume from any change; added tracks that still exist
+    carry their metadata.
+
+    Args:
+        cursor: Per-shard seqs already seen (see parse_cursor)
+        limit: Most changes to return
+
+    Returns:
+        Tuple of (changes, cursor after the last change)
+    """
+    per_shard = scatter(lambda: _shard_changes(cursor, limit))
+    rows = list(heapq.merge(*per_shard, key=lambda row: row[0]))[:limit]
+
+    added = list({track_id for _, _, _, op, track_id in rows if op == CHANGE_ADD})
+    tracks = {}
+    if added:
+        for shard_tracks in scatter(lambda: [
+            track.serialize() for track in Track.query.filter(Track.id.in_(added))
+        ]):
+            tracks.update((track['id'], track) for track in shard_tracks)
+
+    position = list(cursor)
+    changes = []
+    for created_at, shard, seq, op, track_id in rows:
+        position[shard] = seq
+        change = {
+            'op': op,
+            'track_id': track_id,
+            'at': created_at,
+            'cursor': format_cursor(position)
+        }
+        if op == CHANGE_ADD:
+            change['track'] = tracks.get(track_id)
+        changes.append(change)
+    return changes, position
+
+
+def wait_for_changes(cursor: Cursor, limit: int, timeout: float) -> Tuple[List[Dict], Cursor]:
+    """changes_since(), polling for up to timeout seconds until there are some"""
+    deadline = time.monotonic() + timeout
+    while True:
+        changes, position = changes_since(cursor, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes, position
+        # End the read transaction so the next poll sees new commits
+        db.session.rollback()
+        time.sleep(min(CHANGES_POLL_INTERVAL, remaining))
+
+
+def backfill_changes() -> int:
+    """Log an add for every track on the current shard with no change yet.
+
+    Lets consumers of a catalogue that predates the change log sync
+    from the beginning of the feed.
+    """
+    logged = select(TrackChange.track_id).where(TrackChange.op == CHANGE_ADD)
+    track_ids = [
+        track_id for (track_id,) in
+        db.session.query(Track.id).filter(Track.id.not_in(logged)).order_by(Track.id)
+    ]
+    record_changes(CHANGE_ADD, track_ids)
+    db.session.commit()
+    return len(track_ids)
@@ -0,0 +1,98 @@
+import json
+
+import click
+
+from services.catalogue.bulk import DEFAULT_BATCH_SIZE, discover_items, import_tracks
+from services.catalogue.duplicates import audit_duplicates
+
+
+@click.group()
+def main():
+    """Shamzam catalogue administration"""
+
+
+@main.command('import')
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Tracks inserted per transaction')
+@click.option('--workers', type=int, default=None,
+              help='Hashing/fingerprinting processes [default: CPU count; 0 runs inline]')
+@click.option('--checkpoint', type=click.Path(dir_okay=False), default=None,
+              help='File recording completed paths so an interrupted import can resume')
+@click.option('--max-distance', type=int, default=None,
+              help='Skip near-duplicates within this many signature bits '
+                   '[default: NEAR_DUPLICATE_MAX_DISTANCE; negative disables]')
+def import_command(source, batch_size, workers, checkpoint, max_distance):
+    """Import every WAV in a directory or listed in a manifest CSV.
+
+    Manifests have path, title and artist columns. In a directory, files
+    named "Artist - Title.wav" supply their own metadata.
+    """
+    # Imported here so spawned workers do not build an app on import
+    from services.catalogue.app import app
+
+    try:
+        items = discover_items(source)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='SOURCE')
+
+    if max_distance is None:
+        max_distance = app.config['NEAR_DUPLICATE_MAX_DISTANCE']
+
+    click.echo(f"Importing {len(items)} tracks from {source}", err=True)
+    with app.app_context():
+        report = import_tracks(
+            items,
+            batch_size=batch_size,
+            workers=workers,
+            checkpoint=checkpoint,
+            progress=lambda report: click.echo(report.summary(), err=True),
+            max_distance=max_distance if max_distance >= 0 else None
+        )
+
+    click.echo(json.dumps(report.to_dict(), indent=2))
+
+
+@main.command('audit-duplicates')
+@click.option('--max-distance', type=int, default=None,
+              help='Signature bits within which tracks are near-duplicates '
+                   '[default: NEAR_DUPLICATE_MAX_DISTANCE]')
+def audit_command(max_distance):
+    """Report groups of near-duplicate tracks across the whole catalogue.
+
+    Tracks stored before signatures existed are only covered once
+    "flask --app services.catalogue.app reindex-signatures" has signed
+    them.
+    """
+    from services.catalogue.app import app
+
+    if max_distance is None:
+        max_distance = max(app.config['NEAR_DUPLICATE_MAX_DISTANCE'], 0)
+
+    with app.app_context():
+        groups = audit_duplicates(max_distance)
+
+    click.echo(f"{len(groups)} near-duplicate groups", err=True)
+    click.echo(json.dumps({'max_distance': max_distance, 'groups': groups}, indent=2))
+
+
+@main.command('rebalance')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True,
+              help='Tracks examined per query')
+def rebalance_command(batch_size):
+    """Move tracks to the shard owning their id prefix.
+
+    Run after adding or removing DATABASE_SHARD_URIS, with writes
+    paused; safe to re-run after an interruption.
+    """
+    from services.catalogue.app import app
+    from services.catalogue.migrations import rebalance_shards
+
+    with app.app_context():
+        result = rebalance_shards(batch_size)
+
+    click.echo(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,294 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from functools import wraps
+from typing import Callable, List, Optional, TypeVar
+
+import sqlalchemy as sa
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from shared.metrics import instrument_engine
+from shared.utils import logger
+
+REPLICA_BIND = 'replica'
+SHARD_BIND_PREFIX = 'shard'
+# Hex digits of a track id that choose its shard
+SHARD_PREFIX_LENGTH = 4
+
+T = TypeVar('T')
+
+# Set while a read-only view runs; RoutingSession sends its reads to the replica
+_use_replica = ContextVar('use_replica', default=False)
+# Index of the shard the session is bound to, when one is chosen
+_shard = ContextVar('shard', default=None)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_pid: Optional[int] = None
+_pool_lock = threading.Lock()
+
+
+# --------------------------
+# Engine configuration
+# --------------------------
+
+def engine_options(uri: str) -> dict:
+    """SQLAlchemy engine options for a database URI, tuned from the environment.
+
+    SQLite gets a driver-level lock timeout (pragmas are applied per
+    connection by configure_engines); server databases get a sized,
+    pre-pinged and recycled connection pool.
+    """
+    if make_url(uri).get_backend_name() == 'sqlite':
+        busy_timeout = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+        return {'connect_args': {'timeout': busy_timeout / 1000}}
+
+    return {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', 10)),
+        'pool_timeout': float(os.getenv('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    }
+
+
+def configure_database(app):
+    """Fill in engine options, shard binds and the optional replica bind before db.init_app.
+
+    DATABASE_URI is the first shard; DATABASE_SHARD_URIS (comma
+    separated) adds the rest, as binds shard1, shard2, ...
+    """
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', engine_options(uri))
+
+    shard_uris = [u.strip() for u in os.getenv('DATABASE_SHARD_URIS', '').split(',') if u.strip()]
+    app.config['CATALOGUE_SHARDS'] = [None]
+    for index, shard_uri in enumerate(shard_uris, start=1):
+        bind = f'{SHARD_BIND_PREFIX}{index}'
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[bind] = {
+            'url': shard_uri,
+            **engine_options(shard_uri)
+        }
+        app.config['CATALOGUE_SHARDS'].append(bind)
+
+    replica_uri = os.getenv('DATABASE_REPLICA_URI')
+    if replica_uri:
+        app.config.setdefault('SQLALCHEMY_BINDS', {})[REPLICA_BIND] = {
+            'url': replica_uri,
+            **engine_options(replica_uri)
+        }
+
+
+def configure_engines(db):
+    """Instrument every engine and apply per-connection SQLite pragmas (app context required)"""
+    for engine in db.engines.values():
+        instrument_engine(engine)
+        if engine.dialect.name == 'sqlite' and not event.contains(engine, 'connect', _sqlite_pragmas):
+            event.listen(engine, 'connect', _sqlite_pragmas)
+
+
+def create_tables(db):
+    """Create the schema on the primary and every other shard (app context required).
+
+    Tables created by an earlier version are upgraded in place. Replicas
+    follow their primary, so they are left alone.
+    """
+    db.create_all(bind_key=None)
+    upgrade_tables(db.engine, db.metadata)
+    for bind in current_app.config['CATALOGUE_SHARDS'][1:]:
+        db.metadata.create_all(db.engines[bind])
+        upgrade_tables(db.engines[bind], db.metadata)
+
+
+def upgrade_tables(engine: sa.engine.Engine, metadata: sa.MetaData):
+    """Add the columns (and their indexes) models gained since a table was created.
+
+    create_all never alters an existing table, and every ORM load of a
+    model selects all of its columns. Existing rows hold NULL in the new
+    columns until backfilled (see "Upgrading" in the README).
+
+    Raises:
+        RuntimeError: If a missing column cannot be added as NULL
+    """
+    inspector = sa.inspect(engine)
+    tables = set(inspector.get_table_names())
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        present = {column['name'] for column in inspector.get_columns(table.name)}
+        missing = [column for column in table.columns if column.name not in present]
+        if not missing:
+            continue
+        for column in missing:
+            if not column.nullable and column.server_default is None:
+                raise RuntimeError(
+                    f"Table {table.name} lacks the NOT NULL column {column.name}; "
+                    f"recreate the table or add the column by hand"
+                )
+        with engine.begin() as connection:
+            for column in missing:
+                connection.execute(sa.text(
+                    f"ALTER TABLE {table.name} ADD COLUMN {column.name} "
+                    f"{column.type.compile(engine.dialect)}"
+                ))
+        names = {column.name for column in missing}
+        for index in table.indexes:
+            if names & {column.name for column in index.columns}:
+                index.create(engine, checkfirst=True)
+        logger.warning("Added columns %s to %s on %s; see \"Upgrading\" in the README to backfill them",
+                       ', '.join(sorted(names)), table.name, engine.url.render_as_string())
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; busy_timeout makes
+    # writers queue instead of failing with "database is locked"
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.execute(f"PRAGMA mmap_size={int(os.getenv('SQLITE_MMAP_SIZE', 256 * 2 ** 20))}")
+    cursor.close()
+
+
+# --------------------------
+# Read replica routing
+# --------------------------
+
+class RoutingSession(Session):
+    """Session routing statements to a shard and reads to the replica.
+
+    Inside on_shard() every statement goes to that shard's engine. On
+    the first shard (and when no shard is chosen), reads inside
+    replica_reads() go to the replica; writes, flushes and anything
+    outside a read-only scope use the primary, as does everything when
+    no replica is configured.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        shard = _shard.get()
+        if bind is None and shard:
+            return self._db.engines[current_app.config['CATALOGUE_SHARDS'][shard]]
+        if bind is None and _use_replica.get() and not self._flushing:
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None and not isinstance(clause, sa.sql.expression.UpdateBase):
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@contextmanager
+def replica_reads():
+    """Route the session's reads to the replica for the enclosed block"""
+    token = _use_replica.set(True)
+    try:
+        yield
+    finally:
+        _use_replica.reset(token)
+
+
+def read_only(view):
+    """Decorator for views that only read; they may see replica lag"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
+
+
+# --------------------------
+# Shard routing
+# --------------------------
+# Tracks are range-partitioned by the leading hex digits of their id,
+# so each shard holds one contiguous slice of the id space. A track's
+# fingerprints live on the same shard as its row.
+
+def shard_count() -> int:
+    return len(current_app.config.get('CATALOGUE_SHARDS', [None]))
+
+
+def shard_for(track_id: str, count: Optional[int] = None) -> int:
+    """Index of the shard owning a track id (ids that are not hex go to shard 0)"""
+    count = count or shard_count()
+    try:
+        prefix = int(track_id[:SHARD_PREFIX_LENGTH].ljust(SHARD_PREFIX_LENGTH, '0'), 16)
+    except ValueError:
+        return 0
+    return prefix * count >> (4 * SHARD_PREFIX_LENGTH)
+
+
+def current_shard() -> Optional[int]:
+    return _shard.get()
+
+
+@contextmanager
+def on_shard(index: int):
+    """Bind the session's statements to one shard for the enclosed block"""
+    token = _shard.set(index)
+    try:
+        yield
+    finally:
+        _shard.reset(token)
+
+
+def owner_shard(track_id: str):
+    """on_shard() for the shard owning a track id"""
+    return on_shard(shard_for(track_id))
+
+
+def shard_engine() -> sa.engine.Engine:
+    """Engine of the current shard (the primary outside on_shard)"""
+    engines = current_app.extensions['sqlalchemy'].engines
+    return engines[current_app.config['CATALOGUE_SHARDS'][_shard.get() or 0]]
+
+
+def scatter(query: Callable[[], T]) -> List[T]:
+    """Run a query on every shard and return the results in shard order.
+
+    Shards are queried in parallel, each in its own app context and so
+    its own session; the caller's context variables (replica reads,
+    request metrics) carry over. With a single shard, or when already
+    bound to a shard, the query runs inline on that shard only, so
+    nested scatters do not fan out again.
+    """
+    shard = _shard.get()
+    if shard is not None:
+        return [query()]
+    count = shard_count()
+    if count == 1:
+        with on_shard(0):
+            return [query()]
+
+    app = current_app._get_current_object()
+
+    def run(index: int) -> T:
+        with app.app_context(), on_shard(index):
+            return query()
+
+    pool = _shard_pool()
+    futures = [pool.submit(copy_context().run, run, index) for index in range(count)]
+    return [future.result() for future in futures]
+
+
+def each_shard(job: Callable[[], T]) -> List[T]:
+    """Run a job on every shard in turn, in this session (for maintenance tasks)"""
+    results = []
+    for index in range(shard_count()):
+        with on_shard(index):
+            results.append(job())
+    return results
+
+
+def _shard_pool() -> ThreadPoolExecutor:
+    """Scatter threads, recreated in a forked worker whose parent had a pool"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ThreadPoolExecutor(
+                max_workers=int(os.getenv('SHARD_QUERY_WORKERS', 8)),
+                thread_name_prefix='catalogue-shard'
+            )
+            _pool_pid = os.getpid()
+        return _pool
@@ -0,0 +1,216 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import or_
+
+from services.catalogue.database import on_shard, scatter, shard_count
+from services.catalogue.extensions import blob_store, db
+from services.catalogue.track import Track
+from shared.fingerprint import (
+    SIGNATURE_BLOCKS,
+    analyze_track,
+    block_probes,
+    hamming_distance,
+    signature_blocks
+)
+from shared.utils import AudioProcessingError, logger
+
+DEFAULT_MAX_DISTANCE = 6  # Differing signature bits still counted as the same recording
+
+BLOCK_COLUMNS = [f'signature_block{i}' for i in range(SIGNATURE_BLOCKS)]
+
+
+# --------------------------
+# Storage
+# --------------------------
+# Signatures are unsigned 64-bit; SQL integers are signed, so they are
+# stored shifted into the signed range and converted back on read.
+
+def to_signed(signature: int) -> int:
+    return signature - (1 << 64) if signature >= 1 << 63 else signature
+
+
+def to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def signature_columns(signature: Optional[int]) -> Dict:
+    """Track column values for a signature (all None when unsigned)"""
+    if signature is None:
+        return {'signature': None, **{column: None for column in BLOCK_COLUMNS}}
+    return {
+        'signature': to_signed(signature),
+        **dict(zip(BLOCK_COLUMNS, signature_blocks(signature)))
+    }
+
+
+# --------------------------
+# Lookup
+# --------------------------
+
+def find_near_duplicates(signature: int, max_distance: int = DEFAULT_MAX_DISTANCE,
+                         exclude: Optional[str] = None) -> List[Tuple[str, int]]:
+    """Tracks whose signature is within max_distance bits of signature.
+
+    Candidates come from the indexed block columns (multi-index
+    hashing), so only tracks sharing a near-identical block are read.
+    Signatures say nothing about ids, so every shard is probed.
+
+    Returns:
+        (track id, distance) pairs, closest first
+    """
+    probes = block_probes(signature, max_distance)
+
+    def candidates():
+        query = db.session.query(Track.id, Track.signature).filter(or_(*(
+            getattr(Track, column).in_(values) for column, values in zip(BLOCK_COLUMNS, probes)
+        )))
+        if exclude is not None:
+            query = query.filter(Track.id != exclude)
+        return query.all()
+
+    matches = []
+    for track_id, stored in (row for rows in scatter(candidates) for row in rows):
+        distance = hamming_distance(signature, to_unsigned(stored))
+        if distance <= max_distance:
+            matches.append((track_id, distance))
+    return sorted(matches, key=lambda match: (match[1], match[0]))
+
+
+class SignatureIndex:
+    """In-memory multi-index table for signatures not yet committed"""
+
+    def __init__(self):
+        self.tables: List[Dict[int, List[str]]] = [{} for _ in range(SIGNATURE_BLOCKS)]
+        self.signatures: Dict[str, int] = {}
+
+    def add(self, track_id: str, signature: int):
+        self.signatures[track_id] = signature
+        for table, block in zip(self.tables, signature_blocks(signature)):
+            table.setdefault(block, []).append(track_id)
+
+    def search(self, signature: int, max_distance: int = DEFAULT_MAX_DISTANCE) -> List[Tuple[str, int]]:
+        candidates = {
+            track_id
+            for table, values in zip(self.tables, block_probes(signature, max_distance))
+            for value in values
+            for track_id in table.get(value, ())
+        }
+        matches = [
+            (track_id, hamming_distance(signature, self.signatures[track_id]))
+            for track_id in candidates
+        ]
+        return sorted(
+            (match for match in matches if match[1] <= max_distance),
+            key=lambda match: (match[1], match[0])
+        )
+
+
+# --------------------------
+# Batch jobs
+# --------------------------
+
+def audit_duplicates(max_distance: int = DEFAULT_MAX_DISTANCE) -> List[Dict]:
+    """Group every near-duplicate track in the catalogue.
+
+    Signatures are streamed, shard by shard, into an in-memory
+    SignatureIndex and each track is probed as it is added, so the audit
+    is one pass over the catalogue rather than a comparison of every pair.
+
+    Returns:
+        Groups of two or more tracks, each with its members and the
+        largest pairwise distance found linking them
+    """
+    index = SignatureIndex()
+    parent: Dict[str, str] = {}
+    distances: Dict[str, int] = {}
+
+    def root(track_id: str) -> str:
+        while parent[track_id] != track_id:
+            parent[track_id] = parent[parent[track_id]]
+            track_id = parent[track_id]
+        return track_id
+
+    for shard in range(shard_count()):
+        with on_shard(shard):
+            rows = (
+                db.session.query(Track.id, Track.signature)
+                .filter(Track.signature.isnot(None))
+                .order_by(Track.id)
+                .yield_per(1000)
+            )
+            for track_id, stored in rows:
+                signature = to_unsigned(stored)
+                parent[track_id] = track_id
+                for other, distance in index.search(signature, max_distance):
+                    a, b = root(track_id), root(other)
+                    if a != b:
+                        parent[b] = a
+                        distances[a] = max(distances.get(a, 0), distances.pop(b, 0))
+                    distances[a] = max(distances.get(a, 0), distance)
+                index.add(track_id, signature)
+
+    groups: Dict[str, List[str]] = {}
+    for track_id in parent:
+        groups.setdefault(root(track_id), []).append(track_id)
+
+    members = [ids for ids in groups.values() if len(ids) > 1]
+    tracks = _serialize_tracks(track_id for ids in members for track_id in ids)
+    return [
+        {
+            'tracks': [tracks[track_id] for track_id in sorted(ids)],
+            'max_distance': distances[root(ids[0])]
+        }
+        for ids in sorted(members, key=min)
+    ]
+
+
+def _serialize_tracks(track_ids: Iterable[str], chunk: int = 500) -> Dict[str, Dict]:
+    track_ids = list(track_ids)
+
+    def load():
+        return [
+            track.serialize()
+            for i in range(0, len(track_ids), chunk)
+            for track in Track.query.filter(Track.id.in_(track_ids[i:i + chunk]))
+        ]
+    return {track['id']: track for tracks in scatter(load) for track in tracks}
+
+
+def backfill_signatures(batch_size: int = 100) -> int:
+    """Sign tracks stored without a signature (of the current shard; run
+    under each_shard for all of them).
+
+    Audio is read back from the blob store one batch at a time, and
+    each batch is committed, so an interrupted run can be restarted.
+
+    Returns:
+        Number of tracks signed
+    """
+    signed = 0
+    last_id = ''
+    while True:
+        tracks = (
+            Track.query
+            .filter(Track.signature.is_(None), Track.id > last_id)
+            .order_by(Track.id)
+            .limit(batch_size)
+            .all()
+        )
+        if not tracks:
+            break
+
+        for track in tracks:
+            try:
+                with blob_store.open(track.id) as audio:
+                    _, signature = analyze_track(audio)
+            except (OSError, AudioProcessingError) as e:
+                logger.warning("Cannot sign track %s: %s", track.id, e)
+                continue
+            if signature is not None:
+                for column, value in signature_columns(signature).items():
+                    setattr(track, column, value)
+                signed += 1
+        db.session.commit()
+        last_id = tracks[-1].id
+        logger.info("Signed tracks up to %s (%d signed)", last_id, signed)
+    return signed
@@ -1,4 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
 
+from services.catalogue.database import RoutingSession
+from services.catalogue.storage import BlobStore
+
 # Initialize extensions
-db = SQLAlchemy()
\ No newline at end of file
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+blob_store = BlobStore()
@@ -0,0 +1,10 @@
+from services.catalogue.extensions import db
+
+class Fingerprint(db.Model):
+    """Inverted index of spectral-peak hashes to track offsets"""
+    __tablename__ = 'fingerprints'
+
+    id = db.Column(db.Integer, primary_key=True)
+    hash = db.Column(db.Integer, nullable=False, index=True)
+    track_id = db.Column(db.String(64), db.ForeignKey('tracks.id'), nullable=False, index=True)
+    offset = db.Column(db.Integer, nullable=False)  # Anchor STFT frame
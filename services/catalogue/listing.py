@@ -0,0 +1,53 @@
+import heapq
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from services.catalogue.database import scatter
+from services.catalogue.extensions import db
+from services.catalogue.track import Track
+
+# Rows fetched per keyset query while streaming an export
+STREAM_CHUNK_SIZE = 1000
+
+
+def _page_query(cursor: Optional[str], limit: int):
+    """id/title/artist only, in id order, strictly after the cursor"""
+    query = db.session.query(Track.id, Track.title, Track.artist)
+    if cursor:
+        query = query.filter(Track.id > cursor)
+    return query.order_by(Track.id).limit(limit)
+
+
+def list_tracks_page(cursor: Optional[str], limit: int) -> Tuple[List[Dict], Optional[str]]:
+    """One keyset page of the catalogue.
+
+    Seeks on the primary key index, so every page costs the same however
+    deep into the catalogue it is. Each shard returns its own next page
+    in parallel and the pages are merged by id.
+
+    Args:
+        cursor: Id of the last track of the previous page (None for the first)
+        limit: Page size
+
+    Returns:
+        Tuple of (serialized tracks, cursor for the next page or None)
+    """
+    pages = scatter(lambda: [tuple(row) for row in _page_query(cursor, limit + 1)])
+    rows = list(heapq.merge(*pages))[:limit + 1]
+    tracks = [{'id': r[0], 'title': r[1], 'artist': r[2]} for r in rows[:limit]]
+    next_cursor = tracks[-1]['id'] if len(rows) > limit else None
+    return tracks, next_cursor
+
+
+def iter_tracks(cursor: Optional[str] = None,
+                chunk_size: int = STREAM_CHUNK_SIZE) -> Iterator[Dict]:
+    """Every track after the cursor, fetched one keyset chunk at a time.
+
+    Memory stays bounded by chunk_size and no read transaction is held
+    open between chunks.
+    """
+    while True:
+        tracks, cursor = list_tracks_page(cursor, chunk_size)
+        yield from tracks
+        db.session.rollback()
+        if cursor is None:
+            return
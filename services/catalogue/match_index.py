@@ -0,0 +1,656 @@
+import json
+import mmap
+import multiprocessing
+import os
+import struct
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+from typing import Callable, Dict, FrozenSet, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from shared.fingerprint import (
+    MIN_MATCH_VOTES,
+    HashPair,
+    frames_to_seconds,
+    match_confidence,
+    vote_offsets
+)
+from shared.utils import logger
+
+try:
+    import fcntl
+except ImportError:  # Not POSIX: one process per index directory
+    fcntl = None
+
+# --------------------------
+# File format
+# --------------------------
+#
+# An index directory holds immutable generations of the index plus an
+# append log per generation:
+#
+#   CURRENT            name of the live generation, swapped atomically
+#   LOCK               flock serializing logged writes with compaction
+#   index-<gen>.shzi   header, sorted track ids, partition directory and
+#                      one (hash, track, offset) int32 table per partition
+#   log-<gen>.shzl     tracks added or removed since <gen> was written
+
+INDEX_MAGIC = b'SHZMIDX\0'
+INDEX_FORMAT_VERSION = 1
+# magic, format version, partitions, tracks, rows, version token length
+INDEX_HEADER = struct.Struct('<8sIIQQI')
+# Byte offset and rows of one partition table
+INDEX_PARTITION = struct.Struct('<QQ')
+# op, track id, rows, version token length; then rows (hash, offset) int32
+# pairs and the token
+LOG_RECORD = struct.Struct('<B64sII')
+LOG_ADD = 1
+LOG_REMOVE = 2
+
+TRACK_ID_DTYPE = np.dtype('S64')
+# Sections start on cache-line boundaries
+SECTION_ALIGNMENT = 64
+# Rows of a partition table: hash, track number, offset
+PARTITION_FIELDS = 3
+# Compact once the log holds this many rows, or a quarter of the index
+COMPACT_MIN_ROWS = 100_000
+# Rows converted to arrays at a time while writing an index file
+INDEX_WRITE_CHUNK = 65_536
+# Index files a scoring process keeps mapped across requests
+WORKER_ATTACH_CACHE = 4
+
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = 'LOCK'
+
+Leader = Tuple[int, int, int]  # (track number, delta, votes)
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_key: Optional[Tuple[int, int]] = None
+_pool_lock = threading.Lock()
+
+
+class Partition(NamedTuple):
+    """One partition table of an index file"""
+    path: str
+    offset: int
+    rows: int
+
+
+def index_path(directory: str, generation: str) -> str:
+    return os.path.join(directory, f'index-{generation}.shzi')
+
+
+def log_path(directory: str, generation: str) -> str:
+    return os.path.join(directory, f'log-{generation}.shzl')
+
+
+def current_generation(directory: str) -> Optional[str]:
+    """Name of the live generation, or None before the first compaction"""
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as current:
+            return current.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+@contextmanager
+def directory_lock(directory: str, exclusive: bool = True):
+    """Hold the index directory's flock for the enclosed block"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+
+def _aligned(position: int) -> int:
+    return -(-position // SECTION_ALIGNMENT) * SECTION_ALIGNMENT
+
+
+def write_index(path: str, token: str, rows: Iterable[Tuple[int, str, int]],
+                partitions: int):
+    """Write an index file atomically.
+
+    Tracks are numbered in id order and split across partitions by
+    number; each partition's table is sorted by hash, so it can be
+    scored with binary searches straight from the mapped file. Rows are
+    consumed in chunks, so they can be streamed from the database.
+
+    Args:
+        path: Destination file, replaced only once complete
+        token: Catalogue version the rows were read at
+        rows: Every (hash, track_id, offset) row of the fingerprint index
+        partitions: Number of partition tables
+    """
+    # Rows arrive in chunks of int32 columns, tracks numbered as first seen
+    numbers: Dict[str, int] = {}
+    chunks = []
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, INDEX_WRITE_CHUNK))
+        if not chunk:
+            break
+        hashes, track_ids, offsets = zip(*chunk)
+        chunks.append(np.array([
+            hashes, [numbers.setdefault(track_id, len(numbers)) for track_id in track_ids], offsets
+        ], dtype=np.int32))
+    table = np.concatenate(chunks, axis=1) if chunks else np.empty((PARTITION_FIELDS, 0), np.int32)
+
+    # Renumber tracks in id order
+    seen = np.array(list(numbers), dtype=TRACK_ID_DTYPE)
+    order = np.argsort(seen, kind='stable')
+    ids = seen[order]
+    renumber = np.empty(len(order), dtype=np.int32)
+    renumber[order] = np.arange(len(order), dtype=np.int32)
+    hashes, tracks, offsets = table[0], renumber[table[1]], table[2]
+    token_bytes = token.encode()
+
+    tables = []
+    for part in range(partitions):
+        selected = np.flatnonzero(tracks % partitions == part)
+        selected = selected[np.argsort(hashes[selected], kind='stable')]
+        tables.append(np.stack([hashes[selected], tracks[selected], offsets[selected]]))
+
+    position = _aligned(INDEX_HEADER.size + len(token_bytes))
+    ids_offset = position
+    position = _aligned(position + ids.nbytes)
+    directory_offset = position
+    position = _aligned(position + partitions * INDEX_PARTITION.size)
+    table_offsets = []
+    for table in tables:
+        table_offsets.append(position)
+        position = _aligned(position + table.nbytes)
+
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as index:
+            index.write(INDEX_HEADER.pack(
+                INDEX_MAGIC, INDEX_FORMAT_VERSION, partitions, len(ids), len(hashes), len(token_bytes)
+            ))
+            index.write(token_bytes)
+            sections = [(ids_offset, ids.tobytes()), (directory_offset, b''.join(
+                INDEX_PARTITION.pack(offset, table.shape[1])
+                for offset, table in zip(table_offsets, tables)
+            ))]
+            sections += [(offset, table.tobytes()) for offset, table in zip(table_offsets, tables)]
+            for offset, data in sections:
+                index.write(b'\0' * (offset - index.tell()))
+                index.write(data)
+            index.flush()
+            os.fsync(index.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+class IndexFile:
+    """A read-only mapping of one index file.
+
+    Opening reads only the header and partition directory; pages are
+    faulted in on use and shared with every other process mapping the
+    same file through the OS page cache.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as source:
+            self.map = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, partitions, tracks, rows, token_length = INDEX_HEADER.unpack_from(self.map)
+        if magic != INDEX_MAGIC or version != INDEX_FORMAT_VERSION:
+            raise ValueError(f"{path} is not a version {INDEX_FORMAT_VERSION} match index")
+        self.token = self.map[INDEX_HEADER.size:INDEX_HEADER.size + token_length].decode()
+        self.rows = rows
+
+        ids_offset = _aligned(INDEX_HEADER.size + token_length)
+        self.ids = np.frombuffer(self.map, dtype=TRACK_ID_DTYPE, count=tracks, offset=ids_offset)
+        directory_offset = _aligned(ids_offset + self.ids.nbytes)
+        self.partitions = [
+            Partition(path, *INDEX_PARTITION.unpack_from(self.map, directory_offset + i * INDEX_PARTITION.size))
+            for i in range(partitions)
+        ]
+
+    def table(self, partition: Partition) -> np.ndarray:
+        return np.frombuffer(
+            self.map, dtype=np.int32, count=PARTITION_FIELDS * partition.rows, offset=partition.offset
+        ).reshape(PARTITION_FIELDS, partition.rows)
+
+    def number(self, track_id: str) -> Optional[int]:
+        """Track number of an id in this file, or None"""
+        key = track_id.encode()
+        position = int(np.searchsorted(self.ids, key))
+        if position < len(self.ids) and self.ids[position] == key:
+            return position
+        return None
+
+
+# --------------------------
+# Append log
+# --------------------------
+
+class IndexChanges:
+    """Tracks added or removed by one logged catalogue write"""
+
+    def __init__(self):
+        self.records: List[Tuple[int, str, List[HashPair]]] = []
+
+    def add(self, track_id: str, hashes: List[HashPair]):
+        self.records.append((LOG_ADD, track_id, hashes))
+
+    def remove(self, track_id: str):
+        self.records.append((LOG_REMOVE, track_id, []))
+
+
+def append_log(path: str, changes: IndexChanges, token: str):
+    """Append records with one write; the caller holds the directory lock"""
+    token_bytes = token.encode()
+    chunks = []
+    for op, track_id, hashes in changes.records:
+        chunks.append(LOG_RECORD.pack(op, track_id.encode(), len(hashes), len(token_bytes)))
+        chunks.append(np.asarray(hashes, dtype=np.int32).reshape(-1, 2).tobytes())
+        chunks.append(token_bytes)
+    with open(path, 'ab') as log:
+        log.write(b''.join(chunks))
+
+
+def read_log(path: str, position: int) -> Tuple[List[Tuple[int, str, np.ndarray, str]], int]:
+    """Complete records after a byte position, and the position after them.
+
+    A record still being written (or cut short by a crash) is left for a
+    later read; a crash leaves the version token unmatched, so the next
+    match compacts the index instead.
+    """
+    try:
+        with open(path, 'rb') as log:
+            log.seek(position)
+            data = log.read()
+    except FileNotFoundError:
+        return [], position
+
+    records, consumed = [], 0
+    while len(data) - consumed >= LOG_RECORD.size:
+        op, track_id, rows, token_length = LOG_RECORD.unpack_from(data, consumed)
+        end = consumed + LOG_RECORD.size + rows * 8 + token_length
+        if end > len(data):
+            break
+        pairs = np.frombuffer(data, dtype=np.int32, count=rows * 2, offset=consumed + LOG_RECORD.size)
+        token = data[end - token_length:end].decode()
+        records.append((op, track_id.rstrip(b'\0').decode(), pairs.reshape(rows, 2), token))
+        consumed = end
+    return records, position + consumed
+
+
+class LogState:
+    """The log applied on top of an index file (immutable; replaced as the log grows)"""
+
+    def __init__(self, index: IndexFile, position: int = 0, token: Optional[str] = None,
+                 added: Optional[Dict[str, np.ndarray]] = None,
+                 removed: FrozenSet[int] = frozenset()):
+        self.index = index
+        self.position = position
+        self.token = token or index.token
+        self.added = added or {}
+        self.removed = removed
+        self.rows = sum(len(pairs) for pairs in self.added.values())
+
+        # Added tracks, numbered after the file's, as one hash-sorted table
+        self.track_ids = list(self.added)
+        first = len(index.ids)
+        if self.added:
+            pairs = np.concatenate(list(self.added.values()))
+            numbers = np.repeat(
+                np.arange(first, first + len(self.added), dtype=np.int32),
+                [len(pairs) for pairs in self.added.values()]
+            )
+            order = np.argsort(pairs[:, 0], kind='stable')
+            self.table = np.stack([pairs[order, 0], numbers[order], pairs[order, 1]])
+        else:
+            self.table = None
+        self.excluded = np.fromiter(sorted(removed), dtype=np.int32, count=len(removed))
+
+    def catch_up(self, path: str) -> 'LogState':
+        """This state with any records appended since it was read"""
+        records, position = read_log(path, self.position)
+        if not records:
+            return self
+
+        added, removed = dict(self.added), set(self.removed)
+        for op, track_id, pairs, token in records:
+            number = self.index.number(track_id)
+            added.pop(track_id, None)
+            if op == LOG_ADD:
+                # Content-addressed ids: a re-added track has the same hashes
+                if number is None:
+                    added[track_id] = pairs
+                else:
+                    removed.discard(number)
+            elif number is not None:
+                removed.add(number)
+        return LogState(self.index, position, records[-1][3], added, frozenset(removed))
+
+    def track_id(self, number: int) -> str:
+        first = len(self.index.ids)
+        if number < first:
+            return self.index.ids[number].decode()
+        return self.track_ids[number - first]
+
+
+# --------------------------
+# Scoring
+# --------------------------
+
+# Index files mapped by this scoring process, least recently used first
+_attached: 'OrderedDict[str, IndexFile]' = OrderedDict()
+
+
+def score_partition(partition: Partition, fragments: List[Tuple[np.ndarray, np.ndarray]],
+                    early_exit: Optional[float], excluded: Optional[np.ndarray] = None,
+                    table: Optional[np.ndarray] = None) -> List[List[Leader]]:
+    """Vote every fragment against one partition table.
+
+    Runs in a pool process, which maps the index file by path, or inline
+    with a table the caller has already mapped.
+
+    Returns:
+        Leading alignments (see shared.fingerprint.vote_offsets) per
+        fragment, in order
+    """
+    if not partition.rows:
+        return [[] for _ in fragments]
+    if table is None:
+        table = _attach(partition.path).table(partition)
+    return [
+        vote_offsets(hashes, offsets, table[0], table[1], table[2], early_exit, excluded)
+        for hashes, offsets in fragments
+    ]
+
+
+def _attach(path: str) -> IndexFile:
+    index = _attached.get(path)
+    if index is not None:
+        _attached.move_to_end(path)
+        return index
+
+    index = _attached[path] = IndexFile(path)
+    while len(_attached) > WORKER_ATTACH_CACHE:
+        # Unmapped once no table view refers to it
+        _attached.popitem(last=False)
+    return index
+
+
+def _match_pool(workers: int) -> ProcessPoolExecutor:
+    """Scoring processes, recreated in a forked worker or when resized"""
+    global _pool, _pool_key
+    key = (os.getpid(), workers)
+    with _pool_lock:
+        if _pool is None or _pool_key != key:
+            if _pool is not None and _pool_key[0] == os.getpid():
+                _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _pool_key = key
+        return _pool
+
+
+# --------------------------
+# Match index
+# --------------------------
+
+class MatchIndex:
+    """Memory-mapped fingerprint index scored in parallel across CPU cores.
+
+    The index lives in files under a directory shared by every worker
+    process: an immutable, versioned index file that workers map in
+    milliseconds, plus an append log of tracks added or removed since it
+    was written. Catalogue writes are logged under a directory lock;
+    when the log grows large, or the catalogue changed without being
+    logged, the index is compacted into a new file in the background and
+    swapped in atomically.
+
+    With workers > 0 the file's partitions are scored concurrently by a
+    persistent process pool; with 0 they are scored in the calling thread.
+    """
+
+    def __init__(self, directory: str, workers: int, early_exit: Optional[float]):
+        self.directory = directory
+        self.workers = workers
+        self.early_exit = early_exit
+        self.state: Optional[LogState] = None
+        self.lock = threading.Lock()
+        # One compaction at a time per process; the thread running one
+        self.compaction = threading.Lock()
+        self.compactor: Optional[threading.Thread] = None
+
+    @classmethod
+    def from_config(cls, config) -> 'MatchIndex':
+        early_exit = config['MATCH_EARLY_EXIT_CONFIDENCE']
+        return cls(
+            config['MATCH_INDEX_PATH'],
+            config['MATCH_WORKERS'],
+            early_exit if early_exit <= 1 else None
+        )
+
+    def match(self, queries: List[List[HashPair]], version: Callable[[], Hashable],
+              load: Callable[[], Iterable[Tuple[int, str, int]]]) -> List[Optional[Dict]]:
+        """Match fragments against an up-to-date index.
+
+        Args:
+            queries: One list of (hash, offset) pairs per fragment
+            version: Returns the current catalogue version
+            load: Yields every (hash, track_id, offset) index row
+
+        Returns:
+            Dict with track_id, votes, offset (seconds) and confidence,
+            or None, per fragment
+        """
+        state = self.refresh(version, load)
+        fragments = [
+            (np.fromiter((h for h, _ in query), dtype=np.int64, count=len(query)),
+             np.fromiter((offset for _, offset in query), dtype=np.int64, count=len(query)))
+            for query in queries
+        ]
+        excluded = state.excluded if len(state.excluded) else None
+
+        # Partitions go to the pool; the log's table is scored here meanwhile
+        partitions = state.index.partitions
+        if self.workers > 0:
+            pool = _match_pool(self.workers)
+            futures = [
+                pool.submit(score_partition, partition, fragments, self.early_exit, excluded)
+                for partition in partitions
+            ]
+            per_partition = []
+        else:
+            futures = []
+            per_partition = [
+                score_partition(partition, fragments, self.early_exit, excluded,
+                                state.index.table(partition))
+                for partition in partitions
+            ]
+        if state.table is not None:
+            per_partition.append([
+                vote_offsets(hashes, offsets, *state.table, self.early_exit)
+                for hashes, offsets in fragments
+            ])
+        per_partition += [future.result() for future in futures]
+
+        return [
+            _best(state, [leader for leaders in candidates for leader in leaders])
+            for candidates in zip(*per_partition)
+        ]
+
+    def refresh(self, version: Callable[[], Hashable],
+                load: Callable[[], Iterable[Tuple[int, str, int]]]) -> LogState:
+        """The index with the log applied.
+
+        An index that is out of date, or whose log has grown large, is
+        compacted in a background thread while this one is served; only
+        the first index is built in the calling thread.
+        """
+        token = json.dumps(version())
+        with self.lock:
+            state = self._catch_up()
+            if state is not None and state.token != token:
+                # A write may be between its commit and its log record
+                with directory_lock(self.directory, exclusive=False):
+                    state = self._catch_up()
+        if state is None:
+            return self.compact(version, load)
+        if state.token != token or self._log_too_large(state):
+            self._compact_in_background(version, load)
+        return state
+
+    @contextmanager
+    def changes(self, version: Callable[[], Hashable]):
+        """Log the tracks a catalogue write adds or removes.
+
+        Hold this around the write's commit: the directory lock keeps the
+        commit and its log record together, so readers never mistake a
+        logged write for an unlogged one and compaction never misses one.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with directory_lock(self.directory):
+            changes = IndexChanges()
+            yield changes
+            generation = current_generation(self.directory)
+            if changes.records and generation is not None:
+                append_log(log_path(self.directory, generation), changes, json.dumps(version()))
+
+    def compact(self, version: Callable[[], Hashable],
+                load: Callable[[], Iterable[Tuple[int, str, int]]]) -> LogState:
+        """Rewrite the index from the catalogue and reset the log.
+
+        The new generation is written without the directory lock, so
+        catalogue writes carry on meanwhile; the lock is held only to move
+        records logged since the catalogue was read into the new log and
+        swap CURRENT.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with self.compaction:
+            # The version and log position are read together: no logged
+            # write is between its commit and its record meanwhile
+            with self.lock, directory_lock(self.directory, exclusive=False):
+                token = json.dumps(version())
+                state = self._catch_up()
+                # Another process may have compacted while this one waited
+                if state is not None and state.token == token and not self._log_too_large(state):
+                    return state
+                base = current_generation(self.directory)
+                position = _file_size(log_path(self.directory, base)) if base else 0
+
+            generation = uuid.uuid4().hex
+            path = index_path(self.directory, generation)
+            write_index(path, token, load(), max(self.workers, 1))
+
+            with self.lock, directory_lock(self.directory):
+                if current_generation(self.directory) != base:
+                    # Another process swapped in a generation meanwhile
+                    os.remove(path)
+                    return self._catch_up()
+
+                tail = b''
+                if base is not None:
+                    with open(log_path(self.directory, base), 'rb') as log:
+                        log.seek(position)
+                        tail = log.read()
+                with open(log_path(self.directory, generation), 'wb') as log:
+                    log.write(tail)
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+                with os.fdopen(fd, 'w') as current:
+                    current.write(generation)
+                os.replace(tmp_path, os.path.join(self.directory, CURRENT_FILE))
+                self._remove_generations(keep={generation, base})
+
+                self.state = LogState(IndexFile(path)).catch_up(log_path(self.directory, generation))
+                logger.info("Match index compacted: %s tracks, %s rows in %s",
+                            len(self.state.index.ids), self.state.index.rows, self.directory)
+                return self.state
+
+    def _compact_in_background(self, version: Callable[[], Hashable],
+                               load: Callable[[], Iterable[Tuple[int, str, int]]]):
+        """Start a compaction thread unless one is already running"""
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                return
+            self.compactor = threading.Thread(
+                target=self._compact_logged, args=(version, load),
+                name='match-index-compaction', daemon=True
+            )
+            self.compactor.start()
+
+    def _compact_logged(self, version: Callable[[], Hashable],
+                        load: Callable[[], Iterable[Tuple[int, str, int]]]):
+        try:
+            self.compact(version, load)
+        except Exception:
+            logger.exception("Match index compaction failed in %s", self.directory)
+
+    def _log_too_large(self, state: LogState) -> bool:
+        return state.rows > max(COMPACT_MIN_ROWS, state.index.rows // 4)
+
+    def _catch_up(self) -> Optional[LogState]:
+        generation = current_generation(self.directory)
+        if generation is None:
+            return None
+        state = self.state
+        if state is None or state.index.path != index_path(self.directory, generation):
+            try:
+                state = LogState(IndexFile(index_path(self.directory, generation)))
+            except FileNotFoundError:
+                # Compacted again between reading CURRENT and opening
+                return None
+        self.state = state.catch_up(log_path(self.directory, generation))
+        return self.state
+
+    def _remove_generations(self, keep):
+        """Delete all but the kept generations; open mappings stay valid"""
+        for name in os.listdir(self.directory):
+            stem, _, extension = name.rpartition('.')
+            if extension in ('shzi', 'shzl') and stem.split('-', 1)[-1] not in keep:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
+
+    def reset_after_fork(self):
+        """Remap in the forked worker rather than share the parent's locks"""
+        self.lock = threading.Lock()
+        self.compaction = threading.Lock()
+        self.compactor = None
+        self.state = None
+
+
+def _best(state: LogState, leaders: List[Leader]) -> Optional[Dict]:
+    """Combine the leading alignments reported by each partition"""
+    if not leaders:
+        return None
+    track, delta, votes = max(leaders, key=lambda leader: leader[2])
+    if votes < MIN_MATCH_VOTES:
+        return None
+    runner_up = max((n for other, _, n in leaders if other != track), default=0)
+    return {
+        'track_id': state.track_id(track),
+        'votes': votes,
+        'offset': frames_to_seconds(delta),
+        'confidence': match_confidence(votes, runner_up)
+    }
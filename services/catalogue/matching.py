@@ -0,0 +1,198 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, select
+
+from services.catalogue.database import on_shard, scatter, shard_count
+from services.catalogue.extensions import db
+from services.catalogue.fingerprint import Fingerprint
+from services.catalogue.match_index import IndexChanges, MatchIndex
+from services.catalogue.track import Track
+from services.catalogue.track_change import TrackChange
+from shared.fingerprint import HashPair, best_match
+
+# Keep IN (...) lists below SQLite's bound parameter limit
+MATCH_QUERY_CHUNK = 500
+# Fingerprint rows fetched at a time while compacting the match index
+INDEX_ROWS_PER_FETCH = 10_000
+
+
+def match_fragment(query: List[HashPair]) -> Optional[Dict]:
+    """Match fragment fingerprints against the hash index.
+
+    Args:
+        query: (hash, offset) pairs from the fragment
+
+    Returns:
+        Serialized track with votes, offset (seconds) and confidence, or
+        None
+    """
+    return match_fragments([query])[0]
+
+
+def match_fragments(queries: List[List[HashPair]]) -> List[Optional[Dict]]:
+    """Match several fragments with one pass over the hash index.
+
+    With MATCH_ENGINE "index" (the default) fragments are scored against
+    the memory-mapped match index across CPU cores; with "sql" index rows are
+    fetched from each shard for the union of every fragment's hashes.
+    Either way matched tracks are loaded with a single query per shard.
+
+    Args:
+        queries: One list of (hash, offset) pairs per fragment
+
+    Returns:
+        Match (as for match_fragment) or None per fragment, in order
+    """
+    if current_app.config['MATCH_ENGINE'] == 'index':
+        # Compaction may call back from its own thread, outside this context
+        app = current_app._get_current_object()
+        return _with_tracks(match_index().match(
+            queries,
+            lambda: _version_in(app),
+            lambda: _index_rows_in(app)
+        ))
+
+    # A track's hashes all live on its own shard, so each shard votes
+    # independently and the best-supported match across shards wins
+    per_shard = scatter(lambda: _match_shard(queries))
+    results = []
+    for candidates in zip(*per_shard):
+        found = [match for match in candidates if match]
+        results.append(max(found, key=lambda match: match['votes']) if found else None)
+    return results
+
+
+def _match_shard(queries: List[List[HashPair]]) -> List[Optional[Dict]]:
+    # Fetch every index row sharing a hash with any fragment
+    unique_hashes = list({h for query in queries for h, _ in query})
+    rows_by_hash = defaultdict(list)
+    for i in range(0, len(unique_hashes), MATCH_QUERY_CHUNK):
+        chunk = unique_hashes[i:i + MATCH_QUERY_CHUNK]
+        for row in (
+            db.session.query(Fingerprint.hash, Fingerprint.track_id, Fingerprint.offset)
+            .filter(Fingerprint.hash.in_(chunk))
+        ):
+            rows_by_hash[row.hash].append(tuple(row))
+
+    matches = []
+    for query in queries:
+        candidates = [row for h in {h for h, _ in query} for row in rows_by_hash.get(h, ())]
+        matches.append(best_match(query, candidates))
+
+    track_ids = {match['track_id'] for match in matches if match}
+    tracks = {
+        track.id: track
+        for track in Track.query.filter(Track.id.in_(track_ids))
+    } if track_ids else {}
+
+    results = []
+    for match in matches:
+        track = tracks.get(match['track_id']) if match else None
+        results.append({
+            **track.serialize(),
+            'votes': match['votes'],
+            'offset': match['offset'],
+            'confidence': match['confidence']
+        } if track else None)
+    return results
+
+
+def match_index() -> MatchIndex:
+    """The application's match index, attached on first use"""
+    index = current_app.extensions.get('match_index')
+    if index is None:
+        index = current_app.extensions.setdefault(
+            'match_index', MatchIndex.from_config(current_app.config)
+        )
+    return index
+
+
+@contextmanager
+def index_changes():
+    """Record the tracks a write adds or removes in the match index log.
+
+    Wrap the write's commit, outside any on_shard block. Yields an
+    IndexChanges to fill in once the rows are committed; nothing is
+    logged if the block raises, or with MATCH_ENGINE "sql".
+    """
+    if current_app.config['MATCH_ENGINE'] != 'index':
+        yield IndexChanges()
+        return
+    with match_index().changes(catalogue_version) as changes:
+        yield changes
+
+
+def compact_match_index():
+    """Rewrite the match index from the catalogue and reset its log"""
+    return match_index().compact(catalogue_version, _index_rows)
+
+
+def catalogue_version() -> Tuple:
+    """Token that changes whenever tracks are added or removed.
+
+    Per shard: the last change log sequence number, which every add and
+    remove advances, and the highest fingerprint id, which also catches
+    inserts that bypass the change log. Both are read from the end of a
+    primary key index, so the token costs the same at any catalogue size.
+    """
+    return tuple(scatter(lambda: tuple(db.session.execute(
+        select(select(func.max(TrackChange.seq)).scalar_subquery(),
+               select(func.max(Fingerprint.id)).scalar_subquery())
+    ).one())))
+
+
+def _index_rows() -> Iterator[Tuple[int, str, int]]:
+    """Every (hash, track_id, offset) row of the fingerprint index.
+
+    Shards are read in turn and rows streamed in batches rather than
+    loaded at once.
+    """
+    for shard in range(shard_count()):
+        with on_shard(shard):
+            yield from db.session.execute(
+                select(Fingerprint.hash, Fingerprint.track_id, Fingerprint.offset)
+                .execution_options(yield_per=INDEX_ROWS_PER_FETCH)
+            )
+
+
+def _version_in(app) -> Tuple:
+    if has_app_context():
+        return catalogue_version()
+    with app.app_context():
+        return catalogue_version()
+
+
+def _index_rows_in(app) -> Iterator[Tuple[int, str, int]]:
+    if has_app_context():
+        yield from _index_rows()
+        return
+    with app.app_context():
+        yield from _index_rows()
+
+
+def _with_tracks(matches: List[Optional[Dict]]) -> List[Optional[Dict]]:
+    """Replace track ids in index matches with the serialized tracks.
+
+    Tracks removed since the index snapshot was taken no longer match.
+    """
+    track_ids = list({match['track_id'] for match in matches if match})
+    tracks = {}
+    if track_ids:
+        for shard_tracks in scatter(lambda: [
+            track.serialize() for track in Track.query.filter(Track.id.in_(track_ids))
+        ]):
+            tracks.update((track['id'], track) for track in shard_tracks)
+
+    results = []
+    for match in matches:
+        track = tracks.get(match['track_id']) if match else None
+        results.append({
+            **track,
+            'votes': match['votes'],
+            'offset': match['offset'],
+            'confidence': match['confidence']
+        } if track else None)
+    return results
@@ -0,0 +1,121 @@
+from collections import defaultdict
+from typing import Dict
+
+from sqlalchemy import delete, insert, inspect, select, text
+
+from services.catalogue.database import on_shard, shard_count, shard_engine, shard_for
+from services.catalogue.extensions import blob_store, db
+from services.catalogue.fingerprint import Fingerprint
+from services.catalogue.track import Track
+from shared.utils import logger
+
+
+def migrate_audio_blobs(batch_size: int = 100) -> int:
+    """Move legacy tracks.audio_file bytes into the blob store.
+
+    Rows are walked in id order a batch at a time so memory stays bounded,
+    and blobs already in the store are skipped, so an interrupted run can
+    simply be restarted. The column is dropped once every row is copied.
+    Works on the current shard; run under each_shard for all of them.
+
+    Args:
+        batch_size: Rows loaded per query
+
+    Returns:
+        Number of blobs written
+    """
+    columns = {column['name'] for column in inspect(shard_engine()).get_columns('tracks')}
+    if 'audio_file' not in columns:
+        logger.info("tracks.audio_file already migrated")
+        return 0
+
+    moved = 0
+    last_id = ''
+    while True:
+        rows = db.session.execute(
+            text("SELECT id, audio_file FROM tracks WHERE id > :last_id ORDER BY id LIMIT :limit"),
+            {'last_id': last_id, 'limit': batch_size}
+        ).all()
+        if not rows:
+            break
+
+        for track_id, audio_file in rows:
+            if audio_file is not None and not blob_store.exists(track_id):
+                blob_store.put(track_id, audio_file)
+                moved += 1
+        last_id = rows[-1][0]
+        logger.info("Migrated audio up to track %s (%d blobs written)", last_id, moved)
+
+    db.session.execute(text("ALTER TABLE tracks DROP COLUMN audio_file"))
+    db.session.commit()
+    return moved
+
+
+def rebalance_shards(batch_size: int = 500) -> Dict[str, int]:
+    """Move every track (with its fingerprints) to the shard that owns it.
+
+    Run after changing DATABASE_SHARD_URIS, with writes paused. Each
+    shard is walked in id order a batch at a time. Misplaced tracks are
+    copied to their owner and committed there before being deleted from
+    the source. A run interrupted in between leaves a track on both
+    shards, which the next run resolves by skipping the copy and
+    finishing the delete, so rebalancing can simply be restarted.
+
+    Args:
+        batch_size: Tracks examined per query
+
+    Returns:
+        Dict with the number of tracks scanned and moved
+    """
+    scanned = moved = 0
+    for source in range(shard_count()):
+        last_id = ''
+        while True:
+            with on_shard(source):
+                rows = db.session.execute(
+                    select(Track.__table__).where(Track.id > last_id).order_by(Track.id).limit(batch_size)
+                ).mappings().all()
+            if not rows:
+                break
+            scanned += len(rows)
+            last_id = rows[-1]['id']
+
+            misplaced = defaultdict(list)
+            for row in rows:
+                target = shard_for(row['id'])
+                if target != source:
+                    misplaced[target].append(dict(row))
+            if not misplaced:
+                continue
+
+            ids = [row['id'] for tracks in misplaced.values() for row in tracks]
+            fingerprints = defaultdict(list)
+            with on_shard(source):
+                for row in db.session.execute(
+                    select(Fingerprint.hash, Fingerprint.track_id, Fingerprint.offset)
+                    .where(Fingerprint.track_id.in_(ids))
+                ).mappings():
+                    fingerprints[row['track_id']].append(dict(row))
+
+            for target, tracks in misplaced.items():
+                with on_shard(target):
+                    present = {
+                        track_id for (track_id,) in
+                        db.session.query(Track.id).filter(Track.id.in_([row['id'] for row in tracks]))
+                    }
+                    copies = [row for row in tracks if row['id'] not in present]
+                    if copies:
+                        db.session.execute(insert(Track.__table__), copies)
+                        prints = [fp for row in copies for fp in fingerprints[row['id']]]
+                        if prints:
+                            db.session.execute(insert(Fingerprint.__table__), prints)
+                    db.session.commit()
+
+            with on_shard(source):
+                db.session.execute(delete(Fingerprint.__table__).where(Fingerprint.track_id.in_(ids)))
+                db.session.execute(delete(Track.__table__).where(Track.id.in_(ids)))
+                db.session.commit()
+            moved += len(ids)
+            logger.info("Rebalanced shard %d up to %s (%d tracks moved)", source, last_id, moved)
+
+    return {'scanned': scanned, 'moved': moved}
@@ -0,0 +1,297 @@
+import sqlite3
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import DDL, event, func, inspect, select, text, tuple_, update
+
+from services.catalogue.database import scatter, shard_engine
+from services.catalogue.extensions import db
+from services.catalogue.track import Track
+from shared.utils import normalize_text
+
+FUZZY_THRESHOLD = 0.5   # Min share of query trigrams present in a field
+MIN_CANDIDATES = 100    # FTS rows fetched before re-ranking
+CANDIDATE_FACTOR = 4    # ...or this many times the requested page end
+EXACT_QUERY_CHUNK = 250 # (title, artist) pairs per IN (...) list
+REINDEX_BATCH_SIZE = 1000  # Tracks normalized per UPDATE by reindex-search
+
+
+# --------------------------
+# Index DDL
+# --------------------------
+# SQLite: external-content FTS5 table over the normalized columns with a
+# trigram tokenizer, kept in sync by triggers so every write path (ORM,
+# bulk inserts, raw SQL) updates it in the same transaction. Rowids of
+# tables without an INTEGER PRIMARY KEY can change on VACUUM, so run the
+# reindex-search command after vacuuming.
+#
+# PostgreSQL: pg_trgm GIN indexes on the normalized columns, which the
+# planner keeps in sync and uses for both ILIKE and similarity queries.
+
+SQLITE_FTS_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS tracks_fts USING fts5(
+        title_norm, artist_norm,
+        content='tracks', content_rowid='rowid', tokenize='trigram'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS tracks_fts_insert AFTER INSERT ON tracks BEGIN
+        INSERT INTO tracks_fts(rowid, title_norm, artist_norm)
+        VALUES (new.rowid, new.title_norm, new.artist_norm);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tracks_fts_delete AFTER DELETE ON tracks BEGIN
+        INSERT INTO tracks_fts(tracks_fts, rowid, title_norm, artist_norm)
+        VALUES ('delete', old.rowid, old.title_norm, old.artist_norm);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS tracks_fts_update AFTER UPDATE ON tracks BEGIN
+        INSERT INTO tracks_fts(tracks_fts, rowid, title_norm, artist_norm)
+        VALUES ('delete', old.rowid, old.title_norm, old.artist_norm);
+        INSERT INTO tracks_fts(rowid, title_norm, artist_norm)
+        VALUES (new.rowid, new.title_norm, new.artist_norm);
+    END""",
+]
+
+POSTGRES_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_tracks_title_norm_trgm ON tracks USING gin (title_norm gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_tracks_artist_norm_trgm ON tracks USING gin (artist_norm gin_trgm_ops)",
+]
+
+
+def _sqlite_has_trigram(ddl, target, bind, **kw) -> bool:
+    # The FTS5 trigram tokenizer shipped in SQLite 3.34
+    return bind.dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34)
+
+
+for statement in SQLITE_FTS_DDL:
+    event.listen(Track.__table__, 'after_create', DDL(statement).execute_if(callable_=_sqlite_has_trigram))
+event.listen(Track.__table__, 'before_drop', DDL("DROP TABLE IF EXISTS tracks_fts").execute_if(dialect='sqlite'))
+
+for statement in POSTGRES_TRGM_DDL:
+    event.listen(Track.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+
+
+def rebuild_search_index():
+    """Backfill normalized columns and rebuild the dialect's search index
+    (of the current shard; run under each_shard for all of them)"""
+    engine = shard_engine()
+    # Normalization is Python-side (Unicode folding). Only the columns it
+    # needs are read, so a table still missing other columns is fine
+    last_id = ''
+    while True:
+        rows = db.session.execute(
+            select(Track.id, Track.title, Track.artist)
+            .where(Track.id > last_id)
+            .order_by(Track.id)
+            .limit(REINDEX_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        db.session.execute(update(Track), [
+            {'id': row.id, 'title_norm': normalize_text(row.title), 'artist_norm': normalize_text(row.artist)}
+            for row in rows
+        ])
+        last_id = rows[-1].id
+    db.session.commit()
+
+    with engine.begin() as connection:
+        if engine.dialect.name == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+            for statement in SQLITE_FTS_DDL:
+                connection.execute(text(statement))
+            connection.execute(text("INSERT INTO tracks_fts(tracks_fts) VALUES ('rebuild')"))
+        elif engine.dialect.name == 'postgresql':
+            for statement in POSTGRES_TRGM_DDL:
+                connection.execute(text(statement))
+
+
+# --------------------------
+# Scoring
+# --------------------------
+
+def trigrams(value: str) -> Set[str]:
+    """Overlapping 3-character substrings of a normalized string"""
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+def trigram_score(query: str, field: str) -> float:
+    """Share of the query's trigrams found in the field (1.0 for substrings)"""
+    query_grams = trigrams(query)
+    if not query_grams:
+        return 1.0 if query in field else 0.0
+    return len(query_grams & trigrams(field)) / len(query_grams)
+
+
+def _fts_term(column: str, query: str, fuzzy: bool) -> str:
+    """Build an FTS5 column filter: a phrase, or any of its trigrams"""
+    def quote(value):
+        return '"' + value.replace('"', '""') + '"'
+
+    if fuzzy:
+        return f"{column} : ({' OR '.join(quote(g) for g in sorted(trigrams(query)))})"
+    return f"{column} : {quote(query)}"
+
+
+# --------------------------
+# Search
+# --------------------------
+
+def search_catalogue(title: Optional[str] = None,
+                     artist: Optional[str] = None,
+                     limit: int = 20,
+                     offset: int = 0,
+                     fuzzy: bool = True) -> List[Dict]:
+    """Ranked catalogue search by title and/or artist.
+
+    Args:
+        title: Title query (optional)
+        artist: Artist query (optional)
+        limit: Page size
+        offset: Rows to skip
+        fuzzy: Tolerate typos and word-order differences; when False only
+            substring matches are returned
+
+    Returns:
+        Serialized tracks with a relevance score, best first
+    """
+    # Every shard ranks its own first offset + limit; the merged ranking
+    # keeps each shard's order and interleaves by score, title and id
+    pages = scatter(lambda: _search_shard(title, artist, offset + limit, fuzzy))
+    if len(pages) == 1:
+        return pages[0][offset:offset + limit]
+    merged = sorted(
+        (track for page in pages for track in page),
+        key=lambda track: (-track['score'], track['title'], track['id'])
+    )
+    return merged[offset:offset + limit]
+
+
+def _search_shard(title: Optional[str], artist: Optional[str],
+                  limit: int, fuzzy: bool) -> List[Dict]:
+    """Top limit results of one shard"""
+    terms = {
+        column: normalize_text(value)
+        for column, value in (('title_norm', title), ('artist_norm', artist))
+        if value and normalize_text(value)
+    }
+    dialect = shard_engine().dialect.name
+
+    if not terms:
+        return _search_like(terms, limit, 0)
+    if dialect == 'postgresql':
+        return _search_trigram(terms, limit, 0, fuzzy)
+    if dialect == 'sqlite' and _has_fts() and all(len(q) >= 3 for q in terms.values()):
+        return _search_fts(terms, limit, 0, fuzzy)
+    return _search_like(terms, limit, 0)
+
+
+def find_tracks(queries: List[Tuple[Optional[str], Optional[str]]]) -> List[Optional[Dict]]:
+    """Best catalogue match for each (title, artist) pair.
+
+    Pairs whose normalized title and artist match a track exactly are
+    resolved together with one indexed query; only the rest fall back to
+    a ranked search each.
+
+    Returns:
+        Best match or None per query, in order
+    """
+    # Best per shard, then the highest score (earliest shard on ties)
+    per_shard = scatter(lambda: _find_tracks_shard(queries))
+    results = []
+    for candidates in zip(*per_shard):
+        found = [track for track in candidates if track]
+        results.append(max(found, key=lambda track: track['score']) if found else None)
+    return results
+
+
+def _find_tracks_shard(queries: List[Tuple[Optional[str], Optional[str]]]) -> List[Optional[Dict]]:
+    keys = [(normalize_text(title or ''), normalize_text(artist or '')) for title, artist in queries]
+    exact = {}
+    wanted = list({key for key in keys if key[0] and key[1]})
+    for i in range(0, len(wanted), EXACT_QUERY_CHUNK):
+        rows = (
+            db.session.query(Track.id, Track.title, Track.artist, Track.title_norm, Track.artist_norm)
+            .filter(tuple_(Track.title_norm, Track.artist_norm).in_(wanted[i:i + EXACT_QUERY_CHUNK]))
+            .order_by(Track.id)
+        )
+        for row in rows:
+            exact.setdefault((row.title_norm, row.artist_norm), {
+                'id': row.id, 'title': row.title, 'artist': row.artist, 'score': 1.0
+            })
+
+    results = []
+    for (title, artist), key in zip(queries, keys):
+        if key in exact:
+            results.append(exact[key])
+        elif title or artist:
+            matches = search_catalogue(title, artist, limit=1)
+            results.append(matches[0] if matches else None)
+        else:
+            results.append(None)
+    return results
+
+
+_fts_engines = set()
+
+
+def _has_fts() -> bool:
+    """Whether the FTS5 table exists; positive results are cached per engine"""
+    engine = shard_engine()
+    if engine not in _fts_engines and inspect(engine).has_table('tracks_fts'):
+        _fts_engines.add(engine)
+    return engine in _fts_engines
+
+
+def _search_fts(terms: Dict[str, str], limit: int, offset: int, fuzzy: bool) -> List[Dict]:
+    """SQLite FTS5: fetch a bm25-ranked candidate pool, re-rank by trigram overlap"""
+    match = ' AND '.join(_fts_term(column, query, fuzzy) for column, query in terms.items())
+    pool = max(MIN_CANDIDATES, (offset + limit) * CANDIDATE_FACTOR)
+    rows = db.session.execute(
+        text("""
+            SELECT tracks.id, tracks.title, tracks.artist,
+                   tracks.title_norm, tracks.artist_norm
+            FROM tracks_fts JOIN tracks ON tracks.rowid = tracks_fts.rowid
+            WHERE tracks_fts MATCH :match
+            ORDER BY bm25(tracks_fts)
+            LIMIT :pool
+        """),
+        {'match': match, 'pool': pool}
+    ).mappings().all()
+
+    results = []
+    for rank, row in enumerate(rows):
+        score = sum(trigram_score(q, row[column] or '') for column, q in terms.items()) / len(terms)
+        if score >= FUZZY_THRESHOLD:
+            results.append((-score, rank, {
+                'id': row['id'],
+                'title': row['title'],
+                'artist': row['artist'],
+                'score': round(score, 3)
+            }))
+    results.sort(key=lambda r: r[:2])
+    return [r[2] for r in results[offset:offset + limit]]
+
+
+def _search_trigram(terms: Dict[str, str], limit: int, offset: int, fuzzy: bool) -> List[Dict]:
+    """PostgreSQL pg_trgm: GIN-indexed word similarity or ILIKE"""
+    query = db.session.query(Track.id, Track.title, Track.artist)
+    scores = []
+    for column, q in terms.items():
+        field = getattr(Track, column)
+        if fuzzy:
+            query = query.filter(field.op('%>')(q))
+        else:
+            query = query.filter(field.contains(q, autoescape=True))
+        scores.append(func.word_similarity(q, field))
+
+    score = sum(scores) / len(scores)
+    rows = query.add_columns(score.label('score')).order_by(score.desc(), Track.title).limit(limit).offset(offset)
+    return [
+        {'id': r.id, 'title': r.title, 'artist': r.artist, 'score': round(float(r.score), 3)}
+        for r in rows
+    ]
+
+
+def _search_like(terms: Dict[str, str], limit: int, offset: int) -> List[Dict]:
+    """Portable fallback: substring match on the normalized columns"""
+    query = db.session.query(Track.id, Track.title, Track.artist)
+    for column, q in terms.items():
+        query = query.filter(getattr(Track, column).contains(q, autoescape=True))
+    rows = query.order_by(Track.title, Track.id).limit(limit).offset(offset)
+    return [{'id': r.id, 'title': r.title, 'artist': r.artist, 'score': 1.0} for r in rows]
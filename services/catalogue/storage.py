@@ -0,0 +1,81 @@
+import os
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from typing import BinaryIO
+
+from flask import current_app
+
+# Track ids are SHA-256 hex digests; reject anything that could escape the root
+BLOB_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]+$')
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class BlobStore:
+    """Content-addressed audio store keyed by track id.
+
+    Blobs are sharded on disk as <root>/<id[:2]>/<id[2:4]>/<id> so no
+    single directory grows with the catalogue. The root is read from the
+    AUDIO_STORAGE_PATH config of the active application.
+    """
+
+    def init_app(self, app):
+        app.config.setdefault(
+            'AUDIO_STORAGE_PATH',
+            os.path.join(app.instance_path, 'audio')
+        )
+
+    @property
+    def root(self) -> str:
+        return current_app.config['AUDIO_STORAGE_PATH']
+
+    def path(self, blob_id: str) -> str:
+        """Resolve the on-disk path of a blob.
+
+        Raises:
+            ValueError: If the id is not a safe path component
+        """
+        if not BLOB_ID_PATTERN.match(blob_id):
+            raise ValueError(f"Invalid blob id {blob_id!r}")
+        return os.path.join(self.root, blob_id[:2], blob_id[2:4], blob_id)
+
+    def exists(self, blob_id: str) -> bool:
+        return os.path.isfile(self.path(blob_id))
+
+    def put(self, blob_id: str, data: bytes):
+        """Atomically write blob bytes, replacing any partial copy"""
+        with self._atomic_writer(blob_id) as tmp:
+            tmp.write(data)
+
+    def put_file(self, blob_id: str, source: BinaryIO):
+        """Atomically copy a file object into the store in fixed-size chunks"""
+        with self._atomic_writer(blob_id) as tmp:
+            shutil.copyfileobj(source, tmp, COPY_CHUNK_SIZE)
+
+    def open(self, blob_id: str) -> BinaryIO:
+        return open(self.path(blob_id), 'rb')
+
+    def read(self, blob_id: str) -> bytes:
+        with self.open(blob_id) as blob:
+            return blob.read()
+
+    def delete(self, blob_id: str):
+        try:
+            os.remove(self.path(blob_id))
+        except FileNotFoundError:
+            pass
+
+    @contextmanager
+    def _atomic_writer(self, blob_id: str):
+        """Yield a temp file in the target shard, renamed into place on success"""
+        target = self.path(blob_id)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                yield tmp
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
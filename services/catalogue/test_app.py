@@ -1,14 +1,21 @@
+import os
+import wave
 from io import BytesIO
+import numpy as np
 import pytest
 from services.catalogue.app import create_app, db
+from services.catalogue.extensions import blob_store
+from services.catalogue.fingerprint import Fingerprint
 from services.catalogue.track import Track
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     app = create_app()
     app.config.update({
         "TESTING": True,
-        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:"
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///:memory:",
+        "AUDIO_STORAGE_PATH": str(tmp_path / 'audio'),
+        "MATCH_INDEX_PATH": str(tmp_path / 'match-index')
     })
 
     with app.app_context():
@@ -16,9 +23,32 @@ def app():
         yield app
         db.drop_all()
 
+def internal_client(app):
+    """Test client calling as another service (internal routes allowed)"""
+    client = app.test_client()
+    client.environ_base['HTTP_X_INTERNAL_REQUEST'] = 'true'
+    return client
+
 @pytest.fixture
 def client(app):
-    return app.test_client()
+    return internal_client(app)
+
+def make_wav(seconds=10.0, rate=22050, seed=0):
+    """Render a random sequence of tones as 16-bit mono WAV bytes"""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(rate * 0.25)) / rate
+    notes = [
+        sum(np.sin(2 * np.pi * f * t) for f in rng.uniform(200, 4000, size=3))
+        for _ in range(int(seconds * 4))
+    ]
+    samples = np.concatenate(notes) / 3
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(rate)
+        wav.writeframes((samples * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
 
 def test_health(client):
     response = client.get('/tracks/health')
@@ -40,37 +70,802 @@ def test_add_track(client):
     assert response.status_code == 201
     assert b'Track added successfully' in response.data
 
+def test_add_track_streams_upload(client):
+    import hashlib
+    wav_bytes = make_wav(seconds=2)
+    response = client.post('/tracks', data={
+        'title': 'Test Title',
+        'artist': 'Test Artist',
+        'audio_file': (BytesIO(wav_bytes), 'test.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+    track_id = response.json['data']['id']
+    assert track_id == hashlib.sha256(wav_bytes).hexdigest()
+    assert blob_store.read(track_id) == wav_bytes
+
+def test_add_track_invalid_header(client):
+    response = client.post('/tracks', data={
+        'title': 'Test Title',
+        'artist': 'Test Artist',
+        'audio_file': (BytesIO(b'NOTAWAVE' * 100), 'test.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert b'Missing RIFF/WAVE headers' in response.data
+
 def test_remove_track(client):
-    track = Track(id='test_id', title='Test Title', artist='Test Artist', audio_file=b'fake audio data')
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
     db.session.add(track)
     db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
 
     response = client.delete(f'/tracks/{track.id}')
     assert response.status_code == 204
 
 def test_list_tracks(client):
-    track = Track(id='test_id', title='Test Title', artist='Test Artist', audio_file=b'fake audio data')
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
     db.session.add(track)
     db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
 
     response = client.get('/tracks/')
     assert response.status_code == 200
     assert b'Track details retrieved' in response.data
 
 def test_get_track(client):
-    track = Track(id='test_id', title='Test Title', artist='Test Artist', audio_file=b'fake audio data')
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
     db.session.add(track)
     db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
 
     response = client.get(f'/tracks/{track.id}')
     assert response.status_code == 200
     assert b'Track details retrieved' in response.data
 
+def test_get_track_audio(client):
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
+    db.session.add(track)
+    db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
+
+    response = client.get(f'/tracks/{track.id}/audio')
+    assert response.status_code == 200
+    assert response.mimetype == 'audio/wav'
+    assert response.data == b'fake audio data'
+
+    response = client.get(f'/tracks/{track.id}/audio', headers={'Range': 'bytes=5-9'})
+    assert response.status_code == 206
+    assert response.data == b'audio'
+
+    response = client.get(f'/tracks/{track.id}/audio', headers={'If-None-Match': f'"{track.id}"'})
+    assert response.status_code == 304
+    assert response.headers['ETag'] == f'"{track.id}"'
+
+def test_get_track_audio_missing_blob(client):
+    db.session.add(Track(id='test_id', title='Test Title', artist='Test Artist'))
+    db.session.commit()
+
+    response = client.get('/tracks/test_id/audio')
+    assert response.status_code == 404
+    assert response.json['message'] == 'Track audio not found'
+
+def test_get_track_inline_audio_opt_in(client):
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
+    db.session.add(track)
+    db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
+
+    response = client.get(f'/tracks/{track.id}')
+    assert 'audio_file' not in response.json['data']
+    assert response.json['data']['audio_url'] == '/tracks/test_id/audio'
+
+    response = client.get(f'/tracks/{track.id}?include=audio')
+    assert response.json['data']['audio_file'] == 'ZmFrZSBhdWRpbyBkYXRh'
+
+def test_remove_track_deletes_blob(client):
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
+    db.session.add(track)
+    db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
+
+    client.delete(f'/tracks/{track.id}')
+    assert not blob_store.exists(track.id)
+
+def test_remove_track_invalidates_separate_recognition_cache(app, client, monkeypatch):
+    from unittest.mock import MagicMock, patch
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
+    db.session.add(track)
+    db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
+    app.config['RECOGNITION_BASE_URL'] = 'http://recognition.invalid'
+    monkeypatch.setenv('INTERNAL_API_TOKEN', 'secret')
+
+    with patch('shared.http.ServiceClient.request', return_value=MagicMock(status_code=204)) as request:
+        assert client.delete(f'/tracks/{track.id}').status_code == 204
+    method, path = request.call_args.args
+    assert (method, path) == ('DELETE', '/api/cache/tracks/test_id')
+    assert request.call_args.kwargs['headers']['X-Internal-Token'] == 'secret'
+
 def test_search_tracks(client):
-    track = Track(id='test_id', title='Test Title', artist='Test Artist', audio_file=b'fake audio data')
+    track = Track(id='test_id', title='Test Title', artist='Test Artist')
     db.session.add(track)
     db.session.commit()
+    blob_store.put(track.id, b'fake audio data')
 
     response = client.get('/tracks/search?title=Test')
     assert response.status_code == 200
     assert b'Search results' in response.data
+
+def test_match_track(client):
+    from shared.fingerprint import fingerprint_audio
+    wav_bytes = make_wav()
+    response = client.post('/tracks', data={
+        'title': 'Test Title',
+        'artist': 'Test Artist',
+        'audio_file': (BytesIO(wav_bytes), 'test.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+
+    # Four second fragment cut 3s into the track
+    samples = np.frombuffer(wav_bytes[44:], dtype='<i2')[3 * 22050:7 * 22050]
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(22050)
+        wav.writeframes(samples.tobytes())
+    hashes = fingerprint_audio(buffer.getvalue())
+
+    response = client.post('/tracks/match', json={'hashes': hashes})
+    assert response.status_code == 200
+    assert response.json['data']['title'] == 'Test Title'
+    assert abs(response.json['data']['offset'] - 3.0) < 0.1
+
+def test_match_track_no_match(client):
+    response = client.post('/tracks/match', json={'hashes': [[1, 0], [2, 5]]})
+    assert response.status_code == 404
+
+def test_match_track_internal_and_bounded(app, client):
+    assert app.test_client().post('/tracks/match', json={'hashes': [[1, 0]]}).status_code == 403
+
+    app.config['MATCH_MAX_HASHES'] = 2
+    response = client.post('/tracks/match', json={'hashes': [[1, 0], [2, 5], [3, 9]]})
+    assert response.status_code == 400
+    assert 'At most 2 hashes' in response.json['message']
+
+def test_search_tracks_fuzzy(client):
+    db.session.add_all([
+        Track(id='a' * 64, title='Bohemian Rhapsody', artist='Queen'),
+        Track(id='b' * 64, title='Halo', artist='Beyoncé'),
+        Track(id='c' * 64, title='Radio Ga Ga', artist='Queen'),
+    ])
+    db.session.commit()
+
+    response = client.get('/tracks/search?title=Bohemain Rapsody&artist=queen')
+    assert [t['id'] for t in response.json['data']] == ['a' * 64]
+
+    response = client.get('/tracks/search?artist=BEYONCE')
+    assert [t['title'] for t in response.json['data']] == ['Halo']
+
+    response = client.get('/tracks/search?title=Bohemain&fuzzy=false')
+    assert response.json['data'] == []
+
+    response = client.get('/tracks/search?artist=queen&limit=1&offset=1')
+    assert len(response.json['data']) == 1
+
+def test_search_index_follows_delete(client):
+    track = Track(id='a' * 64, title='Bohemian Rhapsody', artist='Queen')
+    db.session.add(track)
+    db.session.commit()
+
+    client.delete(f'/tracks/{track.id}')
+    response = client.get('/tracks/search?title=Bohemian')
+    assert response.json['data'] == []
+
+def test_search_and_fetch(client):
+    db.session.add(Track(id='a' * 64, title='Bohemian Rhapsody', artist='Queen'))
+    db.session.commit()
+
+    response = client.get('/tracks/search-and-fetch?title=Bohemian Rhapsody&artist=Queen')
+    assert response.status_code == 200
+    assert response.json['data']['id'] == 'a' * 64
+    assert response.json['data']['audio_url'] == f"/tracks/{'a' * 64}/audio"
+
+    response = client.get('/tracks/search-and-fetch?title=Unknown Song')
+    assert response.status_code == 404
+
+def test_match_tracks_batch(client):
+    from shared.fingerprint import fingerprint_audio
+    wav_bytes = make_wav(seed=1)
+    response = client.post('/tracks', data={
+        'title': 'Test Title',
+        'artist': 'Test Artist',
+        'audio_file': (BytesIO(wav_bytes), 'test.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+
+    hashes = fingerprint_audio(wav_bytes)
+    response = client.post('/tracks/match/batch', json={'fragments': [hashes, [[1, 0], [2, 5]]]})
+    assert response.status_code == 200
+    matched, missing = response.json['data']
+    assert matched['title'] == 'Test Title'
+    assert matched['audio_url'] == f"/tracks/{matched['id']}/audio"
+    assert missing is None
+
+def test_match_tracks_batch_internal_and_bounded(app, client):
+    assert app.test_client().post('/tracks/match/batch', json={'fragments': [[[1, 0]]]}).status_code == 403
+
+    app.config['MATCH_MAX_HASHES'] = 2
+    response = client.post('/tracks/match/batch', json={'fragments': [[[1, 0]], [[1, 0], [2, 5], [3, 9]]]})
+    assert response.status_code == 400
+    assert 'At most 2 hashes' in response.json['message']
+
+def test_search_and_fetch_batch(client):
+    db.session.add(Track(id='a' * 64, title='Bohemian Rhapsody', artist='Queen'))
+    db.session.add(Track(id='b' * 64, title='Under Pressure', artist='Queen & David Bowie'))
+    db.session.commit()
+
+    response = client.post('/tracks/search-and-fetch/batch', json={'queries': [
+        {'title': 'Bohemian Rhapsody', 'artist': 'Queen'},
+        {'title': 'Under Presure', 'artist': 'Queen'},
+        {'title': 'Unknown Song', 'artist': 'Nobody'}
+    ]})
+    assert response.status_code == 200
+    exact, fuzzy, missing = response.json['data']
+    assert exact['id'] == 'a' * 64
+    assert fuzzy['id'] == 'b' * 64
+    assert missing is None
+
+def test_bulk_add_tracks(app, client):
+    app.config['BULK_IMPORT_WORKERS'] = 0
+    first, second = make_wav(seconds=3, seed=2), make_wav(seconds=3, seed=3)
+    response = client.post('/tracks/bulk', data={
+        'audio_file': [(BytesIO(first), 'a.wav'), (BytesIO(second), 'b.wav'),
+                       (BytesIO(first), 'a-again.wav'), (BytesIO(b'not audio'), 'c.wav')],
+        'title': ['First', 'Second', 'First Again', 'Broken'],
+        'artist': ['Artist', 'Artist', 'Artist', 'Artist']
+    }, content_type='multipart/form-data')
+    assert response.status_code == 200
+    report = response.json['data']
+    assert (report['imported'], report['duplicates'], report['failed']) == (2, 1, 1)
+    assert report['errors'][0]['filename'] == 'c.wav'
+
+    # Normalized columns are filled even though the ORM is bypassed
+    assert client.get('/tracks/search?title=first').json['data'][0]['title'] == 'First'
+    assert blob_store.exists(db.session.query(Track.id).filter_by(title='Second').scalar())
+
+def test_bulk_import_resumes_from_checkpoint(app, tmp_path):
+    from services.catalogue.bulk import discover_items, import_tracks
+    source = tmp_path / 'library'
+    source.mkdir()
+    for seed in range(3):
+        (source / f"Artist - Song {seed}.wav").write_bytes(make_wav(seconds=2, seed=10 + seed))
+    checkpoint = str(tmp_path / 'import.checkpoint')
+
+    items = discover_items(str(source))
+    assert [item.title for item in items] == ['Song 0', 'Song 1', 'Song 2']
+
+    report = import_tracks(items[:2], batch_size=1, workers=2, checkpoint=checkpoint)
+    assert report.imported == 2
+    assert db.session.query(Fingerprint).count() > 0
+
+    report = import_tracks(items, batch_size=2, workers=0, checkpoint=checkpoint)
+    assert (report.skipped, report.imported, report.duplicates) == (2, 1, 0)
+    assert Track.query.count() == 3
+
+def test_bulk_import_checkpoint_retries_failed_files(app, tmp_path):
+    from services.catalogue.bulk import ImportItem, import_tracks
+    path = tmp_path / 'broken.wav'
+    path.write_bytes(b'not audio')
+    checkpoint = str(tmp_path / 'import.checkpoint')
+
+    report = import_tracks([ImportItem(str(path), 'Song', 'Artist')], workers=0, checkpoint=checkpoint)
+    assert len(report.errors) == 1
+
+    # Once fixed, the file is imported instead of skipped as done
+    path.write_bytes(make_wav(seconds=2, seed=20))
+    report = import_tracks([ImportItem(str(path), 'Song', 'Artist')], workers=0, checkpoint=checkpoint)
+    assert (report.skipped, report.imported) == (0, 1)
+
+def test_list_tracks_keyset_pagination(client):
+    for i in range(5):
+        db.session.add(Track(id=f'{i:064x}', title=f'Song {i}', artist='Artist'))
+    db.session.commit()
+
+    seen, cursor = [], ''
+    while True:
+        response = client.get(f'/tracks/?limit=2&cursor={cursor}')
+        assert response.status_code == 200
+        seen.extend(track['id'] for track in response.json['data'])
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            break
+    assert seen == [f'{i:064x}' for i in range(5)]
+
+def test_list_tracks_ndjson_export(client):
+    import json
+    from services.catalogue.listing import iter_tracks
+    for i in range(5):
+        db.session.add(Track(id=f'{i:064x}', title=f'Song {i}', artist='Artist'))
+    db.session.commit()
+    assert len(list(iter_tracks(chunk_size=2))) == 5
+
+    response = client.get(f"/tracks/?format=ndjson&cursor={1:064x}")
+    assert response.mimetype == 'application/x-ndjson'
+    rows = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert [row['title'] for row in rows] == ['Song 2', 'Song 3', 'Song 4']
+
+def test_sqlite_pragmas_applied(app):
+    journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+    busy_timeout = db.session.execute(db.text('PRAGMA busy_timeout')).scalar()
+    assert journal_mode in ('wal', 'memory')
+    assert busy_timeout == 5000
+
+def test_read_only_routes_use_replica(tmp_path, monkeypatch):
+    import sqlalchemy as sa
+    monkeypatch.setenv('DATABASE_REPLICA_URI', f"sqlite:///{tmp_path / 'replica.db'}")
+    replica_app = create_app()
+    try:
+        with replica_app.app_context():
+            replica = db.engines['replica']
+            Track.__table__.create(replica)
+            with replica.begin() as connection:
+                connection.execute(sa.insert(Track.__table__).values(
+                    id='r' * 64, title='Replica Only', artist='Artist', title_norm='replica only', artist_norm='artist'
+                ))
+
+            client = replica_app.test_client()
+            # Reads go to the replica...
+            assert client.get(f"/tracks/{'r' * 64}").status_code == 200
+            assert [t['id'] for t in client.get('/tracks/').json['data']] == ['r' * 64]
+            # ...while writes and everything else use the primary
+            assert db.session.get(Track, 'r' * 64) is None
+    finally:
+        # Other apps in this process have no replica bind
+        db.metadatas.pop('replica', None)
+
+def test_legacy_tracks_table_upgraded_at_startup(tmp_path, monkeypatch):
+    import sqlite3
+    path = tmp_path / 'legacy.db'
+    with sqlite3.connect(path) as connection:
+        connection.execute(
+            "CREATE TABLE tracks (id VARCHAR(64) PRIMARY KEY, title VARCHAR(100) NOT NULL, "
+            "artist VARCHAR(100) NOT NULL, audio_file BLOB)"
+        )
+        connection.execute("INSERT INTO tracks VALUES (?, 'Old Song', 'Old Artist', NULL)", ('a' * 64,))
+    connection.close()
+    monkeypatch.setenv('DATABASE_URI', f"sqlite:///{path}")
+
+    legacy_app = create_app()
+    with legacy_app.app_context():
+        response = legacy_app.test_client().get(f"/tracks/{'a' * 64}")
+        assert response.status_code == 200
+        assert response.json['data']['title'] == 'Old Song'
+        db.session.remove()
+        db.engine.dispose()
+    with sqlite3.connect(path) as connection:
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(tracks)")}
+        indexes = {row[1] for row in connection.execute("PRAGMA index_list(tracks)")}
+    connection.close()
+    assert {'title_norm', 'artist_norm', 'signature', 'signature_block0'} <= columns
+    assert 'ix_tracks_signature_block0' in indexes
+
+    # The documented upgrade sequence then backfills the new columns
+    runner = legacy_app.test_cli_runner()
+    assert 'Moved 0 blobs' in runner.invoke(args=['migrate-audio']).output
+    assert 'Search index rebuilt' in runner.invoke(args=['reindex-search']).output
+    assert 'Signed 0 tracks' in runner.invoke(args=['reindex-signatures']).output
+    with legacy_app.app_context():
+        response = legacy_app.test_client().get('/tracks/search?title=old song')
+        assert [track['id'] for track in response.json['data']] == ['a' * 64]
+
+def test_sharded_catalogue_scatter_gather_and_rebalance(tmp_path, monkeypatch):
+    import hashlib
+    import sqlite3
+    from services.catalogue.database import shard_for
+    from services.catalogue.migrations import rebalance_shards
+    from shared.fingerprint import fingerprint_audio
+    monkeypatch.setenv('DATABASE_URI', f"sqlite:///{tmp_path / 'shard0.db'}")
+    monkeypatch.setenv('AUDIO_STORAGE_PATH', str(tmp_path / 'audio'))
+    monkeypatch.setenv('MATCH_INDEX_PATH', str(tmp_path / 'match-index'))
+    tracks = {}
+    try:
+        # Start on one shard...
+        single = create_app()
+        with single.app_context():
+            client = single.test_client()
+            for seed in range(8):
+                wav = make_wav(seconds=3, seed=40 + seed)
+                response = client.post('/tracks', data={
+                    'title': f'Song {seed}', 'artist': 'Sharded', 'audio_file': (BytesIO(wav), 'a.wav')
+                }, content_type='multipart/form-data')
+                assert response.status_code == 201
+                tracks[response.json['data']['id']] = wav
+
+        # ...then split into three and move tracks to their owners
+        monkeypatch.setenv('DATABASE_SHARD_URIS', ','.join(
+            f"sqlite:///{tmp_path / f'shard{i}.db'}" for i in (1, 2)
+        ))
+        sharded = create_app()
+        with sharded.app_context():
+            assert rebalance_shards(batch_size=3)['moved'] == sum(
+                shard_for(track_id, 3) != 0 for track_id in tracks
+            )
+            assert rebalance_shards()['moved'] == 0
+
+            for index in range(3):
+                with sqlite3.connect(tmp_path / f'shard{index}.db') as connection:
+                    stored = {row[0] for row in connection.execute("SELECT id FROM tracks")}
+                assert stored == {track_id for track_id in tracks if shard_for(track_id, 3) == index}
+
+            client = internal_client(sharded)
+            # Point lookups go to the owning shard
+            for track_id in tracks:
+                assert client.get(f'/tracks/{track_id}').json['data']['id'] == track_id
+
+            # Pages are merged across shards in id order
+            seen, cursor = [], ''
+            while True:
+                response = client.get(f'/tracks/?limit=3&cursor={cursor}')
+                seen += [track['id'] for track in response.json['data']]
+                cursor = response.headers.get('X-Next-Cursor')
+                if not cursor:
+                    break
+            assert seen == sorted(tracks)
+
+            results = client.get('/tracks/search?artist=sharded&limit=5&offset=5').json['data']
+            assert len(results) == 3
+
+            # Fragments match whichever shard holds the track
+            track_id = max(tracks)
+            hashes = fingerprint_audio(tracks[track_id])
+            assert client.post('/tracks/match', json={'hashes': hashes}).json['data']['id'] == track_id
+
+            assert client.delete(f'/tracks/{track_id}').status_code == 204
+            assert client.get(f'/tracks/{track_id}').status_code == 404
+
+            # New tracks are written to (and served from) their owner
+            seed = next(seed for seed in range(50, 100) if shard_for(
+                hashlib.sha256(make_wav(seconds=3, seed=seed)).hexdigest(), 3) == 2)
+            response = client.post('/tracks', data={
+                'title': 'Late', 'artist': 'Sharded', 'audio_file': (BytesIO(make_wav(seconds=3, seed=seed)), 'a.wav')
+            }, content_type='multipart/form-data')
+            assert response.status_code == 201
+            assert client.get(f"/tracks/{response.json['data']['id']}").status_code == 200
+            assert len(client.get('/tracks/').json['data']) == 8
+
+            # The change feed interleaves every shard's log; moves are not changes
+            feed = client.get('/tracks/changes').json['data']
+            assert [change['op'] for change in feed['changes']] == ['add'] * 8 + ['remove', 'add']
+            assert feed['cursor'].count('.') == 2
+            assert client.get(f"/tracks/changes?since={feed['cursor']}").json['data']['changes'] == []
+    finally:
+        for index in (1, 2):
+            db.metadatas.pop(f'shard{index}', None)
+
+def test_metrics_count_stages_and_queries(client):
+    response = client.post('/tracks', data={
+        'title': 'Metered',
+        'artist': 'Artist',
+        'audio_file': (BytesIO(make_wav(seconds=2.0)), 'metered.wav')
+    })
+    assert response.status_code == 201
+    timing = response.headers['Server-Timing']
+    for stage in ('upload', 'store_audio', 'fingerprint', 'db_write', 'db'):
+        assert f"{stage};dur=" in timing
+
+    response = client.get('/tracks/search?title=Metered')
+    assert 'search;dur=' in response.headers['Server-Timing']
+
+    text = client.get('/metrics').get_data(as_text=True)
+    assert 'shamzam_stage_duration_seconds_count{service="catalogue",stage="search"}' in text
+    assert 'shamzam_db_query_duration_seconds_count{service="catalogue",statement="INSERT"}' in text
+    assert 'shamzam_db_queries_per_request_bucket{service="catalogue",endpoint="/tracks/search",le="+Inf"}' in text
+
+def test_compression_middleware(app):
+    import gzip
+    import json
+    from werkzeug.test import Client
+    from shared.compression import CompressionMiddleware
+    for i in range(50):
+        db.session.add(Track(id=f'{i:064x}', title=f'Song {i}', artist='Artist'))
+    db.session.commit()
+    blob_store.put(f'{0:064x}', b'\0' * 4096)
+    client = Client(CompressionMiddleware(app.wsgi_app, minimum_size=512))
+
+    response = client.get('/tracks/?limit=50', headers={'Accept-Encoding': 'br;q=1, gzip;q=0.8'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert int(response.headers['Content-Length']) == len(response.data)
+    assert len(json.loads(gzip.decompress(response.data))['data']) == 50
+
+    # Streamed exports are compressed chunk by chunk
+    response = client.get('/tracks/?format=ndjson', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Length' not in response.headers
+    assert len(gzip.decompress(response.data).splitlines()) == 50
+
+    # Small bodies, audio and clients that refuse gzip are left alone
+    assert 'Content-Encoding' not in client.get('/tracks/health', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get(f'/tracks/{0:064x}/audio', headers={'Accept-Encoding': 'gzip'}).headers
+    assert 'Content-Encoding' not in client.get('/tracks/?limit=50', headers={'Accept-Encoding': 'gzip;q=0'}).headers
+    assert 'Content-Encoding' not in client.get('/tracks/?limit=50').headers
+
+def test_msgpack_match_batch(client):
+    msgpack = pytest.importorskip('msgpack')
+    wav_bytes = make_wav(seconds=3.0)
+    response = client.post('/tracks', data={
+        'title': 'Packed', 'artist': 'Artist', 'audio_file': (BytesIO(wav_bytes), 'packed.wav')
+    })
+    track_id = response.json['data']['id']
+    from shared.fingerprint import fingerprint_audio
+    hashes = [list(pair) for pair in fingerprint_audio(BytesIO(wav_bytes))]
+
+    response = client.post(
+        '/tracks/match/batch',
+        data=msgpack.packb({'fragments': [hashes]}),
+        content_type='application/msgpack',
+        headers={'Accept': 'application/msgpack'}
+    )
+    assert response.status_code == 200
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.data)['data'][0]['id'] == track_id
+
+def test_near_duplicate_deleted_since_lookup_skipped(client, monkeypatch):
+    import services.catalogue.app as catalogue_app
+    db.session.add(Track(id='a' * 64, title='Kept', artist='Artist'))
+    db.session.commit()
+
+    # The closest candidate was deleted after the lookup; the next one is reported
+    monkeypatch.setattr(catalogue_app, 'find_near_duplicates', lambda *args: [('f' * 64, 1), ('a' * 64, 2)])
+    response = client.post('/tracks', data={
+        'title': 'Copy', 'artist': 'Artist', 'audio_file': (BytesIO(make_wav(seed=23)), 'b.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 409
+    assert response.json['data'] == {'duplicate_of': Track.query.get('a' * 64).serialize(), 'distance': 2}
+
+    # With every candidate gone the track is added
+    monkeypatch.setattr(catalogue_app, 'find_near_duplicates', lambda *args: [('f' * 64, 1)])
+    response = client.post('/tracks', data={
+        'title': 'Copy', 'artist': 'Artist', 'audio_file': (BytesIO(make_wav(seed=23)), 'b.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+
+def test_near_duplicate_rejected_and_audited(app, client):
+    from services.catalogue.duplicates import audit_duplicates
+    original = make_wav(seconds=10, seed=21)
+    response = client.post('/tracks', data={
+        'title': 'Original', 'artist': 'Artist', 'audio_file': (BytesIO(original), 'a.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+    original_id = response.json['data']['id']
+
+    # Same recording at 44.1kHz stereo, quieter, after a second of silence
+    samples = np.frombuffer(original[44:], dtype='<i2').astype(np.float64)
+    resampled = np.interp(np.arange(len(samples) * 2) / 2, np.arange(len(samples)), samples) * 0.8
+    padded = np.concatenate([np.zeros(44100), resampled])
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(44100)
+        wav.writeframes(np.repeat(padded, 2).astype('<i2').tobytes())
+    copy = buffer.getvalue()
+
+    response = client.post('/tracks', data={
+        'title': 'Copy', 'artist': 'Artist', 'audio_file': (BytesIO(copy), 'b.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 409
+    assert response.json['data']['duplicate_of']['id'] == original_id
+    assert response.json['data']['distance'] <= app.config['NEAR_DUPLICATE_MAX_DISTANCE']
+
+    # A different recording is still accepted
+    response = client.post('/tracks', data={
+        'title': 'Other', 'artist': 'Artist', 'audio_file': (BytesIO(make_wav(seconds=10, seed=22)), 'c.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+
+    response = client.post('/tracks', data={
+        'title': 'Copy', 'artist': 'Artist', 'allow_duplicate': 'true', 'audio_file': (BytesIO(copy), 'b.wav')
+    }, content_type='multipart/form-data')
+    assert response.status_code == 201
+
+    groups = audit_duplicates(app.config['NEAR_DUPLICATE_MAX_DISTANCE'])
+    assert [sorted(track['title'] for track in group['tracks']) for group in groups] == [['Copy', 'Original']]
+
+    # Bulk imports skip near-duplicates, including within the same import
+    app.config['BULK_IMPORT_WORKERS'] = 0
+    fresh = make_wav(seconds=10, seed=23)
+    response = client.post('/tracks/bulk', data={
+        'audio_file': [(BytesIO(copy[:-2]), 'copy.wav'), (BytesIO(fresh), 'fresh.wav'),
+                       (BytesIO(fresh[:-2]), 'fresh-copy.wav')],
+        'title': ['Copy', 'Fresh', 'Fresh Copy'],
+        'artist': ['Artist', 'Artist', 'Artist']
+    }, content_type='multipart/form-data')
+    report = response.json['data']
+    assert report['imported'] == 1
+    assert sorted(entry['filename'] for entry in report['near_duplicates']) == ['copy.wav', 'fresh-copy.wav']
+
+def test_match_index_engines_agree(app, client):
+    from services.catalogue.match_index import MatchIndex
+    from shared.fingerprint import best_match, fingerprint_audio, vote_offsets
+    ids = []
+    for seed in (31, 32, 33):
+        response = client.post('/tracks', data={
+            'title': f'Track {seed}', 'artist': 'Artist',
+            'audio_file': (BytesIO(make_wav(seconds=10, seed=seed)), f'{seed}.wav')
+        }, content_type='multipart/form-data')
+        ids.append(response.json['data']['id'])
+
+    # Fragment cut 4s into the second track
+    samples = np.frombuffer(make_wav(seconds=10, seed=32)[44:], dtype='<i2')[4 * 22050:8 * 22050]
+    buffer = BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(22050)
+        wav.writeframes(samples.tobytes())
+    hashes = fingerprint_audio(buffer.getvalue())
+
+    # Vectorized voting counts exactly what best_match counts
+    rows = sorted(db.session.query(Fingerprint.hash, Fingerprint.track_id, Fingerprint.offset))
+    numbers = {track_id: n for n, track_id in enumerate(ids)}
+    leaders = vote_offsets(
+        np.array([h for h, _ in hashes]), np.array([o for _, o in hashes]),
+        np.array([r[0] for r in rows]), np.array([numbers[r[1]] for r in rows]),
+        np.array([r[2] for r in rows])
+    )
+    expected = best_match(hashes, rows)
+    assert ids[leaders[0][0]] == expected['track_id'] == ids[1]
+    assert leaders[0][2] == expected['votes']
+
+    results = {}
+    for engine, workers in (('sql', 0), ('index', 0), ('index', 2)):
+        app.config['MATCH_ENGINE'] = engine
+        app.extensions['match_index'] = MatchIndex(app.config['MATCH_INDEX_PATH'], workers, early_exit=None)
+        response = client.post('/tracks/match', json={'hashes': hashes})
+        assert response.status_code == 200
+        match = response.json['data']
+        results[engine, workers] = (match['id'], match['votes'], round(match['offset'], 2))
+        assert 0 < match['confidence'] <= 1
+    assert len(set(results.values())) == 1
+    assert results['sql', 0][0] == ids[1]
+    assert abs(results['sql', 0][2] - 4.0) < 0.1
+
+    # Early exit stops at a confident partial count; the index follows deletes
+    app.extensions['match_index'] = MatchIndex(app.config['MATCH_INDEX_PATH'], 0, early_exit=0.5)
+    response = client.post('/tracks/match', json={'hashes': hashes})
+    assert response.json['data']['id'] == ids[1]
+    assert response.json['data']['confidence'] >= 0.5
+    assert response.json['data']['votes'] < results['sql', 0][1]
+
+    assert client.delete(f'/tracks/{ids[1]}').status_code == 204
+    assert client.post('/tracks/match', json={'hashes': hashes}).status_code == 404
+
+def test_match_index_file_log_and_compaction(app, client):
+    from services.catalogue.match_index import MatchIndex, current_generation
+    from shared.fingerprint import fingerprint_audio
+    directory = app.config['MATCH_INDEX_PATH']
+    wavs = {seed: make_wav(seconds=6, seed=seed) for seed in (41, 42, 43)}
+    hashes = {seed: fingerprint_audio(BytesIO(wav)) for seed, wav in wavs.items()}
+
+    def add(seed):
+        response = client.post('/tracks', data={
+            'title': f'Track {seed}', 'artist': 'Artist',
+            'audio_file': (BytesIO(wavs[seed]), f'{seed}.wav')
+        }, content_type='multipart/form-data')
+        return response.json['data']['id']
+
+    def match(seed):
+        response = client.post('/tracks/match', json={'hashes': hashes[seed]})
+        return response.json['data']['id'] if response.status_code == 200 else None
+
+    # The first match writes the index file
+    first = add(41)
+    assert match(41) == first
+    generation = current_generation(directory)
+    assert generation
+
+    # Later writes are appended to the log, not compacted
+    second = add(42)
+    assert match(42) == second
+    assert client.delete(f'/tracks/{first}').status_code == 204
+    assert match(41) is None
+    assert current_generation(directory) == generation
+
+    # A new worker maps the same file and replays the log
+    app.extensions['match_index'] = MatchIndex(directory, 0, early_exit=None)
+    assert match(42) == second and match(41) is None
+    assert current_generation(directory) == generation
+
+    # Writes that bypass the log are caught by the version check
+    third = 'f' * 64
+    db.session.add(Track(id=third, title='Unlogged', artist='Artist'))
+    db.session.bulk_insert_mappings(Fingerprint, [
+        {'hash': h, 'track_id': third, 'offset': offset} for h, offset in hashes[43]
+    ])
+    db.session.commit()
+    # The stale index is served while it is compacted in the background
+    assert match(43) is None
+    app.extensions['match_index'].compactor.join()
+    assert match(43) == third
+    assert current_generation(directory) != generation
+
+    result = app.test_cli_runner().invoke(args=['compact-match-index'])
+    assert 'Indexed 2 tracks' in result.output
+    assert sorted(name.rsplit('.', 1)[-1] for name in os.listdir(directory)
+                  if name.endswith(('.shzi', '.shzl'))) == ['shzi', 'shzi', 'shzl', 'shzl']
+
+    # Writes logged while a generation is built are carried into its log
+    from services.catalogue.matching import _index_rows
+    wavs[44] = make_wav(seconds=6, seed=44)
+    hashes[44] = fingerprint_audio(BytesIO(wavs[44]))
+    late = []
+
+    def load():
+        rows = list(_index_rows())
+        late.append(add(44))
+        return rows
+
+    generation = current_generation(directory)
+    app.extensions['match_index'].compact(lambda: ('forced',), load)
+    assert current_generation(directory) != generation
+    assert match(44) == late[0] and match(42) == second
+
+def test_change_feed(app, client):
+    import json
+    import time
+    from services.catalogue.changes import backfill_changes
+
+    def add(seed):
+        response = client.post('/tracks', data={
+            'title': f'Track {seed}', 'artist': 'Artist',
+            'audio_file': (BytesIO(make_wav(seconds=3, seed=seed)), f'{seed}.wav')
+        }, content_type='multipart/form-data')
+        return response.json['data']['id']
+
+    first, second = add(61), add(62)
+    assert client.delete(f'/tracks/{first}').status_code == 204
+    app.config['BULK_IMPORT_WORKERS'] = 0
+    client.post('/tracks/bulk', data={
+        'audio_file': [(BytesIO(make_wav(seconds=3, seed=63)), 'c.wav')],
+        'title': ['Bulk'], 'artist': ['Artist']
+    }, content_type='multipart/form-data')
+
+    feed = client.get('/tracks/changes?limit=3').json['data']
+    assert [(c['op'], c['track_id']) for c in feed['changes']] == [
+        ('add', first), ('add', second), ('remove', first)
+    ]
+    # Tracks since removed carry no metadata
+    assert feed['changes'][0]['track'] is None
+    assert feed['changes'][1]['track']['title'] == 'Track 62'
+    assert feed['cursor'] == feed['changes'][-1]['cursor'] == '3'
+
+    feed = client.get(f"/tracks/changes?since={feed['cursor']}").json['data']
+    assert [c['track']['title'] for c in feed['changes']] == ['Bulk']
+
+    # Long-polls return empty once the wait runs out
+    started = time.monotonic()
+    response = client.get(f"/tracks/changes?since={feed['cursor']}&wait=1")
+    assert response.json['data'] == {'changes': [], 'cursor': feed['cursor']}
+    assert time.monotonic() - started >= 1
+    assert client.get('/tracks/changes?since=abc').status_code == 400
+
+    # Streams resume from Last-Event-ID
+    response = client.get('/tracks/changes/stream', headers={'Last-Event-ID': '1'}, buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    event = next(iter(response.response)).decode()
+    assert event.startswith('id: 2\nevent: add\n')
+    assert json.loads(event.split('data: ', 1)[1])['track_id'] == second
+    response.close()
+
+    # Streams past their lifetime end with a reconnect hint
+    app.config['CHANGE_STREAM_MAX_SECONDS'] = 0
+    events = b''.join(client.get('/tracks/changes/stream?since=2').response).decode()
+    assert events.startswith('id: 3\nevent: remove\n')
+    assert events.endswith('retry: 1000\n\n')
+
+    # Tracks stored before the change log get an add when backfilled
+    db.session.add(Track(id='e' * 64, title='Legacy', artist='Artist'))
+    db.session.commit()
+    assert backfill_changes() == 1
+    assert backfill_changes() == 0
+    assert client.get('/tracks/changes?since=4').json['data']['changes'][0]['track_id'] == 'e' * 64
@@ -1,17 +1,40 @@
+from sqlalchemy.orm import validates
+
 from services.catalogue.extensions import db
+from shared.utils import normalize_text
 
 class Track(db.Model):
-    """Database model for music tracks"""
+    """Database model for music tracks.
+    
+    Audio bytes live in the blob store under the same id; the table only
+    holds metadata.
+    """
     __tablename__ = 'tracks'
     
     id = db.Column(db.String(64), primary_key=True)  # SHA-256 hash
     title = db.Column(db.String(100), nullable=False)
     artist = db.Column(db.String(100), nullable=False)
-    audio_file = db.Column(db.LargeBinary, nullable=False)
+    
+    # Accent/case-folded copies maintained for the search index
+    title_norm = db.Column(db.String(100))
+    artist_norm = db.Column(db.String(100))
+
+    # 64-bit perceptual signature (stored signed) and its 16-bit blocks,
+    # each indexed for near-duplicate lookups; see services.catalogue.duplicates
+    signature = db.Column(db.BigInteger)
+    signature_block0 = db.Column(db.Integer, index=True)
+    signature_block1 = db.Column(db.Integer, index=True)
+    signature_block2 = db.Column(db.Integer, index=True)
+    signature_block3 = db.Column(db.Integer, index=True)
+
+    @validates('title', 'artist')
+    def _normalize(self, key, value):
+        setattr(self, f'{key}_norm', normalize_text(value))
+        return value
 
     def serialize(self):
         return {
             'id': self.id,
             'title': self.title,
             'artist': self.artist
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,18 @@
+import time
+
+from services.catalogue.extensions import db
+
+class TrackChange(db.Model):
+    """Append-only log of tracks added to and removed from one shard.
+    
+    Rows are written in the same transaction as the change itself, so
+    the log never disagrees with the tracks table; see
+    services.catalogue.changes for the feed built on it.
+    """
+    __tablename__ = 'track_changes'
+    __table_args__ = {'sqlite_autoincrement': True}  # Never reuse a seq
+    
+    seq = db.Column(db.Integer, primary_key=True)
+    track_id = db.Column(db.String(64), nullable=False)
+    op = db.Column(db.String(6), nullable=False)  # 'add' or 'remove'
+    created_at = db.Column(db.Float, nullable=False, default=time.time)
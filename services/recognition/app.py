@@ -1,106 +1,435 @@
-from flask import Flask, jsonify, render_template
+from flask import Flask, jsonify, render_template, request, url_for
+from werkzeug.exceptions import BadRequest
 import requests
 import os
+from concurrent.futures import ThreadPoolExecutor
+from services.recognition.batch import close_batch, collect_batch_uploads
+from services.recognition.cache import RecognitionCache
+from services.recognition.catalogue_client import CatalogueUnavailable, HttpCatalogueClient
+from services.recognition.jobs import CallbackRejected, JobQueue, QueueFull
+from shared.fingerprint import fingerprint_audio
+from shared.http import get_client
+from shared.logs import configure_logging
+from shared.metrics import init_metrics, span
+from shared.signals import track_removed
 from shared.utils import (
+    AUDD_API_URL,
+    FRAGMENT_MAX_SECONDS,
+    MAX_UPLOAD_SIZE,
+    MULTIPART_OVERHEAD,
+    AudioProcessingError,
+    encode_wav,
     handle_errors,
+    internal_headers,
+    internal_only,
+    logger,
+    normalize_audio,
     validate_audio_format,
     validate_file_upload
 )
 
+TIMEOUT_ERROR_BODY = {
+    "error": "Request to external service timed out",
+    "code": "TIMEOUT_ERROR"
+}
+
+CATALOGUE_ERROR_BODY = {
+    "error": "Catalogue service unavailable",
+    "code": "CATALOGUE_ERROR"
+}
+
+NO_RECOGNITION_MATCH_BODY = {
+    "error": "No matching track found in recognition service",
+    "code": "NO_RECOGNITION_MATCH"
+}
+
+RECOGNITION_ERROR_BODY = {
+    "error": "Recognition service returned an error",
+    "code": "RECOGNITION_ERROR"
+}
+
+def catalogue_missing_body(audd_result):
+    return {
+        "error": "Recognized track not in catalogue",
+        "code": "CATALOGUE_MISSING",
+        "recognized_title": audd_result['title'],
+        "recognized_artist": audd_result['artist']
+    }
+
+def catalogue_failure(error):
+    """Response for a failed catalogue call (timeout vs outage)"""
+    if isinstance(error, requests.exceptions.Timeout):
+        return TIMEOUT_ERROR_BODY, 504
+    return CATALOGUE_ERROR_BODY, 502
+
+CATALOGUE_FAILURES = (requests.exceptions.RequestException, CatalogueUnavailable)
+
 def create_app():
+    configure_logging()
     app = Flask(__name__)
+    # Reject oversized bodies before Werkzeug buffers them
+    app.config['MAX_CONTENT_LENGTH'] = MAX_UPLOAD_SIZE + MULTIPART_OVERHEAD
+    init_metrics(app, 'recognition')
     AUDD_API_KEY = os.getenv('AUDD_API_KEY')
     GATEWAY_HOST = os.getenv('GATEWAY_HOST', 'localhost')
     GATEWAY_PORT = os.getenv('GATEWAY_PORT', 8000)
     CATALOGUE_BASE_URL = f"http://{GATEWAY_HOST}:{GATEWAY_PORT}/catalogue"
     
     headers = {
-        'X-Internal-Request': 'true',
+        **internal_headers(),
         'User-Agent': 'RecognitionService/1.0'
     }
+    
+    # Pooled keep-alive client for AudD.io; the catalogue is reached over
+    # HTTP unless the gateway installs an in-process client
+    audd = get_client(AUDD_API_URL)
+    app.extensions['catalogue_client'] = HttpCatalogueClient(
+        CATALOGUE_BASE_URL,
+        headers,
+        serialization=os.getenv('CATALOGUE_SERIALIZATION', 'json')
+    )
+    
+    # Recognition results keyed by fragment SHA-256
+    cache = RecognitionCache(
+        max_entries=int(os.getenv('RECOGNITION_CACHE_SIZE', 1024)),
+        positive_ttl=float(os.getenv('RECOGNITION_CACHE_POSITIVE_TTL', 3600)),
+        negative_ttl=float(os.getenv('RECOGNITION_CACHE_NEGATIVE_TTL', 300)),
+        path=os.getenv('RECOGNITION_CACHE_PATH')
+    )
+    app.extensions['recognition_cache'] = cache
+    
+    # Co-deployed catalogue announces deletions in-process; other workers
+    # learn of them through the shared tier (RECOGNITION_CACHE_PATH)
+    track_removed.connect(cache.on_track_removed)
+    if not cache.path and int(os.getenv('WEB_CONCURRENCY') or 1) > 1:
+        logger.warning("RECOGNITION_CACHE_PATH is unset: a removed track stays cached "
+                       "in other workers until its entries expire")
+
+    def catalogue():
+        """Active catalogue client; the gateway swaps in an in-process one"""
+        return app.extensions['catalogue_client']
+
+    def fragment_hashes(audio_file):
+        """Fingerprint a fragment, or None when it cannot be decoded"""
+        try:
+            audio_file.seek(0)
+            return fingerprint_audio(
+                audio_file, max_seconds=FRAGMENT_MAX_SECONDS, trim_silence=True
+            )
+        except AudioProcessingError as e:
+            logger.info("Skipping local match: %s", e)
+            return None
+
+    def match_fingerprints(audio_file):
+        """Look up a fragment in the catalogue's local hash index.
+        
+        Returns the matched track, or None when the fragment cannot be
+        fingerprinted or has no aligned match.
+        """
+        with span('fingerprint'):
+            hashes = fragment_hashes(audio_file)
+        if not hashes:
+            return None
+        with span('catalogue_match'):
+            return catalogue().match(hashes)
 
     @app.route('/health')
     def health():
+        if request.args.get('stats'):
+            return jsonify({
+                'status': 'Recognition operational',
+                'cache': cache.stats()
+            }), 200
         return 'Recognition operational', 200
     
     @app.route('/')
     def index():
         return render_template('index.html')
 
+    def audd_payload(audio_file):
+        """The fragment as sent to AudD.io: normalized mono at a low rate,
+        capped to FRAGMENT_MAX_SECONDS of sound. Files that cannot be
+        decoded are forwarded as uploaded.
+        """
+        try:
+            audio = normalize_audio(
+                audio_file, max_seconds=FRAGMENT_MAX_SECONDS, trim_silence=True
+            )
+        except AudioProcessingError as e:
+            logger.info("Forwarding fragment unnormalized: %s", e)
+            audio_file.seek(0)
+            return audio_file
+        return encode_wav(audio.samples, audio.sample_rate)
+
+    def audd_recognize(audio_file):
+        """AudD.io result for a fragment, or None when it is not recognized.
+        
+        Raises:
+            requests.exceptions.RequestException: For transport or HTTP errors
+        """
+        response = audd.post(
+            "/recognize",
+            files={'file': (audio_file.filename, audd_payload(audio_file))},
+            data={'api_token': AUDD_API_KEY}
+        )
+        response.raise_for_status()
+        return response.json().get('result')
+
+    def identify(audio_file):
+        """Resolve a validated fragment to a catalogue track.
+        
+        Returns:
+            Tuple of (response body, status code)
+        """
+        try:
+            # 2. Match locally against the catalogue fingerprint index
+            track = match_fingerprints(audio_file)
+            if track:
+                return track, 200
+
+            # 3. Fall back to AudD.io; failures map as for batch items
+            with span('audd'):
+                audd_result, error = recognize_remote(audio_file)
+            if error:
+                return error
+
+            # 4. Search the catalogue and fetch the best match in one hop;
+            #    audio is not inlined, clients stream it from audio_url
+            with span('catalogue_search'):
+                track = catalogue().find_track(audd_result['title'], audd_result['artist'])
+            if not track:
+                return catalogue_missing_body(audd_result), 404
+
+            return track, 200
+
+        except requests.exceptions.Timeout:
+            return TIMEOUT_ERROR_BODY, 504
+        
+        except (requests.exceptions.ConnectionError, CatalogueUnavailable):
+            # Catalogue unreachable, erroring, or its circuit is open
+            return CATALOGUE_ERROR_BODY, 502
+
+    def recognize_upload(audio_file):
+        """Serve a fragment from the cache, or identify and cache it"""
+        # Identical fragments (retries, shared clips) skip recognition
+        with span('cache'):
+            cached = cache.get(audio_file.sha256)
+        if cached:
+            return cached.body, cached.status
+
+        body, status = identify(audio_file)
+        cache.put(audio_file.sha256, body, status)
+        return body, status
+
+    def recognize_remote(audio_file):
+        """AudD.io stage of a batch item.
+        
+        Returns:
+            Tuple of (AudD.io result or None, error response or None)
+        """
+        try:
+            audd_result = audd_recognize(audio_file)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            # Unreachable, or failing fast while its circuit is open
+            return None, (TIMEOUT_ERROR_BODY, 504)
+        except requests.exceptions.RequestException as e:
+            logger.error("AudD.io request failed: %s", e)
+            return None, (RECOGNITION_ERROR_BODY, 502)
+        
+        if not audd_result:
+            return None, (NO_RECOGNITION_MATCH_BODY, 404)
+        return audd_result, None
+
+    def identify_batch(uploads):
+        """Resolve distinct fragments together.
+        
+        Fingerprinting and AudD.io calls run on the batch pool, while each
+        catalogue stage is one set-based call covering every fragment
+        still unresolved. A failure only affects the fragments it touched.
+        
+        Returns:
+            Dict of SHA-256 -> (response body, status code)
+        """
+        results = {}
+        pending = []
+        for upload in uploads:
+            cached = cache.get(upload.sha256)
+            if cached:
+                results[upload.sha256] = (cached.body, cached.status)
+            else:
+                pending.append(upload)
+        
+        # 1. Fingerprint concurrently, then match every fragment in one call
+        with span('fingerprint'):
+            fingerprinted = [
+                (upload, hashes)
+                for upload, hashes in zip(pending, batch_pool.map(fragment_hashes, pending))
+                if hashes
+            ]
+        if fingerprinted:
+            try:
+                with span('catalogue_match'):
+                    matches = catalogue().match_many([hashes for _, hashes in fingerprinted])
+            except CATALOGUE_FAILURES as e:
+                for upload in pending:
+                    results[upload.sha256] = catalogue_failure(e)
+            else:
+                for (upload, _), track in zip(fingerprinted, matches):
+                    if track:
+                        results[upload.sha256] = (track, 200)
+        
+        # 2. Fall back to AudD.io concurrently for the rest
+        unmatched = [upload for upload in pending if upload.sha256 not in results]
+        recognized = []
+        with span('audd'):
+            outcomes = list(batch_pool.map(recognize_remote, unmatched))
+        for upload, (audd_result, error) in zip(unmatched, outcomes):
+            if error:
+                results[upload.sha256] = error
+            else:
+                recognized.append((upload, audd_result))
+        
+        # 3. Resolve every recognized title/artist with one catalogue call
+        if recognized:
+            try:
+                with span('catalogue_search'):
+                    tracks = catalogue().find_tracks(
+                        [(audd_result['title'], audd_result['artist']) for _, audd_result in recognized]
+                    )
+            except CATALOGUE_FAILURES as e:
+                for upload, _ in recognized:
+                    results[upload.sha256] = catalogue_failure(e)
+            else:
+                for (upload, audd_result), track in zip(recognized, tracks):
+                    if track:
+                        results[upload.sha256] = (track, 200)
+                    else:
+                        results[upload.sha256] = (catalogue_missing_body(audd_result), 404)
+        
+        for upload in pending:
+            cache.put(upload.sha256, *results[upload.sha256])
+        return results
+
+    # Fingerprinting and AudD.io calls for batch requests; threads start
+    # on first use
+    batch_pool = ThreadPoolExecutor(
+        max_workers=int(os.getenv('RECOGNITION_BATCH_WORKERS', 8)),
+        thread_name_prefix='recognition-batch'
+    )
+    batch_max_items = int(os.getenv('RECOGNITION_BATCH_MAX_ITEMS', 50))
+
+    # Bounded background pool for ?async=1 requests. A job may be polled
+    # from any worker, so several server processes need a shared store
+    job_path = os.getenv('RECOGNITION_JOB_PATH')
+    if not job_path and int(os.getenv('WEB_CONCURRENCY') or 1) > 1:
+        os.makedirs(app.instance_path, exist_ok=True)
+        job_path = os.path.join(app.instance_path, 'jobs.db')
+    callback_hosts = os.getenv('RECOGNITION_WEBHOOK_ALLOWED_HOSTS', '')
+    jobs = JobQueue(
+        recognize_upload,
+        spool_dir=os.getenv('RECOGNITION_JOB_DIR', os.path.join(app.instance_path, 'jobs')),
+        workers=int(os.getenv('RECOGNITION_JOB_WORKERS', 2)),
+        max_queued=int(os.getenv('RECOGNITION_JOB_QUEUE_SIZE', 100)),
+        ttl=float(os.getenv('RECOGNITION_JOB_TTL', 3600)),
+        path=job_path,
+        allowed_callback_hosts=[host.strip() for host in callback_hosts.split(',') if host.strip()]
+    )
+    app.extensions['recognition_jobs'] = jobs
+
     @app.route('/api/recognize', methods=['POST'])
     @handle_errors
     def recognize():
-        """Audio recognition and catalogue matching endpoint"""
+        """Audio recognition and catalogue matching endpoint.
+        
+        With ?async=1 the fragment is queued and 202 is returned with a
+        job to poll; an optional callback_url form field receives the
+        finished job as a POST.
+        """
         # 1. Validate audio file upload
-        audio_file = validate_file_upload('audio_file')
+        with span('upload'):
+            audio_file = validate_file_upload('audio_file')
         validate_audio_format(audio_file.filename)
-        audio_bytes = audio_file.read()
 
-        try:
-            # 2. Recognize with AudD.io
-            audd_response = requests.post(
-                "https://api.audd.io/recognize",
-                files={'file': (audio_file.filename, audio_bytes)},
-                data={'api_token': AUDD_API_KEY},
-                timeout=10
-            )
-            audd_response.raise_for_status()
-            
-            audd_result = audd_response.json().get('result')
-            if not audd_result:
+        if request.args.get('async', '').lower() in ('1', 'true'):
+            try:
+                job = jobs.submit(audio_file, request.form.get('callback_url'))
+            except CallbackRejected as e:
+                raise BadRequest(str(e))
+            except QueueFull:
                 return jsonify({
-                    "error": "No matching track found in recognition service",
-                    "code": "NO_RECOGNITION_MATCH"
-                }), 404
-
-            # 3. Search catalogue for matches
-            search_params = {
-                'title': audd_result['title'],
-                'artist': audd_result['artist']
-            }
-            catalogue_response = requests.get(
-                f"{CATALOGUE_BASE_URL}/tracks/search",
-                params=search_params,
-                headers=headers,
-                timeout=10 
-            )
+                    "error": "Recognition queue is full, retry later",
+                    "code": "QUEUE_FULL"
+                }), 503
             
-            if catalogue_response.status_code != 200:
-                return jsonify({
-                    "error": "Catalogue service unavailable",
-                    "code": "CATALOGUE_ERROR"
-                }), 502
+            response = jsonify(job.to_dict())
+            response.status_code = 202
+            response.headers['Location'] = url_for('get_job', job_id=job.id)
+            return response
 
-            matches = catalogue_response.json().get('data', [])
-            if not matches:
-                return jsonify({
-                    "error": "Recognized track not in catalogue",
-                    "code": "CATALOGUE_MISSING",
-                    "recognized_title": audd_result['title'],
-                    "recognized_artist": audd_result['artist']
-                }), 404
-
-            # 4. Get full track details from catalogue
-            track_id = matches[0]['id']
-            catalogue_response = requests.get(
-                f"{CATALOGUE_BASE_URL}/tracks/{track_id}",
-                headers={'X-Internal-Request': 'true'},
-                timeout=10
-            )
-            
-            if catalogue_response.status_code != 200:
-                return jsonify({
-                    "error": "Failed to retrieve track details",
-                    "code": "TRACK_FETCH_ERROR"
-                }), 502
+        body, status = recognize_upload(audio_file)
+        return jsonify(body), status
 
-            return jsonify(catalogue_response.json()['data'])
+    @app.route('/api/recognize/batch', methods=['POST'])
+    @handle_errors
+    def recognize_batch():
+        """Recognize many fragments in one request.
+        
+        Accepts repeated audio_file parts and/or zip/tar archive parts.
+        Duplicate fragments are recognized once. Every item gets its own
+        status and body, so one bad fragment does not fail the batch.
+        """
+        items = collect_batch_uploads(batch_max_items)
+        try:
+            unique = {}
+            for item in items:
+                if item.upload:
+                    unique.setdefault(item.upload.sha256, item.upload)
+            outcomes = identify_batch(list(unique.values()))
+        finally:
+            close_batch(items)
+        
+        results = []
+        for index, item in enumerate(items):
+            if item.error:
+                body, status = {"error": item.error, "code": "INVALID_AUDIO"}, 400
+            else:
+                body, status = outcomes[item.upload.sha256]
+            results.append({
+                'index': index,
+                'filename': item.filename,
+                'sha256': item.upload.sha256 if item.upload else None,
+                'status': status,
+                'body': body
+            })
+        
+        succeeded = sum(1 for result in results if result['status'] == 200)
+        return jsonify({
+            'results': results,
+            'summary': {
+                'total': len(results),
+                'unique': len(unique),
+                'succeeded': succeeded,
+                'failed': len(results) - succeeded
+            }
+        }), 200
 
-        except requests.exceptions.Timeout:
+    @app.route('/api/recognize/jobs/<string:job_id>', methods=['GET'])
+    def get_job(job_id):
+        """Status, timings and (once finished) result of an async job"""
+        job = jobs.get(job_id)
+        if not job:
             return jsonify({
-                "error": "Request to external service timed out",
-                "code": "TIMEOUT_ERROR"
-            }), 504
+                "error": "Job not found",
+                "code": "JOB_NOT_FOUND"
+            }), 404
+        return jsonify(job.to_dict()), 200
+
+    @app.route('/api/cache/tracks/<string:track_id>', methods=['DELETE'])
+    @internal_only
+    def invalidate_track(track_id):
+        """Drop cached matches for a removed track (separately deployed catalogue)"""
+        cache.invalidate_track(track_id)
+        return '', 204
 
     return app
 
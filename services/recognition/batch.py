@@ -0,0 +1,101 @@
+import os
+import tarfile
+import zipfile
+from typing import BinaryIO, Iterator, List, NamedTuple, Optional, Tuple
+
+from flask import request
+from werkzeug.exceptions import BadRequest
+
+from shared.utils import (
+    MAX_UPLOAD_SIZE,
+    AudioUpload,
+    spool_audio_stream,
+    validate_audio_format
+)
+
+
+class BatchItem(NamedTuple):
+    """One fragment of a batch: a validated upload, or why it was rejected"""
+    filename: str
+    upload: Optional[AudioUpload]
+    error: Optional[str] = None
+
+
+def collect_batch_uploads(max_items: int, max_size: int = MAX_UPLOAD_SIZE) -> List[BatchItem]:
+    """Validate every fragment of a batch request.
+
+    Fragments arrive as repeated audio_file parts and/or archive parts
+    (zip or tar, optionally compressed). Each is streamed once through
+    the usual validation; a bad fragment becomes an error item rather
+    than failing the whole batch.
+
+    Args:
+        max_items: Maximum fragments accepted in one request
+        max_size: Maximum size of a single fragment in bytes
+
+    Returns:
+        Items in upload order
+
+    Raises:
+        BadRequest: If nothing was uploaded, an archive is unreadable or
+            max_items is exceeded
+    """
+    items = []
+
+    def sources() -> Iterator[Tuple[str, BinaryIO]]:
+        for file in request.files.getlist('audio_file'):
+            yield file.filename, file.stream
+        for archive in request.files.getlist('archive'):
+            yield from _archive_members(archive.stream)
+
+    try:
+        for filename, stream in sources():
+            if len(items) >= max_items:
+                raise BadRequest(f"At most {max_items} fragments per batch")
+            try:
+                if not filename:
+                    raise BadRequest("Empty filename")
+                validate_audio_format(filename)
+                spool, sha256, size = spool_audio_stream(stream, max_size)
+                items.append(BatchItem(filename, AudioUpload(filename, spool, sha256, size)))
+            except BadRequest as e:
+                items.append(BatchItem(filename or '', None, e.description))
+    except BaseException:
+        close_batch(items)
+        raise
+
+    if not items:
+        raise BadRequest("No audio_file or archive uploaded")
+    return items
+
+
+def close_batch(items: List[BatchItem]):
+    """Release the spooled files of a batch"""
+    for item in items:
+        if item.upload:
+            item.upload.close()
+
+
+def _archive_members(stream: BinaryIO) -> Iterator[Tuple[str, BinaryIO]]:
+    """Yield (name, stream) for each regular file in a zip or tar archive.
+
+    Tar archives are read sequentially; zip needs a seekable stream,
+    which Werkzeug's spooled form parts provide.
+    """
+    if zipfile.is_zipfile(stream):
+        stream.seek(0)
+        with zipfile.ZipFile(stream) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    with archive.open(info) as member:
+                        yield os.path.basename(info.filename), member
+        return
+
+    stream.seek(0)
+    try:
+        with tarfile.open(fileobj=stream, mode='r|*') as archive:
+            for member in archive:
+                if member.isfile():
+                    yield os.path.basename(member.name), archive.extractfile(member)
+    except tarfile.TarError:
+        raise BadRequest("Archive must be a zip or tar file")
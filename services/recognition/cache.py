@@ -0,0 +1,216 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+from shared.utils import logger
+
+
+class CacheEntry(NamedTuple):
+    status: int
+    body: Dict
+    track_id: Optional[str]
+    expires_at: float
+
+
+class RecognitionCache:
+    """Two-tier cache of recognition responses keyed by fragment SHA-256.
+
+    Positive entries (a catalogue track was found) and negative entries
+    (no recognition match, or recognized but not in the catalogue) get
+    separate TTLs. The memory tier is a bounded LRU private to the
+    worker; the optional SQLite tier is shared by every worker pointing at
+    the same path. Entries are dropped from both tiers when their track
+    is removed from the catalogue. Removals are also logged in the SQLite
+    tier, and each worker applies newly logged ones to its memory tier
+    before serving a hit from it.
+    """
+
+    # Responses worth remembering; errors and timeouts are always retried
+    CACHEABLE_STATUSES = {200, 404}
+
+    def __init__(self, max_entries: int = 1024, positive_ttl: float = 3600,
+                 negative_ttl: float = 300, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._counters = {'hits': 0, 'misses': 0, 'memory_hits': 0, 'disk_hits': 0}
+        # Last invalidation logged in the shared tier that this worker applied
+        self._invalidation_seq = 0
+        if path:
+            self._create_table()
+            self._invalidation_seq = self._connection().execute(
+                "SELECT COALESCE(MAX(seq), 0) FROM recognition_cache_invalidations"
+            ).fetchone()[0]
+
+    # --------------------------
+    # Public API
+    # --------------------------
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return a live entry, promoting disk hits into memory"""
+        now = time.time()
+        self._apply_invalidations()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self._count('hits', 'memory_hits')
+                return entry
+            if entry:
+                del self._entries[key]
+
+        entry = self._disk_get(key, now)
+        with self._lock:
+            if entry:
+                self._remember(key, entry)
+                self._count('hits', 'disk_hits')
+            else:
+                self._count('misses')
+        return entry
+
+    def put(self, key: str, body: Dict, status: int):
+        """Store a response if its status is cacheable"""
+        if status not in self.CACHEABLE_STATUSES:
+            return
+
+        track_id = body.get('id') if status == 200 else None
+        ttl = self.positive_ttl if track_id else self.negative_ttl
+        entry = CacheEntry(status, body, track_id, time.time() + ttl)
+
+        with self._lock:
+            self._remember(key, entry)
+        self._disk_put(key, entry)
+
+    def invalidate_track(self, track_id: str):
+        """Drop every positive entry that resolved to track_id"""
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.track_id == track_id]
+            for key in stale:
+                del self._entries[key]
+        if self.path:
+            with self._connection() as connection:
+                connection.execute("DELETE FROM recognition_cache WHERE track_id = ?", (track_id,))
+                connection.execute(
+                    "INSERT INTO recognition_cache_invalidations (track_id, created_at) VALUES (?, ?)",
+                    (track_id, time.time())
+                )
+        logger.info("Invalidated %d cached recognitions for track %s", len(stale), track_id)
+
+    def on_track_removed(self, sender, track_id: str):
+        """Receiver for the in-process track_removed signal"""
+        self.invalidate_track(track_id)
+
+    def reset_after_fork(self):
+        """Forget SQLite connections inherited from a parent process"""
+        self._local = threading.local()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {**self._counters, 'size': len(self._entries), 'max_entries': self.max_entries}
+
+    # --------------------------
+    # Memory tier
+    # --------------------------
+
+    def _remember(self, key: str, entry: CacheEntry):
+        """Insert into the LRU, evicting the oldest entries (lock held)"""
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _apply_invalidations(self):
+        """Drop memory entries for tracks other workers have invalidated"""
+        if not self.path:
+            return
+        rows = self._connection().execute(
+            "SELECT seq, track_id FROM recognition_cache_invalidations WHERE seq > ? ORDER BY seq",
+            (self._invalidation_seq,)
+        ).fetchall()
+        if not rows:
+            return
+        track_ids = {track_id for _, track_id in rows}
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.track_id in track_ids]
+            for key in stale:
+                del self._entries[key]
+            self._invalidation_seq = max(self._invalidation_seq, rows[-1][0])
+
+    def _count(self, *names: str):
+        for name in names:
+            self._counters[name] += 1
+
+    # --------------------------
+    # Disk tier
+    # --------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL lets workers read while one writes"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _create_table(self):
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS recognition_cache (
+                    key TEXT PRIMARY KEY,
+                    status INTEGER NOT NULL,
+                    body TEXT NOT NULL,
+                    track_id TEXT,
+                    expires_at REAL NOT NULL
+                )
+            """)
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_recognition_cache_track_id ON recognition_cache (track_id)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_recognition_cache_expires_at ON recognition_cache (expires_at)"
+            )
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS recognition_cache_invalidations (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    track_id TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+
+    def _disk_get(self, key: str, now: float) -> Optional[CacheEntry]:
+        if not self.path:
+            return None
+        row = self._connection().execute(
+            "SELECT status, body, track_id, expires_at FROM recognition_cache WHERE key = ? AND expires_at > ?",
+            (key, now)
+        ).fetchone()
+        if not row:
+            return None
+        status, body, track_id, expires_at = row
+        return CacheEntry(status, json.loads(body), track_id, expires_at)
+
+    def _disk_put(self, key: str, entry: CacheEntry):
+        if not self.path:
+            return
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO recognition_cache VALUES (?, ?, ?, ?, ?)",
+                (key, entry.status, json.dumps(entry.body), entry.track_id, entry.expires_at)
+            )
+            # Expired rows are purged opportunistically on write, and
+            # invalidations once no memory tier can still hold the entries
+            now = time.time()
+            connection.execute("DELETE FROM recognition_cache WHERE expires_at <= ?", (now,))
+            connection.execute(
+                "DELETE FROM recognition_cache_invalidations WHERE created_at <= ?",
+                (now - max(self.positive_ttl, self.negative_ttl),)
+            )
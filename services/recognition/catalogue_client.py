@@ -0,0 +1,137 @@
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from shared.fingerprint import HashPair
+from shared.http import get_client
+from shared.metrics import request_id_headers
+from shared.serialization import MSGPACK_MIMETYPE, msgpack_available, packb, unpackb
+
+logger = logging.getLogger(__name__)
+
+
+class CatalogueUnavailable(Exception):
+    """The catalogue answered with an unexpected error status"""
+    pass
+
+
+class CatalogueClient:
+    """Operations the recognition service needs from the catalogue"""
+
+    def match(self, hashes: List[HashPair]) -> Optional[Dict]:
+        """Best fingerprint match for a fragment, or None"""
+        raise NotImplementedError
+
+    def find_track(self, title: str, artist: str) -> Optional[Dict]:
+        """Best metadata search match with its details, or None"""
+        raise NotImplementedError
+
+    def match_many(self, fragments: List[List[HashPair]]) -> List[Optional[Dict]]:
+        """Best fingerprint match or None per fragment, in one call"""
+        raise NotImplementedError
+
+    def find_tracks(self, queries: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        """Best match or None per (title, artist) pair, in one call"""
+        raise NotImplementedError
+
+
+class HttpCatalogueClient(CatalogueClient):
+    """Catalogue deployed as a separate service, reached over pooled HTTP.
+
+    With serialization='msgpack' (and the msgpack package installed)
+    requests and responses are MessagePack rather than JSON, which is
+    smaller and cheaper to encode for fingerprint hash lists. Transport
+    failures propagate as requests exceptions so callers can tell
+    timeouts from outages.
+    """
+
+    def __init__(self, base_url: str, headers: Dict[str, str], serialization: str = 'json'):
+        self.http = get_client(base_url)
+        self.headers = headers
+        self.use_msgpack = serialization == 'msgpack'
+        if self.use_msgpack and not msgpack_available():
+            logger.warning("msgpack is not installed; catalogue calls will use JSON")
+            self.use_msgpack = False
+
+    def match(self, hashes: List[HashPair]) -> Optional[Dict]:
+        return self._data(self._post("/tracks/match", {'hashes': hashes}))
+
+    def find_track(self, title: str, artist: str) -> Optional[Dict]:
+        response = self.http.get(
+            "/tracks/search-and-fetch",
+            params={'title': title, 'artist': artist},
+            headers=self._headers()
+        )
+        return self._data(response)
+
+    def match_many(self, fragments: List[List[HashPair]]) -> List[Optional[Dict]]:
+        return self._data(self._post("/tracks/match/batch", {'fragments': fragments}))
+
+    def find_tracks(self, queries: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        return self._data(self._post(
+            "/tracks/search-and-fetch/batch",
+            {'queries': [{'title': title, 'artist': artist} for title, artist in queries]}
+        ))
+
+    def _post(self, path: str, payload: Dict[str, Any]):
+        if not self.use_msgpack:
+            return self.http.post(path, json=payload, headers=self._headers())
+        return self.http.post(
+            path,
+            data=packb(payload),
+            headers={**self._headers(), 'Content-Type': MSGPACK_MIMETYPE}
+        )
+
+    def _headers(self) -> Dict[str, str]:
+        # The catalogue logs and times the call under the caller's request id
+        headers = {**self.headers, **request_id_headers()}
+        if self.use_msgpack:
+            headers['Accept'] = MSGPACK_MIMETYPE
+        return headers
+
+    def _data(self, response) -> Optional[Dict]:
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise CatalogueUnavailable(f"Catalogue returned {response.status_code}")
+        if self.use_msgpack and response.headers.get('Content-Type', '').startswith(MSGPACK_MIMETYPE):
+            return unpackb(response.content)['data']
+        return response.json()['data']
+
+
+class LocalCatalogueClient(CatalogueClient):
+    """Catalogue app mounted in the same process (e.g. under the gateway).
+
+    Calls the catalogue's query functions directly inside its app
+    context: no HTTP hop, no JSON round-trip, and search plus fetch is a
+    single database query.
+    """
+
+    def __init__(self, catalogue_app, url_prefix: str = ''):
+        self.app = catalogue_app
+        self.url_prefix = url_prefix
+
+    def match(self, hashes: List[HashPair]) -> Optional[Dict]:
+        from services.catalogue.matching import match_fragment
+        with self.app.app_context():
+            return self._with_audio_url(match_fragment(hashes))
+
+    def find_track(self, title: str, artist: str) -> Optional[Dict]:
+        from services.catalogue.search import search_catalogue
+        with self.app.app_context():
+            matches = search_catalogue(title, artist, limit=1)
+        return self._with_audio_url(matches[0] if matches else None)
+
+    def match_many(self, fragments: List[List[HashPair]]) -> List[Optional[Dict]]:
+        from services.catalogue.matching import match_fragments
+        with self.app.app_context():
+            return [self._with_audio_url(match) for match in match_fragments(fragments)]
+
+    def find_tracks(self, queries: List[Tuple[str, str]]) -> List[Optional[Dict]]:
+        from services.catalogue.search import find_tracks
+        with self.app.app_context():
+            return [self._with_audio_url(track) for track in find_tracks(queries)]
+
+    def _with_audio_url(self, track: Optional[Dict]) -> Optional[Dict]:
+        if track is None:
+            return None
+        return {**track, 'audio_url': f"{self.url_prefix}/tracks/{track['id']}/audio"}
@@ -0,0 +1,431 @@
+import ipaddress
+import json
+import os
+import queue
+import shutil
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Collection, Dict, List, Optional, Set, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.utils import AudioUpload, logger
+
+# Seconds between a process's heartbeats for the jobs it is running
+JOB_HEARTBEAT_INTERVAL = 10
+# A running job whose owner has not sent a heartbeat for this long is
+# re-queued (its process died)
+JOB_STALE_AFTER = 60
+
+
+class QueueFull(Exception):
+    """No capacity to accept another job"""
+    pass
+
+
+class CallbackRejected(ValueError):
+    """A callback_url that jobs may not deliver to"""
+    pass
+
+
+@dataclass
+class Job:
+    id: str
+    filename: str
+    sha256: str
+    size: int
+    file_path: str
+    callback_url: Optional[str] = None
+    status: str = 'queued'  # queued -> running -> done | failed
+    status_code: Optional[int] = None
+    result: Optional[Dict] = None
+    created_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+
+    def to_dict(self) -> Dict:
+        """Public representation with per-stage timings"""
+        timings = {}
+        if self.started_at:
+            timings['queued_ms'] = round((self.started_at - self.created_at) * 1000, 1)
+        if self.finished_at:
+            timings['processing_ms'] = round((self.finished_at - self.started_at) * 1000, 1)
+            timings['total_ms'] = round((self.finished_at - self.created_at) * 1000, 1)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'status_code': self.status_code,
+            'result': self.result,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'timings': timings
+        }
+
+
+# --------------------------
+# Job Stores
+# --------------------------
+
+class MemoryJobStore:
+    """Jobs held in this process only; lost on restart"""
+
+    def __init__(self):
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def save(self, job: Job):
+        with self._lock:
+            self._jobs[job.id] = job
+
+    def load(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def delete(self, job_id: str):
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def claim(self, job_id: str, owner: str) -> Optional[Job]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.status != 'queued':
+                return None
+            job.status = 'running'
+            job.started_at = time.time()
+            return job
+
+    def heartbeat(self, owner: str):
+        pass
+
+    def recover(self, stale_before: float) -> List[str]:
+        # Only this process ever sees these jobs
+        return []
+
+    def reset_after_fork(self):
+        pass
+
+    def purge(self, before: float) -> List[Job]:
+        with self._lock:
+            expired = [job for job in self._jobs.values() if job.finished_at and job.finished_at < before]
+            for job in expired:
+                del self._jobs[job.id]
+        return expired
+
+
+class SQLiteJobStore:
+    """Jobs persisted to SQLite so queued work survives a restart.
+
+    Every worker process pointing at the same file shares the jobs. A
+    job is claimed atomically before it runs, and its owner's heartbeat
+    shows when a running job was orphaned by a process that died.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS recognition_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    finished_at REAL,
+                    job TEXT NOT NULL,
+                    owner TEXT,
+                    heartbeat_at REAL
+                )
+            """)
+            # Files created before jobs were claimed lack the owner columns
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(recognition_jobs)")}
+            for column, kind in (('owner', 'TEXT'), ('heartbeat_at', 'REAL')):
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE recognition_jobs ADD COLUMN {column} {kind}")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS ix_recognition_jobs_status ON recognition_jobs (status)"
+            )
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def reset_after_fork(self):
+        """Forget SQLite connections inherited from a parent process"""
+        self._local = threading.local()
+
+    def save(self, job: Job):
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT INTO recognition_jobs (id, status, finished_at, job) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET status = excluded.status, "
+                "finished_at = excluded.finished_at, job = excluded.job",
+                (job.id, job.status, job.finished_at, json.dumps(asdict(job)))
+            )
+
+    def load(self, job_id: str) -> Optional[Job]:
+        row = self._connection().execute(
+            "SELECT job FROM recognition_jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        return Job(**json.loads(row[0])) if row else None
+
+    def delete(self, job_id: str):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM recognition_jobs WHERE id = ?", (job_id,))
+
+    def claim(self, job_id: str, owner: str) -> Optional[Job]:
+        """Mark a queued job running for owner; None if another worker got it"""
+        now = time.time()
+        with self._connection() as connection:
+            claimed = connection.execute(
+                "UPDATE recognition_jobs SET status = 'running', owner = ?, heartbeat_at = ?, "
+                "job = json_set(job, '$.status', 'running', '$.started_at', ?) "
+                "WHERE id = ? AND status = 'queued'",
+                (owner, now, now, job_id)
+            ).rowcount
+        return self.load(job_id) if claimed == 1 else None
+
+    def heartbeat(self, owner: str):
+        with self._connection() as connection:
+            connection.execute(
+                "UPDATE recognition_jobs SET heartbeat_at = ? WHERE status = 'running' AND owner = ?",
+                (time.time(), owner)
+            )
+
+    def recover(self, stale_before: float) -> List[str]:
+        """Re-queue running jobs whose owner stopped sending heartbeats.
+
+        Returns the ids of every queued job, oldest first, for this
+        process to offer its workers; a claim decides which worker runs
+        each one.
+        """
+        with self._connection() as connection:
+            connection.execute(
+                "UPDATE recognition_jobs SET status = 'queued', owner = NULL, heartbeat_at = NULL, "
+                "job = json_set(job, '$.status', 'queued', '$.started_at', NULL) "
+                "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (stale_before,)
+            )
+            rows = connection.execute(
+                "SELECT id FROM recognition_jobs WHERE status = 'queued' ORDER BY rowid"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def purge(self, before: float) -> List[Job]:
+        with self._connection() as connection:
+            rows = connection.execute(
+                "SELECT job FROM recognition_jobs WHERE finished_at < ?", (before,)
+            ).fetchall()
+            connection.execute("DELETE FROM recognition_jobs WHERE finished_at < ?", (before,))
+        return [Job(**json.loads(row[0])) for row in rows]
+
+
+# --------------------------
+# Job Queue
+# --------------------------
+
+class JobQueue:
+    """Bounded pool of worker threads processing recognition jobs.
+
+    Uploads are copied to spool_dir so they outlive the request. Workers
+    start lazily on the first submission, so a pre-forking server does
+    not fork live threads. A job is claimed in the store before it runs,
+    so each runs once even when several processes share a SQLite store.
+    A supervisor thread sends heartbeats for this process's running jobs
+    and offers its workers queued jobs, including those left running by a
+    process that stopped sending heartbeats.
+    """
+
+    def __init__(self, process: Callable[[AudioUpload], Tuple[Dict, int]],
+                 spool_dir: str, workers: int = 2, max_queued: int = 100,
+                 ttl: float = 3600, path: Optional[str] = None,
+                 allowed_callback_hosts: Collection[str] = ()):
+        self.process = process
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.ttl = ttl
+        self.allowed_callback_hosts = {host.lower() for host in allowed_callback_hosts}
+        self.store = SQLiteJobStore(path) if path else MemoryJobStore()
+        self._queue = queue.Queue(maxsize=max_queued)
+        # Ids waiting in _queue, so recovery does not offer them twice
+        self._pending: Set[str] = set()
+        self._pending_lock = threading.Lock()
+        self._owner: Optional[str] = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._webhooks = _webhook_session(self.workers)
+
+    def submit(self, upload: AudioUpload, callback_url: Optional[str] = None) -> Job:
+        """Spool an upload and enqueue it.
+
+        Raises:
+            QueueFull: If max_queued jobs are already waiting
+            CallbackRejected: If callback_url is not a public http(s) URL
+        """
+        if callback_url:
+            self.check_callback_url(callback_url)
+        self._ensure_started()
+        self._purge_expired()
+
+        job_id = uuid.uuid4().hex
+        file_path = os.path.join(self.spool_dir, f"{job_id}.wav")
+        os.makedirs(self.spool_dir, exist_ok=True)
+        upload.seek(0)
+        with open(file_path, 'wb') as spool:
+            shutil.copyfileobj(upload, spool)
+
+        job = Job(job_id, upload.filename, upload.sha256, upload.size, file_path, callback_url)
+        self.store.save(job)
+        if not self._enqueue(job_id):
+            self.store.delete(job_id)
+            self._remove_spool(job)
+            raise QueueFull("Recognition job queue is full")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self._ensure_started()
+        return self.store.load(job_id)
+
+    def check_callback_url(self, url: str):
+        """Refuse webhooks to anything but public addresses.
+
+        With allowed_callback_hosts set, only those hosts are accepted
+        (and trusted whatever they resolve to).
+
+        Raises:
+            CallbackRejected: With the reason
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise CallbackRejected("callback_url must be an http(s) URL")
+        host = parts.hostname.lower()
+        if self.allowed_callback_hosts:
+            if host not in self.allowed_callback_hosts:
+                raise CallbackRejected("callback_url host is not allowed")
+            return
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None)}
+        except (socket.gaierror, UnicodeError):
+            raise CallbackRejected("callback_url host does not resolve")
+        for address in addresses:
+            if not ipaddress.ip_address(address.split('%', 1)[0]).is_global:
+                raise CallbackRejected("callback_url must resolve to a public address")
+
+    def reset_after_fork(self):
+        """Start over in a forked worker: the parent's threads and queue do not exist here"""
+        self.store.reset_after_fork()
+        self._queue = queue.Queue(maxsize=self._queue.maxsize)
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._owner = None
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._webhooks = _webhook_session(self.workers)
+
+    def _ensure_started(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+            # The pid alone could be reused by a later process
+            self._owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+            for i in range(self.workers):
+                threading.Thread(target=self._work, name=f"recognition-job-{i}", daemon=True).start()
+            threading.Thread(target=self._supervise, name="recognition-job-supervisor", daemon=True).start()
+
+    def _enqueue(self, job_id: str) -> bool:
+        """Offer a job to this process's workers; False when the queue is full"""
+        with self._pending_lock:
+            if job_id in self._pending:
+                return True
+            try:
+                self._queue.put_nowait(job_id)
+            except queue.Full:
+                return False
+            self._pending.add(job_id)
+            return True
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            with self._pending_lock:
+                self._pending.discard(job_id)
+            job = self.store.claim(job_id, self._owner)
+            if job:
+                self._run(job)
+
+    def _supervise(self):
+        while True:
+            try:
+                self.store.heartbeat(self._owner)
+                for job_id in self.store.recover(time.time() - JOB_STALE_AFTER):
+                    if not self._enqueue(job_id):
+                        break
+            except sqlite3.Error as e:
+                logger.warning("Recognition job supervisor failed: %s", e)
+            time.sleep(JOB_HEARTBEAT_INTERVAL)
+
+    def _run(self, job: Job):
+        try:
+            with open(job.file_path, 'rb') as stream:
+                body, status = self.process(AudioUpload(job.filename, stream, job.sha256, job.size))
+            job.status = 'done'
+        except Exception as e:
+            logger.error("Recognition job %s failed: %s", job.id, e, exc_info=True)
+            body, status = {"error": "Internal server error"}, 500
+            job.status = 'failed'
+
+        job.result, job.status_code = body, status
+        job.finished_at = time.time()
+        self.store.save(job)
+        self._remove_spool(job)
+
+        if job.callback_url:
+            self._notify(job)
+
+    def _notify(self, job: Job):
+        """POST the finished job to its webhook; failures are only logged"""
+        try:
+            # Checked again: the host may resolve differently by now
+            self.check_callback_url(job.callback_url)
+            self._webhooks.post(
+                job.callback_url, json=job.to_dict(), allow_redirects=False,
+                timeout=(float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+                         float(os.getenv('HTTP_READ_TIMEOUT', 10)))
+            )
+        except (CallbackRejected, requests.exceptions.RequestException) as e:
+            logger.warning("Webhook for job %s failed: %s", job.id, e)
+
+    def _purge_expired(self):
+        for job in self.store.purge(time.time() - self.ttl):
+            self._remove_spool(job)
+
+    @staticmethod
+    def _remove_spool(job: Job):
+        try:
+            os.remove(job.file_path)
+        except FileNotFoundError:
+            pass
+
+
+def _webhook_session(workers: int) -> requests.Session:
+    """One session for every webhook, kept apart from the service clients.
+
+    Its pool keeps connections to a bounded number of recent hosts, so
+    arbitrary callback hosts do not accumulate clients or sockets.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=int(os.getenv('HTTP_POOL_SIZE', 10)),
+                          pool_maxsize=max(workers, 1))
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = 'RecognitionService/1.0'
+    return session
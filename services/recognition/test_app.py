@@ -1,4 +1,5 @@
 import pytest
+from io import BytesIO
 from flask import Flask
 from flask.testing import FlaskClient
 from unittest.mock import patch, MagicMock
@@ -28,8 +29,8 @@ def test_index(client: FlaskClient):
 
 @patch('services.recognition.app.validate_file_upload')
 @patch('services.recognition.app.validate_audio_format')
-@patch('services.recognition.app.requests.post')
-@patch('services.recognition.app.requests.get')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
 def test_recognize_success(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
     mock_file = MagicMock()
     mock_file.filename = 'test.wav'
@@ -44,10 +45,7 @@ def test_recognize_success(mock_get, mock_post, mock_validate_format, mock_valid
         }
     }
 
-    mock_get.side_effect = [
-        MagicMock(status_code=200, json=lambda: {'data': [{'id': '123'}]}),
-        MagicMock(status_code=200, json=lambda: {'data': {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist'}})
-    ]
+    mock_get.return_value = MagicMock(status_code=200, json=lambda: {'data': {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist'}})
 
     response = client.post('/api/recognize', data={'audio_file': (mock_file, 'test.wav')})
     assert response.status_code == 200
@@ -55,8 +53,31 @@ def test_recognize_success(mock_get, mock_post, mock_validate_format, mock_valid
 
 @patch('services.recognition.app.validate_file_upload')
 @patch('services.recognition.app.validate_audio_format')
-@patch('services.recognition.app.requests.post')
-@patch('services.recognition.app.requests.get')
+@patch('services.recognition.app.fingerprint_audio')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
+def test_recognize_local_match(mock_get, mock_post, mock_fingerprint, mock_validate_format, mock_validate_upload, client: FlaskClient):
+    mock_file = MagicMock()
+    mock_file.filename = 'test.wav'
+    mock_file.read.return_value = b'audio data'
+    mock_validate_upload.return_value = mock_file
+    mock_fingerprint.return_value = [(1, 0), (2, 3)]
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {'data': {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist', 'votes': 12}}
+
+    response = client.post('/api/recognize', data={'audio_file': (mock_file, 'test.wav')})
+    assert response.status_code == 200
+    assert response.json == {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist', 'votes': 12}
+    # Matched locally, so neither AudD.io nor a catalogue search is called
+    mock_post.assert_called_once()
+    assert mock_post.call_args.args[0].endswith('/tracks/match')
+    mock_get.assert_not_called()
+
+@patch('services.recognition.app.validate_file_upload')
+@patch('services.recognition.app.validate_audio_format')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
 def test_recognize_no_match(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
     mock_file = MagicMock()
     mock_file.filename = 'test.wav'
@@ -75,8 +96,8 @@ def test_recognize_no_match(mock_get, mock_post, mock_validate_format, mock_vali
 
 @patch('services.recognition.app.validate_file_upload')
 @patch('services.recognition.app.validate_audio_format')
-@patch('services.recognition.app.requests.post')
-@patch('services.recognition.app.requests.get')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
 def test_recognize_catalogue_error(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
     mock_file = MagicMock()
     mock_file.filename = 'test.wav'
@@ -102,8 +123,8 @@ def test_recognize_catalogue_error(mock_get, mock_post, mock_validate_format, mo
 
 @patch('services.recognition.app.validate_file_upload')
 @patch('services.recognition.app.validate_audio_format')
-@patch('services.recognition.app.requests.post')
-@patch('services.recognition.app.requests.get')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
 def test_recognize_timeout(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
     mock_file = MagicMock()
     mock_file.filename = 'test.wav'
@@ -118,3 +139,486 @@ def test_recognize_timeout(mock_get, mock_post, mock_validate_format, mock_valid
         "error": "Request to external service timed out",
         "code": "TIMEOUT_ERROR"
     }
+
+@patch('services.recognition.app.validate_file_upload')
+@patch('services.recognition.app.validate_audio_format')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
+def test_recognize_audd_http_error(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
+    mock_file = MagicMock()
+    mock_file.filename = 'test.wav'
+    mock_file.read.return_value = b'audio data'
+    mock_validate_upload.return_value = mock_file
+
+    mock_post.return_value.status_code = 500
+    mock_post.return_value.raise_for_status.side_effect = requests.exceptions.HTTPError
+
+    response = client.post('/api/recognize', data={'audio_file': (mock_file, 'test.wav')})
+    assert response.status_code == 502
+    assert response.json == {
+        "error": "Recognition service returned an error",
+        "code": "RECOGNITION_ERROR"
+    }
+
+@patch('services.recognition.app.validate_file_upload')
+@patch('services.recognition.app.validate_audio_format')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
+def test_recognize_cached(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
+    mock_file = MagicMock()
+    mock_file.filename = 'test.wav'
+    mock_file.sha256 = 'a' * 64
+    mock_file.read.return_value = b'audio data'
+    mock_validate_upload.return_value = mock_file
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        'result': {
+            'title': 'Test Title',
+            'artist': 'Test Artist'
+        }
+    }
+    mock_get.return_value = MagicMock(status_code=200, json=lambda: {'data': {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist'}})
+
+    first = client.post('/api/recognize', data={'audio_file': (BytesIO(b'audio data'), 'test.wav')})
+    second = client.post('/api/recognize', data={'audio_file': (BytesIO(b'audio data'), 'test.wav')})
+    assert first.json == second.json
+    assert mock_post.call_count == 1
+    assert mock_get.call_count == 1
+
+    stats = client.get('/health?stats=1').json['cache']
+    assert stats['hits'] == 1
+    assert stats['misses'] == 1
+
+def test_cache_invalidated_on_track_removed(app: Flask):
+    from shared.signals import track_removed
+    cache = app.extensions['recognition_cache']
+    cache.put('a' * 64, {'id': '123', 'title': 'Test Title'}, 200)
+    cache.put('b' * 64, {'error': 'No match', 'code': 'NO_RECOGNITION_MATCH'}, 404)
+
+    track_removed.send(None, track_id='123')
+    assert cache.get('a' * 64) is None
+    assert cache.get('b' * 64).status == 404
+
+def test_cache_disk_tier_shared(tmp_path):
+    from services.recognition.cache import RecognitionCache
+    path = str(tmp_path / 'cache.db')
+    RecognitionCache(path=path).put('a' * 64, {'id': '123'}, 200)
+
+    # A second worker sees the entry through the SQLite tier
+    entry = RecognitionCache(path=path).get('a' * 64)
+    assert entry.body == {'id': '123'}
+    assert entry.track_id == '123'
+
+def test_cache_invalidation_reaches_other_workers(tmp_path):
+    from services.recognition.cache import RecognitionCache
+    path = str(tmp_path / 'cache.db')
+    first, second = RecognitionCache(path=path), RecognitionCache(path=path)
+    first.put('a' * 64, {'id': '123'}, 200)
+    assert second.get('a' * 64).track_id == '123'
+
+    # The second worker's memory tier applies the logged removal before a hit
+    first.invalidate_track('123')
+    assert second.get('a' * 64) is None
+
+def test_cache_invalidation_route_is_internal(client: FlaskClient, monkeypatch):
+    cache = client.application.extensions['recognition_cache']
+    cache.put('a' * 64, {'id': '123'}, 200)
+    assert client.delete('/api/cache/tracks/123').status_code == 403
+
+    monkeypatch.setenv('INTERNAL_API_TOKEN', 'secret')
+    headers = {'X-Internal-Request': 'true', 'X-Internal-Token': 'wrong'}
+    assert client.delete('/api/cache/tracks/123', headers=headers).status_code == 403
+    assert cache.get('a' * 64) is not None
+
+    headers['X-Internal-Token'] = 'secret'
+    assert client.delete('/api/cache/tracks/123', headers=headers).status_code == 204
+    assert cache.get('a' * 64) is None
+
+def test_internal_token_required_for_exemption(monkeypatch):
+    from shared.utils import has_internal_token
+    app = Flask(__name__)
+    spoofed = {'X-Internal-Request': 'true', 'X-Internal-Token': 'guess'}
+    with app.test_request_context(headers=spoofed):
+        assert not has_internal_token()
+
+    monkeypatch.setenv('INTERNAL_API_TOKEN', 'secret')
+    with app.test_request_context(headers=spoofed):
+        assert not has_internal_token()
+    with app.test_request_context(headers={'X-Internal-Token': 'secret'}):
+        assert has_internal_token()
+
+def test_circuit_breaker_fails_fast():
+    from shared.http import CircuitOpenError, ServiceClient
+    client = ServiceClient('http://catalogue.invalid', failure_threshold=2, reset_timeout=60)
+    with patch.object(client.session, 'request', side_effect=requests.exceptions.ConnectionError) as mock_request:
+        for _ in range(2):
+            with pytest.raises(requests.exceptions.ConnectionError):
+                client.get('/tracks/search')
+        with pytest.raises(CircuitOpenError):
+            client.get('/tracks/search')
+    assert mock_request.call_count == 2
+    assert client.breaker.state == 'open'
+
+def test_circuit_breaker_half_open_recovers():
+    from shared.http import ServiceClient
+    client = ServiceClient('http://catalogue.invalid', failure_threshold=1, reset_timeout=0)
+    with patch.object(client.session, 'request', side_effect=requests.exceptions.ConnectionError):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get('/tracks/search')
+    with patch.object(client.session, 'request', return_value=MagicMock(status_code=200)):
+        client.get('/tracks/search')
+    assert client.breaker.state == 'closed'
+
+def test_circuit_breaker_trial_released_on_unexpected_error():
+    from shared.http import ServiceClient
+    client = ServiceClient('http://catalogue.invalid', failure_threshold=1, reset_timeout=0)
+    with patch.object(client.session, 'request', side_effect=requests.exceptions.ConnectionError):
+        with pytest.raises(requests.exceptions.ConnectionError):
+            client.get('/tracks/search')
+    # The half-open trial fails with something other than a transport error
+    with patch.object(client.session, 'request', side_effect=ValueError):
+        with pytest.raises(ValueError):
+            client.get('/tracks/search')
+    with patch.object(client.session, 'request', return_value=MagicMock(status_code=200)):
+        client.get('/tracks/search')
+    assert client.breaker.state == 'closed'
+
+def test_circuit_breaker_trial_kept_by_other_calls():
+    from shared.http import CircuitOpenError, ServiceClient
+    client = ServiceClient('http://catalogue.invalid', failure_threshold=1, reset_timeout=0)
+
+    def open_and_start_trial(*args, **kwargs):
+        # While this call is in flight the circuit opens and a trial begins
+        client.breaker.record_failure()
+        assert client.breaker.before_call() is True
+        raise ValueError
+
+    with patch.object(client.session, 'request', side_effect=open_and_start_trial):
+        with pytest.raises(ValueError):
+            client.get('/tracks/search')
+    # The earlier call did not release the trial, so no second one starts
+    with pytest.raises(CircuitOpenError):
+        client.breaker.before_call()
+
+@patch('services.recognition.app.validate_file_upload')
+@patch('services.recognition.app.validate_audio_format')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
+def test_recognize_catalogue_circuit_open(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
+    from shared.http import CircuitOpenError
+    mock_file = MagicMock()
+    mock_file.filename = 'test.wav'
+    mock_file.read.return_value = b'audio data'
+    mock_validate_upload.return_value = mock_file
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        'result': {
+            'title': 'Test Title',
+            'artist': 'Test Artist'
+        }
+    }
+    mock_get.side_effect = CircuitOpenError("Circuit open")
+
+    response = client.post('/api/recognize', data={'audio_file': (mock_file, 'test.wav')})
+    assert response.status_code == 502
+    assert response.json['code'] == 'CATALOGUE_ERROR'
+
+def test_local_catalogue_client(tmp_path):
+    from services.catalogue.app import create_app as create_catalogue_app, db
+    from services.catalogue.track import Track
+    from services.recognition.catalogue_client import LocalCatalogueClient
+
+    catalogue_app = create_catalogue_app()
+    with catalogue_app.app_context():
+        db.create_all()
+        db.session.add(Track(id='a' * 64, title='Bohemian Rhapsody', artist='Queen'))
+        db.session.commit()
+
+    try:
+        client = LocalCatalogueClient(catalogue_app, url_prefix='/catalogue')
+        track = client.find_track('Bohemian Rhapsody', 'Queen')
+        assert track['id'] == 'a' * 64
+        assert track['audio_url'] == f"/catalogue/tracks/{'a' * 64}/audio"
+        assert client.find_track('Unknown Song', 'Nobody') is None
+    finally:
+        with catalogue_app.app_context():
+            db.drop_all()
+
+@patch('services.recognition.app.validate_file_upload')
+@patch('services.recognition.app.validate_audio_format')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
+def test_recognize_async_job(mock_get, mock_post, mock_validate_format, mock_validate_upload, tmp_path, monkeypatch):
+    import time
+    from shared.utils import AudioUpload
+    monkeypatch.setenv('RECOGNITION_JOB_DIR', str(tmp_path))
+    client = create_app().test_client()
+    mock_validate_upload.return_value = AudioUpload('test.wav', BytesIO(b'audio data'), 'c' * 64, 10)
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {
+        'result': {
+            'title': 'Test Title',
+            'artist': 'Test Artist'
+        }
+    }
+    mock_get.return_value = MagicMock(status_code=200, json=lambda: {'data': {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist'}})
+
+    response = client.post('/api/recognize?async=1', data={'audio_file': (BytesIO(b'audio data'), 'test.wav')})
+    assert response.status_code == 202
+    job_id = response.json['id']
+    assert response.headers['Location'].endswith(f'/api/recognize/jobs/{job_id}')
+
+    deadline = time.time() + 5
+    while time.time() < deadline:
+        job = client.get(f'/api/recognize/jobs/{job_id}').json
+        if job['status'] in ('done', 'failed'):
+            break
+        time.sleep(0.01)
+
+    assert job['status'] == 'done'
+    assert job['status_code'] == 200
+    assert job['result'] == {'id': '123', 'title': 'Test Title', 'artist': 'Test Artist'}
+    assert 'total_ms' in job['timings']
+    # The spooled copy is removed once the job finishes
+    assert list(tmp_path.iterdir()) == []
+
+def test_recognize_job_not_found(client: FlaskClient):
+    response = client.get('/api/recognize/jobs/unknown')
+    assert response.status_code == 404
+    assert response.json['code'] == 'JOB_NOT_FOUND'
+
+def test_job_queue_full(tmp_path):
+    from services.recognition.jobs import JobQueue, QueueFull
+    from shared.utils import AudioUpload
+    jobs = JobQueue(lambda upload: ({}, 200), spool_dir=str(tmp_path), workers=0, max_queued=1)
+
+    jobs.submit(AudioUpload('a.wav', BytesIO(b'a'), 'a' * 64, 1))
+    with pytest.raises(QueueFull):
+        jobs.submit(AudioUpload('b.wav', BytesIO(b'b'), 'b' * 64, 1))
+    # The rejected upload is not left behind on disk
+    assert len(list(tmp_path.iterdir())) == 1
+
+def test_job_claimed_once_and_stale_jobs_recovered(tmp_path):
+    import time
+    from services.recognition.jobs import JOB_STALE_AFTER, JobQueue
+    from shared.utils import AudioUpload
+    path = str(tmp_path / 'jobs.db')
+    first, second = (
+        JobQueue(lambda upload: ({}, 200), spool_dir=str(tmp_path), workers=0, path=path)
+        for _ in range(2)
+    )
+    job = first.submit(AudioUpload('a.wav', BytesIO(b'a'), 'a' * 64, 1))
+
+    # Both workers were offered the job; only one claim succeeds
+    assert first.store.claim(job.id, 'first').status == 'running'
+    assert second.store.claim(job.id, 'second') is None
+    assert second.get(job.id).status == 'running'
+
+    # A live owner keeps its job; a silent one loses it to recovery
+    assert job.id not in second.store.recover(time.time() - JOB_STALE_AFTER)
+    assert second.store.recover(time.time() + 1) == [job.id]
+    assert second.store.claim(job.id, 'second').status == 'running'
+
+def test_job_callback_url_must_be_public(client: FlaskClient, tmp_path):
+    from services.recognition.jobs import CallbackRejected, JobQueue
+    jobs = JobQueue(lambda upload: ({}, 200), spool_dir=str(tmp_path), workers=0)
+    for url in ('ftp://example.com/', 'http://127.0.0.1/hook', 'http://10.0.0.5/hook',
+                'http://169.254.169.254/latest', 'http://[::1]/hook', 'http://localhost:8000/'):
+        with pytest.raises(CallbackRejected):
+            jobs.check_callback_url(url)
+    jobs.check_callback_url('http://93.184.216.34/hook')
+
+    # An allowlist admits only its hosts, wherever they resolve
+    jobs = JobQueue(lambda upload: ({}, 200), spool_dir=str(tmp_path), workers=0,
+                    allowed_callback_hosts=['receiver.internal'])
+    jobs.check_callback_url('https://receiver.internal/hook')
+    with pytest.raises(CallbackRejected):
+        jobs.check_callback_url('http://93.184.216.34/hook')
+
+    response = client.post('/api/recognize?async=1', data={
+        'audio_file': (BytesIO(b'RIFF\x24\x00\x00\x00WAVEfmt ' + b'\x00' * 28), 'a.wav'),
+        'callback_url': 'http://127.0.0.1:8000/admin'
+    })
+    assert response.status_code == 400
+    assert 'public address' in response.get_data(as_text=True)
+
+@patch('services.recognition.app.fingerprint_audio')
+@patch('shared.http.ServiceClient.post')
+def test_recognize_batch(mock_post, mock_fingerprint, client: FlaskClient):
+    import zipfile
+    wav = b'RIFF\x24\x00\x00\x00WAVEfmt ' + b'\x00' * 28
+    other = b'RIFF\x24\x00\x00\x00WAVEfmt ' + b'\x01' * 28
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zf:
+        zf.writestr('clips/other.wav', other)
+    archive.seek(0)
+
+    mock_fingerprint.return_value = []
+
+    def post(path, **kwargs):
+        if path == '/recognize':
+            title = 'Known' if kwargs['files']['file'][0] == 'a.wav' else 'Unknown'
+            return MagicMock(status_code=200, json=lambda: {'result': {'title': title, 'artist': 'Artist'}})
+        assert path == '/tracks/search-and-fetch/batch'
+        return MagicMock(status_code=200, json=lambda: {'data': [
+            {'id': '123', 'title': q['title'], 'artist': q['artist']} if q['title'] == 'Known' else None
+            for q in kwargs['json']['queries']
+        ]})
+    mock_post.side_effect = post
+
+    response = client.post('/api/recognize/batch', data={
+        'audio_file': [(BytesIO(wav), 'a.wav'), (BytesIO(wav), 'a-copy.wav'), (BytesIO(wav), 'notes.txt')],
+        'archive': (archive, 'clips.zip')
+    })
+    assert response.status_code == 200
+    results = response.json['results']
+    assert [r['status'] for r in results] == [200, 200, 400, 404]
+    assert results[0]['body']['id'] == '123'
+    assert results[1]['sha256'] == results[0]['sha256']
+    assert results[3]['filename'] == 'other.wav'
+    assert results[3]['body']['code'] == 'CATALOGUE_MISSING'
+    assert response.json['summary'] == {'total': 4, 'unique': 2, 'succeeded': 2, 'failed': 2}
+    # Duplicates are recognized once and the catalogue is queried once
+    paths = [call.args[0] for call in mock_post.call_args_list]
+    assert paths.count('/recognize') == 2
+    assert paths.count('/tracks/search-and-fetch/batch') == 1
+
+def test_recognize_batch_empty(client: FlaskClient):
+    response = client.post('/api/recognize/batch', data={})
+    assert response.status_code == 400
+
+def test_sqlite_rate_limit_storage_shared(tmp_path):
+    from limits import parse
+    from limits.strategies import FixedWindowRateLimiter
+    from shared.ratelimit import SQLiteStorage
+    uri = f"sqlite:///{tmp_path / 'ratelimit.db'}"
+    limit = parse('5 per minute')
+
+    # Two workers sharing the file, syncing on every hit
+    workers = [FixedWindowRateLimiter(SQLiteStorage(uri, flush_every=1)) for _ in range(2)]
+    allowed = [workers[i % 2].hit(limit, 'client') for i in range(8)]
+    assert allowed == [True] * 5 + [False] * 3
+
+    # Batched: a worker overshoots by at most flush_every - 1 hits
+    batched = FixedWindowRateLimiter(SQLiteStorage(uri, flush_every=4, flush_interval=60))
+    assert sum(batched.hit(limit, 'other') for _ in range(20)) <= 5 + 3
+
+@patch('services.recognition.app.validate_file_upload')
+@patch('services.recognition.app.validate_audio_format')
+@patch('shared.http.ServiceClient.post')
+@patch('shared.http.ServiceClient.get')
+def test_recognize_request_id_and_metrics(mock_get, mock_post, mock_validate_format, mock_validate_upload, client: FlaskClient):
+    mock_file = MagicMock()
+    mock_file.filename = 'test.wav'
+    mock_validate_upload.return_value = mock_file
+
+    mock_post.return_value.status_code = 200
+    mock_post.return_value.json.return_value = {'result': {'title': 'Test Title', 'artist': 'Test Artist'}}
+    mock_get.return_value = MagicMock(status_code=200, json=lambda: {'data': {'id': '123'}})
+
+    response = client.post(
+        '/api/recognize',
+        data={'audio_file': (mock_file, 'test.wav')},
+        headers={'X-Request-ID': 'trace-42'}
+    )
+    assert response.status_code == 200
+    assert response.headers['X-Request-ID'] == 'trace-42'
+    assert 'audd;dur=' in response.headers['Server-Timing']
+    assert 'catalogue_search;dur=' in response.headers['Server-Timing']
+
+    # Forwarded to the catalogue alongside X-Internal-Request
+    headers = mock_get.call_args.kwargs['headers']
+    assert headers['X-Request-ID'] == 'trace-42'
+    assert headers['X-Internal-Request'] == 'true'
+
+    metrics = client.get('/metrics')
+    assert metrics.status_code == 200
+    assert metrics.content_type.startswith('text/plain; version=0.0.4')
+    text = metrics.get_data(as_text=True)
+    assert 'shamzam_stage_duration_seconds_count{service="recognition",stage="audd"}' in text
+    assert 'shamzam_http_requests_total{service="recognition",method="POST",endpoint="/api/recognize",status="200"}' in text
+    assert 'service="catalogue"' not in text
+
+def test_generated_request_id(client: FlaskClient):
+    response = client.get('/health', headers={'X-Request-ID': 'not a valid id!'})
+    assert response.headers['X-Request-ID'] != 'not a valid id!'
+    assert len(response.headers['X-Request-ID']) == 32
+
+def test_json_logging_with_sampling(monkeypatch, capsys):
+    import json
+    import logging
+    from shared.logs import configure_logging, shutdown_logging
+
+    monkeypatch.setenv('LOG_FORMAT', 'json')
+    monkeypatch.setenv('LOG_QUEUE', 'true')
+    monkeypatch.setenv('LOG_SAMPLE_RATES', 'sampling.test=0.5')
+    configure_logging(force=True)
+    try:
+        configure_logging()  # Idempotent: no second handler
+        log = logging.getLogger('sampling.test')
+        for i in range(4):
+            log.warning("No matching track found for %s", i)
+        log.error("Always kept", extra={'track_id': 'abc'})
+    finally:
+        shutdown_logging()  # Drains the queue
+
+    entries = [json.loads(line) for line in capsys.readouterr().err.splitlines() if line.startswith('{')]
+    entries = [entry for entry in entries if entry['logger'] == 'sampling.test']
+    assert [entry['message'] for entry in entries] == [
+        "No matching track found for 0",
+        "No matching track found for 2",
+        "Always kept"
+    ]
+    assert entries[0]['sample_rate'] == 0.5
+    assert entries[2]['track_id'] == 'abc'
+    assert entries[2]['level'] == 'ERROR'
+
+def stereo_24bit_wav(seconds: float, rate: int, silence: float) -> bytes:
+    import numpy as np
+    import wave
+    times = np.arange(int(seconds * rate)) / rate
+    tone = 0.5 * np.sin(2 * np.pi * 440 * times)
+    tone[:int(silence * rate)] = 0
+    ints = (np.repeat(tone, 2) * 8388607).astype('<i4')
+    frames = np.frombuffer(ints.tobytes(), dtype=np.uint8).reshape(-1, 4)[:, :3].tobytes()
+    output = BytesIO()
+    with wave.open(output, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(3)
+        wav.setframerate(rate)
+        wav.writeframes(frames)
+    return output.getvalue()
+
+def test_normalize_audio_downmixes_resamples_and_caps():
+    import wave
+    from shared.utils import NORMALIZED_SAMPLE_RATE, encode_wav, normalize_audio
+
+    audio = normalize_audio(stereo_24bit_wav(10, 48000, silence=2), max_seconds=3, trim_silence=True)
+    assert audio.sample_rate == NORMALIZED_SAMPLE_RATE
+    assert audio.samples.ndim == 1
+    assert audio.start == pytest.approx(2, abs=0.05)
+    assert audio.source_duration == pytest.approx(10)
+    assert len(audio.samples) == pytest.approx(3 * NORMALIZED_SAMPLE_RATE, rel=0.01)
+    assert abs(audio.samples).max() == pytest.approx(0.5, rel=0.01)
+
+    with wave.open(BytesIO(encode_wav(audio.samples, audio.sample_rate))) as wav:
+        assert (wav.getnchannels(), wav.getsampwidth(), wav.getframerate()) == (1, 2, NORMALIZED_SAMPLE_RATE)
+
+@patch('shared.http.ServiceClient.post')
+def test_audd_receives_normalized_fragment(mock_post, client: FlaskClient):
+    audio = stereo_24bit_wav(30, 48000, silence=1)
+    def respond(path, **kwargs):
+        body = {'data': None} if path.endswith('/tracks/match') else {'result': None}
+        return MagicMock(status_code=200, headers={}, json=lambda: body)
+    mock_post.side_effect = respond
+
+    response = client.post('/api/recognize', data={'audio_file': (BytesIO(audio), 'test.wav')})
+    assert response.status_code == 404
+    uploads = [call.kwargs['files']['file'][1] for call in mock_post.call_args_list if 'files' in call.kwargs]
+    assert len(uploads) == 1
+    # Mono 16-bit at the normalized rate, capped well below the original
+    assert isinstance(uploads[0], bytes)
+    assert len(uploads[0]) < len(audio) / 10
@@ -11,6 +11,16 @@ setup(
     install_requires=[
         'Flask>=2.0.3',
         'requests>=2.26.0',
-        'SQLAlchemy>=1.4.27'
-    ]
+        'SQLAlchemy>=1.4.27',
+        'numpy>=1.22'
+    ],
+    extras_require={
+        'zstd': ['zstandard>=0.21'],
+        'msgpack': ['msgpack>=1.0']
+    },
+    entry_points={
+        'console_scripts': [
+            'shamzam-catalogue=services.catalogue.cli:main'
+        ]
+    }
 )
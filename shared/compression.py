@@ -0,0 +1,202 @@
+import gzip
+import os
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:  # Optional: gzip only
+    zstandard = None
+
+# Text formats worth compressing; audio and already-compressed types are
+# passed through untouched
+COMPRESSIBLE_TYPES = (
+    'application/json',
+    'application/x-ndjson',
+    'application/msgpack',
+    'application/javascript',
+    'text/'
+)
+DEFAULT_MINIMUM_SIZE = 1024
+# Larger bodies with a known length are streamed rather than buffered
+MAX_BUFFERED_SIZE = 8 * 2 ** 20
+
+
+def parse_accept_encoding(header: str) -> Dict[str, float]:
+    """Map each coding in an Accept-Encoding header to its q-value"""
+    codings = {}
+    for part in filter(None, (item.strip() for item in header.split(','))):
+        coding, *params = (piece.strip() for piece in part.split(';'))
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[coding.lower()] = q
+    return codings
+
+
+class CompressionMiddleware:
+    """Negotiated gzip/zstd compression of WSGI responses.
+
+    Compresses text-like responses of at least minimum_size bytes (or of
+    unknown length, such as streamed NDJSON) when the client accepts
+    zstd (preferred, if the zstandard package is installed) or gzip.
+    Responses that already have a Content-Encoding, partial content and
+    HEAD requests are left alone. The wrapped application must call
+    start_response before returning its body, as Flask does.
+
+    Args:
+        app: WSGI application to wrap
+        minimum_size: Smallest body worth compressing, in bytes
+        gzip_level: zlib compression level (1-9)
+        zstd_level: zstd compression level
+    """
+
+    def __init__(self, app, minimum_size: int = DEFAULT_MINIMUM_SIZE,
+                 gzip_level: int = 6, zstd_level: int = 3):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.zstd_level = zstd_level
+
+    @classmethod
+    def from_env(cls, app) -> 'CompressionMiddleware':
+        """Build from COMPRESSION_* environment variables"""
+        return cls(
+            app,
+            minimum_size=int(os.getenv('COMPRESSION_MIN_SIZE', DEFAULT_MINIMUM_SIZE)),
+            gzip_level=int(os.getenv('COMPRESSION_GZIP_LEVEL', 6)),
+            zstd_level=int(os.getenv('COMPRESSION_ZSTD_LEVEL', 3))
+        )
+
+    def choose_encoding(self, accept_encoding: str) -> Optional[str]:
+        codings = parse_accept_encoding(accept_encoding)
+        wildcard = codings.get('*', 0.0)
+        candidates = (['zstd'] if zstandard is not None else []) + ['gzip']
+        accepted = [(codings.get(coding, wildcard), coding) for coding in candidates]
+        # Highest q wins; on ties the order above (zstd first) decides
+        q, coding = max(accepted, key=lambda item: item[0])
+        return coding if q > 0 else None
+
+    def __call__(self, environ, start_response):
+        encoding = None
+        if environ.get('REQUEST_METHOD') != 'HEAD':
+            encoding = self.choose_encoding(environ.get('HTTP_ACCEPT_ENCODING', ''))
+        if encoding is None:
+            return self.app(environ, start_response)
+
+        captured: List = []
+        written: List[bytes] = []
+
+        def capture(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+            return written.append
+
+        app_iter = self.app(environ, capture)
+        status, headers, exc_info = captured
+        if not self._compressible(status, headers):
+            start_response(status, headers, exc_info)
+            return _prepend(written, app_iter)
+
+        length = _header(headers, 'Content-Length')
+        vary = _vary(headers)
+        # A strong ETag names the uncompressed bytes, so it cannot be kept
+        headers = [(name, value) for name, value in headers
+                   if name.lower() not in ('content-length', 'etag', 'vary')]
+        headers += [('Content-Encoding', encoding), ('Vary', vary)]
+
+        if length is not None and int(length) <= MAX_BUFFERED_SIZE:
+            try:
+                body = b''.join(written) + b''.join(app_iter)
+            finally:
+                _close(app_iter)
+            compressed = self._compress(encoding, body)
+            headers.append(('Content-Length', str(len(compressed))))
+            start_response(status, headers, exc_info)
+            return [compressed]
+
+        start_response(status, headers, exc_info)
+        return self._stream(encoding, written, app_iter)
+
+    def _compressible(self, status: str, headers: List[Tuple[str, str]]) -> bool:
+        if int(status.split(' ', 1)[0]) in (204, 206, 304):
+            return False
+        if _header(headers, 'Content-Encoding'):
+            return False
+        content_type = (_header(headers, 'Content-Type') or '').lower()
+        if not content_type.startswith(COMPRESSIBLE_TYPES):
+            return False
+        length = _header(headers, 'Content-Length')
+        return length is None or int(length) >= self.minimum_size
+
+    def _compress(self, encoding: str, body: bytes) -> bytes:
+        if encoding == 'zstd':
+            return zstandard.ZstdCompressor(level=self.zstd_level).compress(body)
+        return gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+
+    def _stream(self, encoding: str, written: List[bytes], app_iter: Iterable[bytes]):
+        """Compress chunk by chunk, flushing each so streamed output is not held back"""
+        if encoding == 'zstd':
+            compressor = zstandard.ZstdCompressor(level=self.zstd_level).compressobj()
+            flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)  # noqa: E731
+            finish = compressor.flush
+        else:
+            compressor = zlib.compressobj(self.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)  # noqa: E731
+            finish = compressor.flush
+        try:
+            for chunk in _prepend(written, app_iter):
+                if chunk:
+                    data = compressor.compress(chunk) + flush()
+                    if data:
+                        yield data
+            yield finish()
+        finally:
+            _close(app_iter)
+
+
+def _header(headers: List[Tuple[str, str]], name: str) -> Optional[str]:
+    name = name.lower()
+    for key, value in headers:
+        if key.lower() == name:
+            return value
+    return None
+
+
+def _vary(headers: List[Tuple[str, str]]) -> str:
+    existing = [value.strip() for key, values in headers if key.lower() == 'vary'
+                for value in values.split(',') if value.strip()]
+    if 'accept-encoding' not in (value.lower() for value in existing):
+        existing.append('Accept-Encoding')
+    return ', '.join(existing)
+
+
+def _prepend(written: List[bytes], app_iter: Iterable[bytes]):
+    if not written:
+        return app_iter
+    return _ClosingChain(written, app_iter)
+
+
+class _ClosingChain:
+    """Chunks from start_response's write() followed by the app's, keeping close()"""
+
+    def __init__(self, written: List[bytes], app_iter: Iterable[bytes]):
+        self.written = written
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        yield from self.written
+        yield from self.app_iter
+
+    def close(self):
+        _close(self.app_iter)
+
+
+def _close(app_iter: Iterable[bytes]):
+    close = getattr(app_iter, 'close', None)
+    if close is not None:
+        close()
@@ -0,0 +1,375 @@
+from collections import Counter, defaultdict
+from typing import BinaryIO, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+
+from shared.utils import (  # noqa: F401  (resample re-exported)
+    NORMALIZED_SAMPLE_RATE,
+    AudioProcessingError,
+    normalize_audio,
+    resample,
+    sound_bounds
+)
+
+
+# --------------------------
+# Fingerprint Parameters
+# --------------------------
+
+SAMPLE_RATE = NORMALIZED_SAMPLE_RATE  # Analysis rate; content above ~5.5kHz is ignored
+WINDOW_SIZE = 1024         # STFT window (~93ms at SAMPLE_RATE)
+HOP_SIZE = 512             # STFT hop (~46ms at SAMPLE_RATE)
+PEAK_FREQ_RADIUS = 10      # Neighbourhood half-width in frequency bins
+PEAK_TIME_RADIUS = 5       # Neighbourhood half-width in frames
+PEAK_DYNAMIC_RANGE = 60.0  # Ignore peaks quieter than max - N dB
+FAN_VALUE = 10             # Target peaks paired with each anchor
+MAX_PAIR_DELTA = 63        # Max anchor->target distance in frames (6 bits)
+MIN_MATCH_VOTES = 5        # Aligned hashes required to accept a match
+CONFIDENT_VOTES = 20       # Aligned hashes for full match confidence
+VOTE_CHUNK = 256           # Fragment hashes scored between early-exit checks
+
+SIGNATURE_BANDS = 8        # Log-spaced energy bands in a perceptual signature
+SIGNATURE_SEGMENTS = 8     # Equal slices of the track's sounding duration
+SIGNATURE_MIN_HZ = 100.0
+SIGNATURE_MAX_HZ = 5000.0
+SIGNATURE_BLOCKS = 4       # 16-bit blocks indexed for Hamming search
+SIGNATURE_BLOCK_BITS = 64 // SIGNATURE_BLOCKS
+
+HashPair = Tuple[int, int]  # (hash, anchor frame offset)
+
+
+# --------------------------
+# Audio Decoding
+# --------------------------
+
+def decode_wav(audio_data: Union[bytes, BinaryIO]) -> Tuple[np.ndarray, int]:
+    """Decode a PCM or float WAV into mono float32 samples.
+
+    Args:
+        audio_data: Raw bytes or a readable file object of a WAV file
+
+    Returns:
+        Tuple of (samples in [-1, 1], sample rate)
+
+    Raises:
+        AudioProcessingError: If the WAV cannot be decoded
+    """
+    audio = normalize_audio(audio_data, target_rate=None)
+    return audio.samples, audio.sample_rate
+
+
+# --------------------------
+# Spectral Analysis
+# --------------------------
+
+def spectrogram(samples: np.ndarray) -> np.ndarray:
+    """Compute a log-magnitude STFT.
+
+    Args:
+        samples: Mono samples at SAMPLE_RATE
+
+    Returns:
+        Array of shape (frequency bins, frames) in dB
+    """
+    if len(samples) < WINDOW_SIZE:
+        return np.empty((WINDOW_SIZE // 2 + 1, 0), dtype=np.float32)
+
+    frames = np.lib.stride_tricks.sliding_window_view(samples, WINDOW_SIZE)[::HOP_SIZE]
+    magnitudes = np.abs(np.fft.rfft(frames * np.hanning(WINDOW_SIZE), axis=1))
+    return (20 * np.log10(magnitudes + 1e-10)).T.astype(np.float32)
+
+
+def _maximum_filter(spec: np.ndarray) -> np.ndarray:
+    """Separable sliding maximum over the peak neighbourhood"""
+    padded = np.pad(spec, ((PEAK_FREQ_RADIUS, PEAK_FREQ_RADIUS), (0, 0)), constant_values=-np.inf)
+    by_freq = np.lib.stride_tricks.sliding_window_view(padded, 2 * PEAK_FREQ_RADIUS + 1, axis=0).max(axis=-1)
+    padded = np.pad(by_freq, ((0, 0), (PEAK_TIME_RADIUS, PEAK_TIME_RADIUS)), constant_values=-np.inf)
+    return np.lib.stride_tricks.sliding_window_view(padded, 2 * PEAK_TIME_RADIUS + 1, axis=1).max(axis=-1)
+
+
+def find_peaks(spec: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Pick constellation peaks from a spectrogram.
+
+    Returns:
+        Tuple of (frame indices, frequency bins) sorted by time
+    """
+    if spec.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    is_peak = (spec == _maximum_filter(spec)) & (spec > spec.max() - PEAK_DYNAMIC_RANGE)
+    freqs, times = np.nonzero(is_peak)
+    order = np.lexsort((freqs, times))
+    return times[order], freqs[order]
+
+
+def hash_peaks(times: np.ndarray, freqs: np.ndarray) -> List[HashPair]:
+    """Combine anchor peaks with nearby targets into hash pairs.
+
+    Each hash packs (anchor freq, target freq, frame delta) into 26 bits
+    and is paired with the anchor's frame offset.
+    """
+    hashes, offsets = [], []
+    for k in range(1, FAN_VALUE + 1):
+        if k >= len(times):
+            break
+        delta = times[k:] - times[:-k]
+        valid = (delta > 0) & (delta <= MAX_PAIR_DELTA)
+        anchor_freqs, target_freqs = freqs[:-k][valid], freqs[k:][valid]
+        hashes.append((anchor_freqs << 16) | (target_freqs << 6) | delta[valid])
+        offsets.append(times[:-k][valid])
+
+    if not hashes:
+        return []
+    return list(zip(np.concatenate(hashes).tolist(), np.concatenate(offsets).tolist()))
+
+
+def fingerprint_audio(audio_data: Union[bytes, BinaryIO],
+                      max_seconds: Optional[float] = None,
+                      trim_silence: bool = False) -> List[HashPair]:
+    """Generate combinatorial hash fingerprints for WAV audio.
+
+    Args:
+        audio_data: Raw bytes or a readable file object of a WAV file
+        max_seconds: Fingerprint at most this much audio (None for all)
+        trim_silence: Skip leading and trailing silence first
+
+    Returns:
+        List of (hash, frame offset) pairs
+
+    Raises:
+        AudioProcessingError: If the WAV cannot be decoded
+    """
+    audio = normalize_audio(audio_data, SAMPLE_RATE, max_seconds, trim_silence)
+    times, freqs = find_peaks(spectrogram(audio.samples))
+    return hash_peaks(times, freqs)
+
+
+def analyze_track(audio_data: Union[bytes, BinaryIO]) -> Tuple[List[HashPair], Optional[int]]:
+    """Fingerprint hashes and perceptual signature of a whole track.
+
+    Decodes and transforms the audio once for both.
+
+    Returns:
+        Tuple of (hash pairs, signature or None if too short to sign)
+
+    Raises:
+        AudioProcessingError: If the WAV cannot be decoded
+    """
+    audio = normalize_audio(audio_data, SAMPLE_RATE)
+    spec = spectrogram(audio.samples)
+    times, freqs = find_peaks(spec)
+    start, end = sound_bounds(audio.samples, SAMPLE_RATE)
+    return hash_peaks(times, freqs), perceptual_signature(spec[:, start // HOP_SIZE:end // HOP_SIZE])
+
+
+# --------------------------
+# Perceptual Signature
+# --------------------------
+
+def perceptual_signature(spec: np.ndarray) -> Optional[int]:
+    """Summarise a spectrogram as a 64-bit energy-band signature.
+
+    The sounding part of the track is split into SIGNATURE_SEGMENTS
+    equal slices and SIGNATURE_BANDS log-spaced bands; each bit records
+    whether a band is louder in that slice than its median over the
+    track. Relative to the track's own levels, the bits survive gain
+    and EQ changes, re-encoding, resampling and small trims, so copies
+    of one recording land a few bits apart.
+
+    Args:
+        spec: Log-magnitude spectrogram (dB) at SAMPLE_RATE, silence trimmed
+
+    Returns:
+        Unsigned 64-bit signature, or None when there are fewer frames
+        than segments
+    """
+    if spec.shape[1] < SIGNATURE_SEGMENTS:
+        return None
+
+    hz_per_bin = SAMPLE_RATE / WINDOW_SIZE
+    edges = np.geomspace(SIGNATURE_MIN_HZ, SIGNATURE_MAX_HZ, SIGNATURE_BANDS + 1) / hz_per_bin
+    edges = np.round(edges).astype(int)
+    power = 10 ** (spec.astype(np.float64) / 10)
+
+    bands = np.stack([power[low:high].sum(axis=0) for low, high in zip(edges[:-1], edges[1:])])
+    energy = np.log10(np.stack([
+        segment.mean(axis=1) for segment in np.array_split(bands, SIGNATURE_SEGMENTS, axis=1)
+    ], axis=1) + 1e-12)
+    bits = energy > np.median(energy, axis=1, keepdims=True)
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+def signature_blocks(signature: int) -> List[int]:
+    """Split a signature into SIGNATURE_BLOCKS values, most significant first"""
+    mask = (1 << SIGNATURE_BLOCK_BITS) - 1
+    return [
+        (signature >> (SIGNATURE_BLOCK_BITS * (SIGNATURE_BLOCKS - 1 - i))) & mask
+        for i in range(SIGNATURE_BLOCKS)
+    ]
+
+
+def block_neighbours(block: int, radius: int) -> List[int]:
+    """Every block value within radius bits of block (including itself)"""
+    values = {block}
+    for _ in range(radius):
+        values |= {value ^ (1 << bit) for value in values for bit in range(SIGNATURE_BLOCK_BITS)}
+    return sorted(values)
+
+
+def block_probes(signature: int, max_distance: int) -> List[List[int]]:
+    """Block values to look up for signatures within max_distance.
+
+    Multi-index hashing: if two signatures differ in at most d bits, at
+    least one of their m blocks differs in at most d // m bits, so
+    probing each block's neighbourhood of that radius finds every
+    candidate without scanning the catalogue.
+    """
+    radius = max_distance // SIGNATURE_BLOCKS
+    return [block_neighbours(block, radius) for block in signature_blocks(signature)]
+
+
+# --------------------------
+# Matching
+# --------------------------
+
+def frames_to_seconds(frames: int) -> float:
+    """Convert an STFT frame offset into seconds"""
+    return frames * HOP_SIZE / SAMPLE_RATE
+
+
+def best_match(query: Iterable[HashPair],
+               candidates: Iterable[Tuple[int, str, int]]) -> Optional[Dict]:
+    """Find the best aligned track by offset-histogram voting.
+
+    Args:
+        query: (hash, offset) pairs from the fragment
+        candidates: (hash, track_id, offset) rows from the index that
+            share a hash with the query
+
+    Returns:
+        Dict with track_id, votes, offset (seconds) and confidence, or
+        None when no track reaches MIN_MATCH_VOTES
+    """
+    query_offsets = defaultdict(list)
+    for hash_value, offset in query:
+        query_offsets[hash_value].append(offset)
+
+    votes = Counter()
+    for hash_value, track_id, offset in candidates:
+        for query_offset in query_offsets.get(hash_value, ()):
+            votes[(track_id, offset - query_offset)] += 1
+
+    if not votes:
+        return None
+
+    (track_id, delta), count = votes.most_common(1)[0]
+    if count < MIN_MATCH_VOTES:
+        return None
+
+    runner_up = max((n for (other, _), n in votes.items() if other != track_id), default=0)
+    return {
+        'track_id': track_id,
+        'votes': count,
+        'offset': frames_to_seconds(delta),
+        'confidence': match_confidence(count, runner_up)
+    }
+
+
+def match_confidence(votes: int, runner_up: int) -> float:
+    """How clearly a match stands out, from 0 to 1.
+
+    The margin over the runner-up (the best alignment of any other
+    track), scaled down while fewer than CONFIDENT_VOTES hashes agree:
+    1.0 is a well-supported match no other track comes close to.
+    """
+    if votes <= 0:
+        return 0.0
+    margin = max(0.0, 1.0 - runner_up / votes)
+    return round(margin * min(1.0, votes / CONFIDENT_VOTES), 3)
+
+
+def vote_offsets(query_hashes: np.ndarray,
+                 query_offsets: np.ndarray,
+                 index_hashes: np.ndarray,
+                 index_tracks: np.ndarray,
+                 index_offsets: np.ndarray,
+                 early_exit: Optional[float] = None,
+                 excluded: Optional[np.ndarray] = None) -> List[Tuple[int, int, int]]:
+    """Offset-histogram voting against a hash-sorted index, vectorized.
+
+    Equivalent to best_match, but candidate rows are found with binary
+    searches and votes counted over packed (track, delta) keys, so no
+    Python loop runs per hash. The fragment is scored VOTE_CHUNK hashes
+    at a time in time order; once the leading alignment reaches the
+    early_exit confidence the rest of the fragment is skipped.
+
+    Args:
+        query_hashes, query_offsets: The fragment's (hash, offset) pairs
+        index_hashes: Index hashes in ascending order
+        index_tracks, index_offsets: Track number and offset per index row
+        early_exit: Confidence at which to stop scoring, or None
+        excluded: Track numbers whose rows are ignored, or None
+
+    Returns:
+        (track, delta, votes) for the best alignment and for the best
+        alignment of any other track, best first; fewer when fewer
+        tracks share a hash with the fragment
+    """
+    order = np.argsort(query_offsets, kind='stable')
+    query_hashes = np.asarray(query_hashes, dtype=np.int64)[order]
+    query_offsets = np.asarray(query_offsets, dtype=np.int64)[order]
+
+    keys = np.empty(0, dtype=np.int64)
+    counts = np.empty(0, dtype=np.int64)
+    leaders: List[Tuple[int, int, int]] = []
+    for start in range(0, len(query_hashes), VOTE_CHUNK):
+        chunk = query_hashes[start:start + VOTE_CHUNK]
+        lo = np.searchsorted(index_hashes, chunk, side='left')
+        hi = np.searchsorted(index_hashes, chunk, side='right')
+        sizes = hi - lo
+        total = int(sizes.sum())
+        if not total:
+            continue
+
+        # Every index row sharing a hash with each fragment hash
+        rows = np.arange(total) - np.repeat(np.cumsum(sizes) - sizes, sizes) + np.repeat(lo, sizes)
+        deltas = index_offsets[rows] - np.repeat(query_offsets[start:start + VOTE_CHUNK], sizes)
+        tracks = index_tracks[rows]
+        if excluded is not None:
+            kept = ~np.isin(tracks, excluded)
+            tracks, deltas = tracks[kept], deltas[kept]
+            if not len(tracks):
+                continue
+        new_keys = (tracks.astype(np.int64) << 32) | (deltas + (1 << 31))
+
+        keys, inverse = np.unique(np.concatenate([keys, new_keys]), return_inverse=True)
+        counts = np.bincount(
+            inverse,
+            weights=np.concatenate([counts, np.ones(len(new_keys), dtype=np.int64)])
+        ).astype(np.int64)
+
+        leaders = _leaders(keys, counts)
+        if early_exit is not None and leaders:
+            runner_up = leaders[1][2] if len(leaders) > 1 else 0
+            if match_confidence(leaders[0][2], runner_up) >= early_exit:
+                break
+
+    return leaders
+
+
+def _leaders(keys: np.ndarray, counts: np.ndarray) -> List[Tuple[int, int, int]]:
+    """Best (track, delta, votes) alignment, then best of any other track"""
+    tracks = keys >> 32
+    best = int(np.argmax(counts))
+    leaders = [best]
+    others = np.flatnonzero(tracks != tracks[best])
+    if len(others):
+        leaders.append(int(others[np.argmax(counts[others])]))
+    return [
+        (int(tracks[i]), int((keys[i] & 0xFFFFFFFF) - (1 << 31)), int(counts[i]))
+        for i in leaders
+    ]
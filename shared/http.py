@@ -0,0 +1,211 @@
+import logging
+import os
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from shared.metrics import observe_outbound
+
+logger = logging.getLogger(__name__)
+
+
+# --------------------------
+# Circuit Breaking
+# --------------------------
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without touching the network while a dependency is unhealthy"""
+    pass
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    After failure_threshold failures in a row the circuit opens and calls
+    fail immediately. Once reset_timeout has elapsed a single trial call
+    is let through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return 'closed'
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                return 'half-open'
+            return 'open'
+
+    def before_call(self) -> bool:
+        """Raise CircuitOpenError unless a call may proceed.
+
+        Returns:
+            True if this call is the half-open trial
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return False
+            cooled_down = time.monotonic() - self._opened_at >= self.reset_timeout
+            if cooled_down and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+        raise CircuitOpenError(f"Circuit open for {self.name}")
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def end_trial(self):
+        """Let the next call be a trial when one ended without an outcome"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning("Opening circuit for %s after %d failures", self.name, self._failures)
+                self._opened_at = time.monotonic()
+
+
+# --------------------------
+# Pooled Clients
+# --------------------------
+
+class ServiceClient:
+    """Keep-alive HTTP client for one upstream host.
+
+    Wraps a requests.Session whose connection pool is sized to the
+    worker's thread count, applies (connect, read) timeouts, retries
+    idempotent GETs with jittered exponential backoff and guards every
+    call with a CircuitBreaker.
+    """
+
+    def __init__(self, base_url: str,
+                 headers: Optional[Dict[str, str]] = None,
+                 pool_size: int = 10,
+                 connect_timeout: float = 3.05,
+                 read_timeout: float = 10,
+                 retries: int = 2,
+                 backoff_factor: float = 0.2,
+                 backoff_jitter: float = 0.2,
+                 failure_threshold: int = 5,
+                 reset_timeout: float = 30):
+        self.base_url = base_url.rstrip('/')
+        self.host = urlsplit(self.base_url).netloc
+        self.timeout = (connect_timeout, read_timeout)
+        self.breaker = CircuitBreaker(self.base_url, failure_threshold, reset_timeout)
+
+        retry = Retry(
+            total=retries,
+            allowed_methods=frozenset({'GET', 'HEAD'}),
+            status_forcelist=(502, 503, 504),
+            backoff_factor=backoff_factor,
+            backoff_jitter=backoff_jitter,
+            raise_on_status=False
+        )
+        self._adapter_options = {'pool_connections': 1, 'pool_maxsize': pool_size, 'max_retries': retry}
+        self._headers = headers or {}
+        self.session = self._new_session()
+
+    def _new_session(self) -> requests.Session:
+        adapter = HTTPAdapter(**self._adapter_options)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers.update(self._headers)
+        return session
+
+    def reset_after_fork(self):
+        """Replace the session so a forked worker opens its own sockets"""
+        self.session = self._new_session()
+
+    @classmethod
+    def from_env(cls, base_url: str, headers: Optional[Dict[str, str]] = None) -> 'ServiceClient':
+        """Build a client from HTTP_* / CIRCUIT_* environment variables"""
+        return cls(
+            base_url,
+            headers=headers,
+            pool_size=int(os.getenv('HTTP_POOL_SIZE', 10)),
+            connect_timeout=float(os.getenv('HTTP_CONNECT_TIMEOUT', 3.05)),
+            read_timeout=float(os.getenv('HTTP_READ_TIMEOUT', 10)),
+            retries=int(os.getenv('HTTP_RETRIES', 2)),
+            backoff_factor=float(os.getenv('HTTP_BACKOFF_FACTOR', 0.2)),
+            backoff_jitter=float(os.getenv('HTTP_BACKOFF_JITTER', 0.2)),
+            failure_threshold=int(os.getenv('CIRCUIT_FAILURE_THRESHOLD', 5)),
+            reset_timeout=float(os.getenv('CIRCUIT_RESET_TIMEOUT', 30))
+        )
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send a request through the breaker.
+
+        Raises:
+            CircuitOpenError: If the upstream is marked unhealthy
+            requests.exceptions.RequestException: For transport failures
+        """
+        trial = self.breaker.before_call()
+        kwargs.setdefault('timeout', self.timeout)
+        started = time.perf_counter()
+        try:
+            try:
+                response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+            except requests.exceptions.RequestException as e:
+                observe_outbound(self.host, method, type(e).__name__, time.perf_counter() - started)
+                self.breaker.record_failure()
+                raise
+
+            observe_outbound(self.host, method, str(response.status_code), time.perf_counter() - started)
+
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            return response
+        finally:
+            # Any other exception must not leave a half-open trial pending
+            # forever; other calls must not release someone else's trial
+            if trial:
+                self.breaker.end_trial()
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+
+_clients: Dict[str, ServiceClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(base_url: str) -> ServiceClient:
+    """Return the process-wide client for a base URL, creating it once"""
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = ServiceClient.from_env(base_url)
+        return client
+
+
+def reset_clients():
+    """Give every registered client a fresh connection pool (after fork)"""
+    with _clients_lock:
+        for client in _clients.values():
+            client.reset_after_fork()
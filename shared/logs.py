@@ -0,0 +1,204 @@
+import atexit
+import copy
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Dict, Optional
+
+from shared.metrics import current_request_id
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed with extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {
+    'message', 'asctime', 'request_id', 'sample_rate'
+}
+
+_lock = threading.Lock()
+_handler: Optional[logging.Handler] = None
+_listener: Optional[QueueListener] = None
+
+
+# --------------------------
+# Formatting
+# --------------------------
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, with the request id and any extra= fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created))
+                    + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        if getattr(record, 'request_id', None):
+            entry['request_id'] = record.request_id
+        if getattr(record, 'sample_rate', None):
+            entry['sample_rate'] = record.sample_rate
+        entry.update(
+            (key, value) for key, value in vars(record).items()
+            if key not in _RECORD_ATTRIBUTES and not key.startswith('_')
+        )
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class RequestIdFilter(logging.Filter):
+    """Tag records with the id of the request being served (emitting thread)"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = current_request_id()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of repetitive records from chosen loggers.
+
+    Rates map logger names (matched by prefix, longest first) to the
+    share of records kept: 0.1 keeps the first occurrence of each
+    message template and every tenth after it. Records at ERROR and
+    above are always kept.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = sorted(rates.items(), key=lambda item: len(item[0]), reverse=True)
+        self._seen: Dict[tuple, int] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.ERROR:
+            return True
+        rate = self._rate(record.name)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+
+        # Keyed by the unformatted template, so "%s" arguments do not
+        # make every record unique
+        key = (record.name, record.msg)
+        with self._lock:
+            seen = self._seen.get(key, 0)
+            self._seen[key] = seen + 1
+        record.sample_rate = rate
+        return seen % round(1 / rate) == 0
+
+    def _rate(self, name: str) -> Optional[float]:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + '.'):
+                return rate
+        return None
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler that leaves formatting to the listener thread.
+
+    The stock handler renders the message and traceback before
+    enqueueing, on the request thread; here the record is queued as-is.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+
+def parse_sample_rates(spec: str) -> Dict[str, float]:
+    """Parse "logger=rate,logger=rate" (as in LOG_SAMPLE_RATES)
+
+    Raises:
+        ValueError: If an entry is not of the form name=rate
+    """
+    rates = {}
+    for entry in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, rate = entry.partition('=')
+        if not name or not rate:
+            raise ValueError(f"Invalid sample rate entry: {entry!r}")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+# --------------------------
+# Process setup
+# --------------------------
+
+def configure_logging(force: bool = False):
+    """Install the process's log handler once (idempotent).
+
+    Settings come from the environment: LOG_LEVEL, LOG_FORMAT (text or
+    json), LOG_QUEUE (write from a background listener thread, default
+    true) and LOG_SAMPLE_RATES. Call from application factories and
+    entry points rather than at import; force replaces an existing
+    setup, e.g. after the environment changed.
+    """
+    global _handler, _listener
+    with _lock:
+        if _handler is not None and not force:
+            return
+        _remove_handler()
+
+        stream = logging.StreamHandler()
+        if os.getenv('LOG_FORMAT', 'text').lower() == 'json':
+            stream.setFormatter(JsonFormatter())
+        else:
+            stream.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+        if os.getenv('LOG_QUEUE', 'true').lower() == 'true':
+            _handler = LazyQueueHandler(queue.SimpleQueue())
+            _listener = QueueListener(_handler.queue, stream, respect_handler_level=True)
+            _listener.start()
+        else:
+            _handler = stream
+
+        # Filters run on the emitting thread, before a record is queued
+        _handler.addFilter(RequestIdFilter())
+        rates = parse_sample_rates(os.getenv('LOG_SAMPLE_RATES', ''))
+        if rates:
+            _handler.addFilter(SamplingFilter(rates))
+
+        root = logging.getLogger()
+        root.addHandler(_handler)
+        root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+
+def reset_after_fork():
+    """Restart the listener in a forked worker.
+
+    The parent's listener thread does not survive fork, and its queue
+    may have been locked mid-operation, so the worker gets new ones.
+    """
+    global _listener
+    with _lock:
+        if _listener is None:
+            return
+        _handler.queue = queue.SimpleQueue()
+        _listener = QueueListener(_handler.queue, *_listener.handlers, respect_handler_level=True)
+        _listener.start()
+
+
+def shutdown_logging():
+    """Flush queued records and remove the handler"""
+    with _lock:
+        _remove_handler()
+
+
+def _remove_handler():
+    global _handler, _listener
+    if _listener is not None:
+        _listener.stop()  # Drains the queue first
+        _listener = None
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+
+
+atexit.register(shutdown_logging)
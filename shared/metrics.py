@@ -0,0 +1,359 @@
+import re
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from flask import Response, request
+from sqlalchemy import event
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; from sub-millisecond queries up to slow AudD.io round-trips
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Request ids are echoed into logs and headers, so keep them short and plain
+_VALID_REQUEST_ID = re.compile(r'^[A-Za-z0-9._-]{1,128}$')
+
+
+# --------------------------
+# Metric types
+# --------------------------
+
+class Metric:
+    """Base for labelled metrics rendered in the Prometheus text format"""
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self, service: Optional[str] = None) -> List[str]:
+        """Exposition lines, restricted to one service label when given"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            series = sorted(self._series().items())
+        for key, value in series:
+            labels = dict(zip(self.labelnames, key))
+            if service is None or labels.get('service') == service:
+                lines.extend(self._render_series(labels, value))
+        return lines
+
+    def _series(self) -> Dict:
+        raise NotImplementedError
+
+    def _render_series(self, labels: Dict[str, str], value) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    """Monotonic count per label set"""
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _series(self) -> Dict:
+        return dict(self._values)
+
+    def _render_series(self, labels, value):
+        return [f"{self.name}{_labels(labels)} {_number(value)}"]
+
+
+class Histogram(Metric):
+    """Cumulative-bucket histogram per label set"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (last is +Inf), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def count(self, **labels) -> int:
+        with self._lock:
+            series = self._values.get(self._key(labels))
+            return series[2] if series else 0
+
+    def _series(self) -> Dict:
+        return {key: (list(counts), total, n) for key, (counts, total, n) in self._values.items()}
+
+    def _render_series(self, labels, value):
+        counts, total, n = value
+        lines, cumulative = [], 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else _number(bound)
+            lines.append(f"{self.name}_bucket{_labels({**labels, 'le': le})} {cumulative}")
+        lines.append(f"{self.name}_sum{_labels(labels)} {_number(total)}")
+        lines.append(f"{self.name}_count{_labels(labels)} {n}")
+        return lines
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Registry:
+    """Process-wide set of metrics, created once by name"""
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str]) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str],
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self, service: Optional[str] = None) -> str:
+        """Every metric in the Prometheus text format, optionally for one service"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render(service))
+        return '\n'.join(lines) + '\n'
+
+    def _get_or_create(self, cls, name, documentation, labelnames, **options):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **options)
+            return metric
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.counter(
+    'shamzam_http_requests_total',
+    'Requests handled, by route and status',
+    ('service', 'method', 'endpoint', 'status')
+)
+REQUEST_SECONDS = REGISTRY.histogram(
+    'shamzam_http_request_duration_seconds',
+    'Time to handle a request',
+    ('service', 'method', 'endpoint')
+)
+STAGE_SECONDS = REGISTRY.histogram(
+    'shamzam_stage_duration_seconds',
+    'Time spent in each named stage of a request',
+    ('service', 'stage')
+)
+DB_QUERY_SECONDS = REGISTRY.histogram(
+    'shamzam_db_query_duration_seconds',
+    'Database statement execution time',
+    ('service', 'statement')
+)
+DB_QUERIES_PER_REQUEST = REGISTRY.histogram(
+    'shamzam_db_queries_per_request',
+    'Database statements executed per request',
+    ('service', 'endpoint'),
+    buckets=QUERY_COUNT_BUCKETS
+)
+OUTBOUND_SECONDS = REGISTRY.histogram(
+    'shamzam_outbound_request_duration_seconds',
+    'Time for outbound HTTP calls to other services',
+    ('service', 'host', 'method', 'status')
+)
+
+
+# --------------------------
+# Request scope
+# --------------------------
+
+@dataclass
+class RequestMetrics:
+    """Timings gathered while one request is handled"""
+    service: str
+    request_id: str
+    started: float = field(default_factory=time.perf_counter)
+    spans: List[Tuple[str, float]] = field(default_factory=list)
+    db_queries: int = 0
+    db_seconds: float = 0.0
+
+
+# Spans nested app contexts (e.g. the in-process catalogue client), so
+# work done on behalf of a request is attributed to it
+_current: ContextVar[Optional[RequestMetrics]] = ContextVar('request_metrics', default=None)
+
+
+def current_service() -> str:
+    state = _current.get()
+    return state.service if state else 'background'
+
+
+def current_request_id() -> Optional[str]:
+    state = _current.get()
+    return state.request_id if state else None
+
+
+def request_id_headers() -> Dict[str, str]:
+    """Headers carrying the current request id to another service"""
+    request_id = current_request_id()
+    return {REQUEST_ID_HEADER: request_id} if request_id else {}
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Time a stage of the current request.
+
+    Every stage is recorded in the stage histogram and listed in the
+    response's Server-Timing header.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        state = _current.get()
+        STAGE_SECONDS.observe(elapsed, service=current_service(), stage=stage)
+        if state is not None:
+            state.spans.append((stage, elapsed))
+
+
+def observe_outbound(host: str, method: str, status: str, seconds: float):
+    """Record an outbound HTTP call made by shared.http clients"""
+    OUTBOUND_SECONDS.observe(seconds, service=current_service(), host=host, method=method, status=status)
+
+
+# --------------------------
+# Flask integration
+# --------------------------
+
+def init_metrics(app, service: str, aggregate: bool = False):
+    """Time every request of app and serve the registry on /metrics.
+
+    Incoming X-Request-ID headers are kept (one is generated otherwise)
+    and echoed on the response. With aggregate, /metrics shows every
+    service in the process rather than just this one, as the gateway
+    does for the services mounted under it.
+    """
+    def start_request():
+        request_id = request.headers.get(REQUEST_ID_HEADER, '')
+        if not _VALID_REQUEST_ID.match(request_id):
+            request_id = uuid.uuid4().hex
+        request.environ['shamzam.metrics_token'] = _current.set(RequestMetrics(service, request_id))
+
+    def finish_request(response):
+        state = _current.get()
+        if state is None:
+            return response
+
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        elapsed = time.perf_counter() - state.started
+        REQUESTS.inc(service=service, method=request.method, endpoint=endpoint, status=response.status_code)
+        REQUEST_SECONDS.observe(elapsed, service=service, method=request.method, endpoint=endpoint)
+        DB_QUERIES_PER_REQUEST.observe(state.db_queries, service=service, endpoint=endpoint)
+
+        response.headers[REQUEST_ID_HEADER] = state.request_id
+        response.headers['Server-Timing'] = server_timing(state, elapsed)
+        return response
+
+    def end_request(exc):
+        token = request.environ.pop('shamzam.metrics_token', None)
+        if token is not None:
+            _current.reset(token)
+
+    def metrics():
+        return Response(REGISTRY.render(None if aggregate else service), content_type=CONTENT_TYPE)
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+    app.teardown_request(end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def server_timing(state: RequestMetrics, total: float) -> str:
+    """Server-Timing header value: per-stage totals, database time and the whole request"""
+    stages: Dict[str, float] = {}
+    for stage, seconds in state.spans:
+        stages[stage] = stages.get(stage, 0.0) + seconds
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in stages.items()]
+    entries.append(f'db;dur={state.db_seconds * 1000:.1f};desc="{state.db_queries} queries"')
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ', '.join(entries)
+
+
+# --------------------------
+# SQLAlchemy integration
+# --------------------------
+
+def instrument_engine(engine):
+    """Count and time every statement run on engine (idempotent)"""
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(engine, 'handle_error', _handle_error)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_query(conn, statement)
+
+
+def _handle_error(exception_context):
+    if exception_context.connection is not None:
+        _record_query(exception_context.connection, exception_context.statement or '')
+
+
+def _record_query(conn, statement: str):
+    started = conn.info.get('query_started')
+    if not started:
+        return
+    elapsed = time.perf_counter() - started.pop()
+    verb = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    DB_QUERY_SECONDS.observe(elapsed, service=current_service(), statement=verb)
+
+    state = _current.get()
+    if state is not None:
+        state.db_queries += 1
+        state.db_seconds += elapsed
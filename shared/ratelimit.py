@@ -0,0 +1,175 @@
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+from limits.storage import Storage
+
+# How stale a worker's view of a counter may get before it syncs
+DEFAULT_FLUSH_EVERY = 10       # Local hits per key...
+DEFAULT_FLUSH_INTERVAL = 0.25  # ...or seconds since the last sync
+PURGE_INTERVAL = 60            # Seconds between sweeps of expired windows
+
+
+class SQLiteStorage(Storage):
+    """Rate limit counters shared by every process through one SQLite file.
+
+    Registered with the limits library as the ``sqlite`` scheme, so it is
+    selected with a storage URI such as
+    ``sqlite:////var/lib/shamzam/ratelimit.db`` (four slashes for an
+    absolute path). Supports the fixed-window strategy.
+
+    Each process counts hits locally and syncs a key with a single
+    atomic upsert every flush_every hits or flush_interval seconds,
+    whichever comes first. Most requests therefore never touch the
+    database, at the cost of letting each worker overshoot a limit by at
+    most flush_every - 1 hits. A key's first hit and the first hit of a
+    new window always sync, so a fresh window starts from the shared
+    count. Requires SQLite 3.35+ (UPSERT ... RETURNING).
+    """
+
+    STORAGE_SCHEME = ['sqlite']
+
+    def __init__(self, uri: str, wrap_exceptions: bool = False,
+                 flush_every: int = DEFAULT_FLUSH_EVERY,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 **options):
+        self.path = uri.split('://', 1)[1][1:] or ':memory:'
+        self.flush_every = int(flush_every)
+        self.flush_interval = float(flush_interval)
+        self._lock = threading.Lock()
+        self._reset_local_state()
+        with self._connection() as connection:
+            connection.execute("""
+                CREATE TABLE IF NOT EXISTS rate_limits (
+                    key TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+            """)
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    # --------------------------
+    # limits Storage API
+    # --------------------------
+
+    def incr(self, key: str, expiry: float, amount: int = 1) -> int:
+        """Count a hit; returns the (approximate) count for the window"""
+        now = time.time()
+        with self._lock:
+            count, expires_at, synced_at = self._views.get(key, (0, 0.0, 0.0))
+            pending = self._pending.get(key, 0) + amount
+
+            # Window rolled over locally: start again from the shared count
+            if expires_at <= now:
+                count, pending, synced_at = 0, amount, 0.0
+
+            if pending < self.flush_every and now - synced_at < self.flush_interval:
+                self._pending[key] = pending
+                return count + pending
+
+            count, expires_at = self._flush(key, pending, expiry, now)
+            self._pending[key] = 0
+            self._views[key] = (count, expires_at, now)
+            self._maybe_purge(now)
+            return count
+
+    def get(self, key: str) -> int:
+        now = time.time()
+        with self._lock:
+            count, expires_at = self._view(key, now)
+            return count + self._pending.get(key, 0) if expires_at > now else 0
+
+    def get_expiry(self, key: str) -> float:
+        now = time.time()
+        with self._lock:
+            _, expires_at = self._view(key, now)
+            return expires_at if expires_at > now else now
+
+    def check(self) -> bool:
+        try:
+            self._connection().execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self) -> Optional[int]:
+        with self._lock, self._connection() as connection:
+            cleared = connection.execute("DELETE FROM rate_limits").rowcount
+            self._views.clear()
+            self._pending.clear()
+        return cleared
+
+    def clear(self, key: str) -> None:
+        with self._lock, self._connection() as connection:
+            connection.execute("DELETE FROM rate_limits WHERE key = ?", (key,))
+            self._views.pop(key, None)
+            self._pending.pop(key, None)
+
+    # --------------------------
+    # Process-local state
+    # --------------------------
+
+    def reset_after_fork(self):
+        """Drop counters and connections inherited from a parent process"""
+        self._lock = threading.Lock()
+        self._reset_local_state()
+
+    def _reset_local_state(self):
+        self._local = threading.local()
+        # key -> (shared count, window expiry, time of last sync)
+        self._views: Dict[str, Tuple[int, float, float]] = {}
+        # key -> hits counted here but not yet written
+        self._pending: Dict[str, int] = {}
+        self._purged_at = time.time()
+
+    def _view(self, key: str, now: float) -> Tuple[int, float]:
+        """Shared count and expiry, refreshed when older than flush_interval (lock held)"""
+        count, expires_at, synced_at = self._views.get(key, (0, 0.0, 0.0))
+        if now - synced_at >= self.flush_interval:
+            row = self._connection().execute(
+                "SELECT count, expires_at FROM rate_limits WHERE key = ?", (key,)
+            ).fetchone()
+            count, expires_at = row if row else (0, 0.0)
+            if expires_at <= now:
+                self._pending.pop(key, None)
+            self._views[key] = (count, expires_at, now)
+        return count, expires_at
+
+    # --------------------------
+    # SQLite
+    # --------------------------
+
+    def _connection(self) -> sqlite3.Connection:
+        """One connection per thread; WAL keeps readers off the writer's lock"""
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _flush(self, key: str, amount: int, expiry: float, now: float) -> Tuple[int, float]:
+        """Add local hits to the shared counter, starting a new window if
+        the stored one has expired, and return the updated (count, expiry)"""
+        with self._connection() as connection:
+            return connection.execute("""
+                INSERT INTO rate_limits (key, count, expires_at) VALUES (:key, :amount, :now + :expiry)
+                ON CONFLICT(key) DO UPDATE SET
+                    count = CASE WHEN expires_at <= :now THEN :amount ELSE count + :amount END,
+                    expires_at = CASE WHEN expires_at <= :now THEN :now + :expiry ELSE expires_at END
+                RETURNING count, expires_at
+            """, {'key': key, 'amount': amount, 'now': now, 'expiry': expiry}).fetchall()[0]
+
+    def _maybe_purge(self, now: float):
+        if now - self._purged_at < PURGE_INTERVAL:
+            return
+        self._purged_at = now
+        with self._connection() as connection:
+            connection.execute("DELETE FROM rate_limits WHERE expires_at <= ?", (now,))
+        self._views = {key: view for key, view in self._views.items() if view[1] > now}
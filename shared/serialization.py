@@ -0,0 +1,55 @@
+from typing import Any, Dict
+
+from flask import has_request_context, request
+from werkzeug.exceptions import BadRequest
+
+try:
+    import msgpack
+except ImportError:  # Optional: JSON only
+    msgpack = None
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPE = 'application/msgpack'
+
+
+def msgpack_available() -> bool:
+    return msgpack is not None
+
+
+def packb(obj: Any) -> bytes:
+    return msgpack.packb(obj, use_bin_type=True)
+
+
+def unpackb(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def wants_msgpack() -> bool:
+    """Whether the current request prefers a MessagePack response.
+
+    Only an explicit Accept preference counts; */* keeps JSON.
+    """
+    if msgpack is None or not has_request_context():
+        return False
+    best = request.accept_mimetypes.best_match([JSON_MIMETYPE, MSGPACK_MIMETYPE])
+    return best == MSGPACK_MIMETYPE
+
+
+def request_payload() -> Dict:
+    """Request body as a dict, from JSON or MessagePack by Content-Type.
+
+    Malformed or missing JSON gives an empty dict, leaving required
+    field checks to report what is missing.
+
+    Raises:
+        BadRequest: For MessagePack bodies that cannot be decoded
+    """
+    if request.mimetype != MSGPACK_MIMETYPE:
+        return request.get_json(silent=True) or {}
+    if msgpack is None:
+        raise BadRequest("MessagePack request bodies are not supported")
+    try:
+        payload = unpackb(request.get_data())
+    except (ValueError, msgpack.UnpackException) as e:
+        raise BadRequest(f"Invalid MessagePack body: {str(e)}")
+    return payload if isinstance(payload, dict) else {}
@@ -0,0 +1,9 @@
+from blinker import Namespace
+
+# In-process notifications between services mounted in the same gateway.
+# Receivers in a separately deployed service never see these; they rely on
+# the equivalent internal HTTP endpoints instead.
+_signals = Namespace()
+
+# Sent by the catalogue after a track is deleted, with track_id=<id>
+track_removed = _signals.signal('track-removed')